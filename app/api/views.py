@@ -1,11 +1,17 @@
-from flask import Blueprint, jsonify, abort, request
+import datetime
 
-from app.engine import elo
-from app.engine.generator import generate_game
+from flask import Blueprint, abort, request
+
+from app.config import config
+from app.engine import elo_queue, stats, users
+from app.engine.generator import generate_game, generate_games
+from app.engine.users import UserProfile
 from app.extensions import db
-from app.models import User, Task, TaskRun
+from app.models import Task, TaskRun
 from app.models.Task import TaskRunQuestion
-from app.serialization.Task import task_schema, tasks_schema, taskrun_schema
+from app.serialization.Task import task_schema, tasks_schema, encode_taskrun, encode_taskruns, load_taskrun, \
+    load_taskruns
+from app.serialization.encoding import json_response
 
 api = Blueprint('api', __name__, url_prefix='/api')
 
@@ -13,25 +19,34 @@ api = Blueprint('api', __name__, url_prefix='/api')
 def index():
     return "It works!"
 
-# param user
-@api.route("/start", methods=['GET'])
-def start():
-    global user
-    user = User.query.filter_by(uuid=request.args.get('user')).first()
-    if user is None:
-        user = User(uuid=request.args.get('user'))
-        db.session.add(user)
 
-    user.app_version = request.args.get('version')
-    user.language = request.args.get('language')
-    user.is_metric = request.args.get('metric')
+def update_user() -> UserProfile:
+    """
+    Gets or creates the user of the request and updates the profile of the user by the request parameters, the user
+    is written only when the profile changed. Aborts with 400 without the user parameter.
+    :return: id and profile of the user, not committed yet
+    """
+
+    uuid = request.args.get('user')
+    if uuid is None:
+        abort(400)
 
     if request.headers.getlist("X-Forwarded-For"):
-        user.ip_address = request.headers.getlist("X-Forwarded-For")[0]
+        ip_address = request.headers.getlist("X-Forwarded-For")[0]
     else:
-        user.ip_address = request.remote_addr
+        ip_address = request.remote_addr
 
-    db.session.commit()
+    return users.update_user_profile(uuid, {"app_version": request.args.get('version'),
+                                            "language": request.args.get('language'),
+                                            "is_metric": users.parse_boolean(request.args.get('metric')),
+                                            "ip_address": ip_address})
+
+
+def get_task() -> Task:
+    """
+    Finds the task of the request, aborts with 404 if it does not exist
+    :return: the task
+    """
 
     task_name = request.args.get('task')
 
@@ -45,9 +60,35 @@ def start():
     if task is None:
         abort(404)
 
-    taskrun = generate_game(task, user)
-    schema = taskrun_schema.dump(taskrun)
-    return jsonify(schema.data)
+    return task
+
+
+# param user
+@api.route("/start", methods=['GET'])
+def start():
+    user = update_user()
+    task = get_task()
+
+    taskrun = load_taskrun(generate_game(task, user).id)
+    return json_response(encode_taskrun(taskrun))
+
+
+# params as /start, count
+@api.route("/startBatch", methods=['GET'])
+def start_batch():
+    """
+    Generates the next count games of the user at once in one transaction, up to MAX_BATCH_GAMES
+    """
+
+    count = request.args.get('count', 1, type=int)
+    if count < 1 or count > config.MAX_BATCH_GAMES:
+        abort(400)
+
+    user = update_user()
+    task = get_task()
+
+    taskruns = load_taskruns([taskrun.id for taskrun in generate_games(task, user, count)])
+    return json_response(encode_taskruns(taskruns))
 
 
 # param id
@@ -55,9 +96,16 @@ def start():
 def update_task_run():
     data = request.json
 
-    db.session.query(TaskRun).filter(TaskRun.id == data["id"]).update({"completed": not data["aborted"], "summary": data.get("summary", None)})
+    db.session.query(TaskRun).filter(TaskRun.id == data["id"])\
+        .update({"completed": not data["aborted"], "summary": data.get("summary", None),
+                 "answer_date": datetime.datetime.utcnow()})
+
+    # questions answered already before this request (eg. when the request is resent)
+    answered_questions_ids = set(row.question_id for row in db.session.query(TaskRunQuestion.question_id)
+                                 .filter(TaskRunQuestion.taskrun_id == data["id"], TaskRunQuestion.correct != None))
 
     updated_questions_ids = []
+    new_answers_ids = set()
     for question in data["questions"]:
         res = db.session.query(TaskRunQuestion).filter(TaskRunQuestion.taskrun_id == data["id"])\
             .filter(TaskRunQuestion.question_id == question["id"])\
@@ -67,14 +115,21 @@ def update_task_run():
         # if question was updated, append the id to the list of updated questions
         if res == 1:
             updated_questions_ids.append(question["id"])
-
+            if question["correct"] is not None and question["id"] not in answered_questions_ids:
+                new_answers_ids.add(question["id"])
+
+    taskrun = TaskRun.query.get(data["id"])
+    if taskrun is None or len(updated_questions_ids) == 0:
+        db.session.commit()
+        return ""
+
+    # the model is updated by the worker, the answers are only queued, answers sent again are not
+    elo_queue.enqueue_answers(taskrun, [question_id for question_id in updated_questions_ids
+                                        if question_id in new_answers_ids])
+    stats.record_answers(taskrun, new_answers_ids)
     db.session.commit()
 
-    updated_questions = TaskRunQuestion.query\
-        .filter(TaskRunQuestion.taskrun_id == data["id"], TaskRunQuestion.question_id.in_(updated_questions_ids)).all()
-    for question in updated_questions:
-        elo.update(question)
-
-    db.session.commit()
+    if not config.ELO_UPDATE_QUEUE:
+        elo_queue.process_user(taskrun.user_id, wait=True)
 
     return ""
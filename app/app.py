@@ -7,6 +7,7 @@ from app import extensions
 from .api import api
 from .extensions import db, cache, compress
 from .config import DevelopmentConfig
+from .engine.utils import warm_caches
 
 # For import *
 __all__ = ['create_app']
@@ -30,6 +31,7 @@ def create_app(config, app_name='Math', blueprints=None):
     configure_app(app, config)
     configure_blueprints(app, blueprints)
     configure_extensions(app)
+    configure_hooks(app)
 
     return app
 
@@ -57,6 +59,12 @@ def configure_extensions(app):
     compress.init_app(app)
 
 
+def configure_hooks(app):
+    """Configure hooks run by the worker."""
+
+    app.before_first_request(warm_caches)
+
+
 def configure_blueprints(app, blueprints):
     """Configure blueprints in views."""
 
@@ -14,8 +14,37 @@ class Config(object):
     REFERENCE_CURRENCY = 'EUR'
     SYMBOLS_PER_REQUEST = 50
 
+    # units
+    UNIT_REGISTRY_SNAPSHOT = os.environ.get('UNIT_REGISTRY_SNAPSHOT', 'unit_registry.snapshot')
+    UNIT_FORMAT_CACHE_SIZE = 1024
+
+    # model updates
+    # answers are applied to the model by the worker (python run.py elo_worker), otherwise right in the request
+    ELO_UPDATE_QUEUE = os.environ.get('ELO_UPDATE_QUEUE', 'true') == 'true'
+    ELO_WORKER_POLL_INTERVAL = 1
+
+    # answer export (python run.py export_answers)
+    EXPORT_CHUNK_SIZE = 500000  # rows of an exported file
+    EXPORT_FETCH_SIZE = 10000  # rows fetched from the server-side cursor at once
+    # seconds after the last answers of a TaskRun after which they are exported, answers sent earlier may not be
+    # committed yet (TaskRuns answered again after the export are exported again)
+    EXPORT_SETTLE_TIME = 5 * 60
+
+    # API responses
+    # JSON library encoding the responses ("orjson", "ujson", "json"), "auto" takes the first installed one
+    JSON_BACKEND = os.environ.get('JSON_BACKEND', 'auto')
+    # responses smaller than COMPRESS_MIN_SIZE bytes are sent uncompressed by Flask-Compress, gzip level 1-9 trades
+    # CPU for size (compare the levels by python run.py bench_encoding)
+    COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 500))
+    COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', 6))
+
     # question generation
     QUESTIONS_PER_RUN = 10
+    # games generated at once by /api/startBatch
+    MAX_BATCH_GAMES = 10
+    # seconds after which a cached question pool is reloaded even without a change of the question bank, so that
+    # the difficulties updated by answers get to the question selection
+    QUESTION_POOL_MAX_AGE = 15 * 60
     TOLERANCE = "?"
 
 
@@ -0,0 +1,122 @@
+import threading
+import time
+from collections import namedtuple
+
+from sqlalchemy import text, sql
+from sqlalchemy.orm import with_polymorphic, subqueryload
+
+from app.config import config
+from app.engine.generator import QuestionPool
+from app.extensions import db
+from app.models import Task, Question
+from app.models.Question import QuestionTaskAssociation
+from app.serialization.Question import encode_static_question, encoded_questions, clear_rendered_questions
+
+# question pool of a task cached in the process together with the version of the question bank it was loaded from
+CachedPool = namedtuple('CachedPool', ['version', 'loaded_at', 'pool'])
+
+# cached question pools keyed by task id and unit system constraint
+_pools = {}
+_pools_version = None
+_pools_lock = threading.Lock()
+
+
+def get_bank_version() -> int:
+    """
+    Returns the current version of the question bank
+    :return: version of the question bank, 0 if it was never changed
+    :rtype: int
+    """
+
+    version = db.session.execute(text('SELECT max(version) FROM question_bank')).scalar()
+    return version or 0
+
+
+def bump_bank_version():
+    """
+    Marks the question bank as changed, processes reload their cached question pools on their next use. Needs to be
+    called after every change of questions, their answers or task associations (including toggling Question.enabled).
+    """
+
+    db.session.execute(text('INSERT INTO question_bank (id, version) VALUES (1, 1) '
+                            'ON CONFLICT (id) DO UPDATE SET version = question_bank.version + 1'))
+    db.session.commit()
+
+
+def load_task_pool(task: Task, unit_system: str) -> QuestionPool:
+    """
+    Loads enabled questions of the task including their answers, renders their static serialized parts and detaches
+    them from the session so that they can be shared between requests
+    :param task: task to load the questions of
+    :type task: Task
+    :param unit_system: unit system of the questions besides the universal ones ("metric" or "imperial"), same as
+    Task.questions_m and Task.questions_i
+    :type unit_system: str
+    :return: pool of the loaded questions
+    :rtype: QuestionPool
+    """
+
+    entity = with_polymorphic(Question, '*')
+    questions = db.session.query(entity)\
+        .join(QuestionTaskAssociation, QuestionTaskAssociation.question_id == entity.id)\
+        .filter(QuestionTaskAssociation.task_id == task.id,
+                entity.enabled != False,
+                sql.or_(QuestionTaskAssociation.unit_system_constraint == unit_system,
+                        QuestionTaskAssociation.unit_system_constraint == None))\
+        .options(subqueryload(entity.CloseEndedQuestion.answers), subqueryload(entity.SortQuestion.answers))\
+        .order_by(entity.id)\
+        .all()
+
+    for question in questions:
+        if question.id not in encoded_questions:
+            encoded_questions[question.id] = encode_static_question(question)
+
+    for question in questions:
+        for answer in getattr(question, 'answers', []):
+            db.session.expunge(answer)
+        db.session.expunge(question)
+
+    return QuestionPool(questions, task.identifier == "test")
+
+
+def get_task_pool(task: Task, unit_system: str) -> QuestionPool:
+    """
+    Returns the cached question pool of the task, the pool is reloaded when the question bank changed or the pool is
+    older than QUESTION_POOL_MAX_AGE
+    :param task: task to get the questions of
+    :type task: Task
+    :param unit_system: unit system of the questions besides the universal ones ("metric" or "imperial")
+    :type unit_system: str
+    :return: pool of the questions
+    :rtype: QuestionPool
+    """
+
+    global _pools_version
+
+    version = get_bank_version()
+    key = (task.id, unit_system)
+
+    with _pools_lock:
+        if version != _pools_version:
+            _pools.clear()
+            clear_rendered_questions()
+            _pools_version = version
+
+        cached = _pools.get(key)
+        if cached is None or time.time() - cached.loaded_at > config.QUESTION_POOL_MAX_AGE:
+            cached = CachedPool(version, time.time(), load_task_pool(task, unit_system))
+            _pools[key] = cached
+
+    return cached.pool
+
+
+def clear_task_pools():
+    """
+    Removes all cached question pools
+    """
+
+    global _pools_version
+
+    with _pools_lock:
+        _pools.clear()
+        _pools_version = None
@@ -1,17 +1,41 @@
+import hashlib
 import os
+import pickle
+import threading
+from collections import namedtuple
+from functools import lru_cache
 
 import inflection
+import numpy as np
 from flask import current_app
+import pint
 from pint import UnitRegistry, UndefinedUnitError
+from pint.util import UnitsContainer
 from app.engine import currency
 from app.config import config
 
 
-def register_exchange_rates(exchange_rates):
+CUSTOM_UNITS_PATH = os.path.join(os.path.dirname(__file__), 'config/custom_units.txt')
+CURRENCIES_PATH = os.path.join(os.path.dirname(__file__), 'currencies.tsv')
+
+# registry attributes stored in the snapshot, groups and systems are stored separately as they are bound to
+# the registry (contexts are not used by the app so they are not stored at all)
+SNAPSHOT_ATTRIBUTES = ('_defaults', '_dimensions', '_units', '_units_casei', '_prefixes', '_suffixes',
+                       '_dimensional_equivalents', '_root_units_cache', '_dimensionality_cache', '_base_units_cache',
+                       '_parse_unit_cache', '_default_system')
+SNAPSHOT_VERSION = 2
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def register_exchange_rates(ureg, exchange_rates):
     """
     Add currency definitions with exchange rates to unit registery.
     :return:
     :rtype:
+    :param ureg: unit registry to add the definitions to
+    :type ureg: UnitRegistry
     :param exchange_rates: mapping of currencies.
     :type exchange_rates: {symbol: rate}
     """
@@ -44,6 +68,267 @@ def register_exchange_rates(exchange_rates):
         ureg.define(definition)
 
 
+def build_registry(exchange_rates=None):
+    """
+    Builds unit registry from Pint definitions, currencies and custom units
+    :param exchange_rates: mapping of currencies, the current rates by default
+    :type exchange_rates: {symbol: rate}
+    :return: unit registry
+    :rtype: UnitRegistry
+    """
+
+    ureg = UnitRegistry()
+    register_exchange_rates(ureg, currency.get_currency_rates(config) if exchange_rates is None else exchange_rates)
+    ureg.load_definitions(CUSTOM_UNITS_PATH)
+    return ureg
+
+
+def definitions_fingerprint(exchange_rates):
+    """
+    Computes fingerprint of the definitions the registry is built from besides the Pint definitions (which are
+    identified by the Pint version), a snapshot with a different fingerprint is outdated
+    :param exchange_rates: mapping of currencies
+    :type exchange_rates: {symbol: rate}
+    :return: hex digest of custom units, the list of currencies and the exchange rates
+    :rtype: String
+    """
+
+    digest = hashlib.sha256()
+    for path in (CUSTOM_UNITS_PATH, CURRENCIES_PATH):
+        with open(path, 'rb') as file:
+            digest.update(file.read())
+    digest.update(repr(sorted(exchange_rates.items())).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def dump_registry_snapshot(ureg, path, fingerprint):
+    """
+    Stores unit registry to a snapshot file
+    :param ureg: unit registry to store
+    :type ureg: UnitRegistry
+    :param path: path of the snapshot file
+    :type path: String
+    :param fingerprint: fingerprint of the definitions of the registry (see definitions_fingerprint())
+    :type fingerprint: String
+    """
+
+    attributes = dict((name, getattr(ureg, name)) for name in SNAPSHOT_ATTRIBUTES)
+
+    # caches are partly keyed by ParserHelper which does not survive pickling, plain containers are equal to them
+    for name in ('_root_units_cache', '_dimensionality_cache'):
+        attributes[name] = dict((UnitsContainer(dict(key.items())), value) for key, value in attributes[name].items())
+
+    snapshot = {
+        "version": SNAPSHOT_VERSION,
+        "pint_version": pint.__version__,
+        "fingerprint": fingerprint,
+        "attributes": attributes,
+        "groups": dict((name, vars(group)) for name, group in ureg._groups.items()),
+        "systems": dict((name, vars(system)) for name, system in ureg._systems.items()),
+    }
+
+    # write to a temporary file first so workers never load a partially written snapshot
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        pickle.dump(snapshot, file, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def load_registry_snapshot(path, fingerprint):
+    """
+    Loads unit registry from a snapshot file created by dump_registry_snapshot()
+    :param path: path of the snapshot file
+    :type path: String
+    :param fingerprint: fingerprint of the current definitions (see definitions_fingerprint())
+    :type fingerprint: String
+    :return: unit registry or None if the snapshot is not compatible or its definitions changed since
+    :rtype: UnitRegistry
+    """
+
+    with open(path, 'rb') as file:
+        snapshot = pickle.load(file)
+
+    if snapshot.get("version") != SNAPSHOT_VERSION or snapshot.get("pint_version") != pint.__version__ or \
+            snapshot.get("fingerprint") != fingerprint:
+        return None
+
+    # empty registry, the definitions are restored from the snapshot
+    ureg = UnitRegistry(None)
+    for name, value in snapshot["attributes"].items():
+        setattr(ureg, name, value)
+
+    for name, state in snapshot["groups"].items():
+        vars(ureg.get_group(name)).update(state)
+    for name, state in snapshot["systems"].items():
+        vars(ureg.get_system(name)).update(state)
+
+    return ureg
+
+
+def load_registry():
+    """
+    Loads unit registry from the snapshot configured in UNIT_REGISTRY_SNAPSHOT if available and up to date, builds it
+    otherwise
+    :return: unit registry
+    :rtype: UnitRegistry
+    """
+
+    exchange_rates = currency.get_currency_rates(config)
+    path = config.UNIT_REGISTRY_SNAPSHOT
+    if path and os.path.isfile(path):
+        try:
+            ureg = load_registry_snapshot(path, definitions_fingerprint(exchange_rates))
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, KeyError):
+            ureg = None
+
+        if ureg is not None:
+            return ureg
+
+    return build_registry(exchange_rates)
+
+
+def get_registry():
+    """
+    Returns unit registry, it is loaded on the first use
+    :return: unit registry
+    :rtype: UnitRegistry
+    """
+
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = load_registry()
+
+    return _registry
+
+
+# Conversion between two units split into the same stages Pint applies in UnitRegistry._convert (offset unit to
+# reference, multiplicative factor, reference to offset unit), so the results are identical to the Pint path.
+# The offset stages are applied only for offset units (eg. degC, degF).
+Conversion = namedtuple('Conversion', ['src_scale', 'src_offset', 'factor', 'dst_scale', 'dst_offset', 'units'])
+
+_conversions = {}
+_base_conversions = {}
+
+
+def _resolve_conversion(src, dst):
+    """
+    Resolves conversion between two unit containers using the Pint registry
+    :param src: source units
+    :type src: pint.util.UnitsContainer
+    :param dst: destination units
+    :type dst: pint.util.UnitsContainer
+    :return: resolved conversion
+    :rtype: Conversion
+    """
+
+    if src == dst:
+        return Conversion(1, 0, 1, 1, 0, dst)
+
+    ureg = get_registry()
+
+    # let Pint validate the conversion (raises DimensionalityError for incompatible units)
+    ureg.convert(1, src, dst)
+
+    src_offset_units = [u for u in src if not ureg._units[u].is_multiplicative]
+    dst_offset_units = [u for u in dst if not ureg._units[u].is_multiplicative]
+
+    src_scale, src_offset = 1, 0
+    if src_offset_units:
+        converter = ureg._units[src_offset_units[0]].converter
+        src_scale, src_offset = converter.scale, converter.offset
+
+    dst_scale, dst_offset = 1, 0
+    if dst_offset_units:
+        converter = ureg._units[dst_offset_units[0]].converter
+        dst_scale, dst_offset = converter.scale, converter.offset
+
+    factor, _ = ureg._get_root_units(src.remove(src_offset_units) / dst.remove(dst_offset_units))
+
+    return Conversion(src_scale, src_offset, factor, dst_scale, dst_offset, dst)
+
+
+def get_conversion(quantity_from, quantity_to):
+    """
+    Returns cached conversion between two units, resolving it on the first use
+    :param quantity_from: quantity identifier (eg. 'm' for meters)
+    :type quantity_from: String
+    :param quantity_to: output quantity identifier (eg. 'cm' for centimetres)
+    :type quantity_to: String
+    :return: conversion from quantity_from to quantity_to
+    :rtype: Conversion
+    """
+
+    key = (quantity_from, quantity_to)
+    conversion = _conversions.get(key)
+    if conversion is None:
+        ureg = get_registry()
+        conversion = _resolve_conversion(ureg.parse_units(quantity_from)._units, ureg.parse_units(quantity_to)._units)
+        _conversions[key] = conversion
+
+    return conversion
+
+
+def get_base_conversion(quantity_from):
+    """
+    Returns cached conversion of the unit to its base unit, resolving it on the first use
+    :param quantity_from: quantity identifier (eg. 'cm' for centimeters)
+    :type quantity_from: String
+    :return: conversion from quantity_from to its base unit
+    :rtype: Conversion
+    """
+
+    conversion = _base_conversions.get(quantity_from)
+    if conversion is None:
+        ureg = get_registry()
+        src = ureg.parse_units(quantity_from)._units
+        _, dst = ureg._get_base_units(src)
+        conversion = _resolve_conversion(src, dst)
+        _base_conversions[quantity_from] = conversion
+
+    return conversion
+
+
+def apply_conversion(conversion, value):
+    """
+    Applies conversion to the value
+    :param conversion: conversion to apply
+    :type conversion: Conversion
+    :param value: amount (eg. 5)
+    :type value: Number
+    :return: converted amount (not rounded)
+    :rtype: Number
+    """
+
+    if conversion.src_offset:
+        value = value * conversion.src_scale + conversion.src_offset
+
+    value = value * conversion.factor
+
+    if conversion.dst_offset:
+        value = (value - conversion.dst_offset) / conversion.dst_scale
+
+    return value
+
+
+def convert_value(quantity_from, value_from, quantity_to):
+    """
+    Converts the amount between units, same as convert() but without wrapping the result in Pint.Quantity
+    :param quantity_from: quantity identifier (eg. 'm' for meters)
+    :type quantity_from: String
+    :param value_from: amount (eg. 5)
+    :type value_from: Number
+    :param quantity_to: output quantity identifier (eg. 'cm' for centimetres)
+    :type quantity_to: String
+    :return: converted amount rounded to 3 decimal places (eg. 500)
+    :rtype: Number
+    """
+
+    value = apply_conversion(get_conversion(quantity_from, quantity_to), value_from)
+    return round(value, 3) + 0  # workaround to prevent having negative zero
+
+
 def convert(quantity_from, value_from, quantity_to):
     """
     :param quantity_from: quantity identifier (eg. 'm' for meters)
@@ -56,6 +341,127 @@ def convert(quantity_from, value_from, quantity_to):
     :rtype: Pint.Quantity
     """
 
+    units = get_conversion(quantity_from, quantity_to).units
+    return get_registry().Quantity(convert_value(quantity_from, value_from, quantity_to), units)
+
+
+def _round_many(values):
+    """
+    Rounds the amounts to 3 decimal places the same way as built-in round() does
+    :param values: amounts
+    :type values: numpy.ndarray
+    :return: rounded amounts
+    :rtype: numpy.ndarray
+    """
+
+    rounded = np.round(values, 3)
+
+    # numpy rounds the scaled value (x * 1000) which may differ from correctly rounded built-in round() when the
+    # amount is (almost) exactly in the middle, so such amounts are rounded one by one
+    scaled = values * 1000
+    fraction = np.abs(scaled - np.trunc(scaled))
+    ambiguous = np.abs(fraction - 0.5) <= np.maximum(np.abs(scaled), 1) * 1e-12
+    for i in np.flatnonzero(ambiguous):
+        rounded[i] = round(float(values[i]), 3)
+
+    return rounded
+
+
+def _apply_conversions(conversions, codes, values):
+    """
+    Applies conversions to the amounts
+    :param conversions: distinct conversions
+    :type conversions: [Conversion]
+    :param codes: index to conversions for each amount
+    :type codes: numpy.ndarray
+    :param values: amounts
+    :type values: numpy.ndarray
+    :return: converted amounts (not rounded)
+    :rtype: numpy.ndarray
+    """
+
+    src_scale, src_offset, factor, dst_scale, dst_offset = \
+        (np.array(column, dtype=float)[codes] for column in list(zip(*conversions))[:5])
+
+    values = np.where(src_offset != 0, values * src_scale + src_offset, values)
+    values = values * factor
+    return np.where(dst_offset != 0, (values - dst_offset) / dst_scale, values)
+
+
+def _factorize(keys):
+    """
+    Groups equal keys
+    :param keys: keys to group (eg. unit pairs)
+    :type keys: iterable
+    :return: distinct keys and index to them for each key
+    :rtype: ([object], numpy.ndarray)
+    """
+
+    index = {}
+    codes = np.fromiter((index.setdefault(key, len(index)) for key in keys), dtype=np.intp)
+    return list(index), codes
+
+
+def convert_many(from_units, values, to_units):
+    """
+    Converts columns of amounts at once, the result is the same as calling convert_value() for each row
+    :param from_units: quantity identifiers (eg. ['m', 'km'])
+    :type from_units: [String]
+    :param values: amounts (eg. [5, 2])
+    :type values: [Number]
+    :param to_units: output quantity identifiers (eg. ['cm', 'm'])
+    :type to_units: [String]
+    :return: converted amounts rounded to 3 decimal places (eg. [500, 2000])
+    :rtype: numpy.ndarray
+    """
+
+    values = np.asarray(values, dtype=float)
+    if not len(from_units) == len(to_units) == len(values):
+        raise ValueError("Units and values must have the same length.")
+    if len(values) == 0:
+        return values
+
+    pairs, codes = _factorize(zip(from_units, to_units))
+    conversions = [get_conversion(quantity_from, quantity_to) for quantity_from, quantity_to in pairs]
+    return _round_many(_apply_conversions(conversions, codes, values)) + 0  # workaround to prevent having negative zero
+
+
+def to_normalized_many(from_units, values):
+    """
+    Normalizes columns of amounts at once, the result is the same as calling to_normalized() for each row
+    :param from_units: quantity identifiers (eg. ['m', 'km'])
+    :type from_units: [String]
+    :param values: amounts (eg. [5, 2])
+    :type values: [Number]
+    :return: normalized amounts
+    :rtype: numpy.ndarray
+    """
+
+    values = np.asarray(values, dtype=float)
+    if len(from_units) != len(values):
+        raise ValueError("Units and values must have the same length.")
+    if len(values) == 0:
+        return values
+
+    units, codes = _factorize(from_units)
+    conversions = [get_base_conversion(quantity_from) for quantity_from in units]
+    return _apply_conversions(conversions, codes, values)
+
+
+def convert_pint(quantity_from, value_from, quantity_to):
+    """
+    Same as convert() but doing the whole conversion in Pint, kept as a reference for benchmarks
+    :param quantity_from: quantity identifier (eg. 'm' for meters)
+    :type quantity_from: String
+    :param value_from: amount (eg. 5)
+    :type value_from: Number
+    :param quantity_to: output quantity identifier (eg. 'cm' for centimetres)
+    :type quantity_to: String
+    :return: quantity object with converted value (eg. containing 500 cm)
+    :rtype: Pint.Quantity
+    """
+
+    ureg = get_registry()
     from_q = ureg.Quantity(value_from, quantity_from)
     to_q = ureg.Quantity(1, quantity_to)
     to = from_q.to(to_q)
@@ -75,8 +481,7 @@ def to_normalized(quantity_from, value_from):
     :rtype: Number
     """
 
-    from_q = ureg.Quantity(value_from, quantity_from)
-    return from_q.to_base_units().magnitude
+    return apply_conversion(get_base_conversion(quantity_from), value_from)
 
 
 # formatters
@@ -93,6 +498,13 @@ def format_number(number):
     return "{0:.3f}".format(number).rstrip('0').rstrip('.')
 
 
+# display names of units which are not formatted well by Pint
+UNIT_OUTPUTS = {"degC": "°C", "degF": "°F", "yd2": "square yard", "mi2": "square mile", "ft2": "square foot",
+                "in2": "square inch", "cm2": "square centimeter", "dm2": "square decimeter", "m2": "square meter",
+                "km2": "square kilometer", "fp": "football pitch", "tc": "tennis court", "et": "Eiffel Tower",
+                "esb": "Empire State Building", "bb": "Big Ben", "US_ton": "US ton", "metric_ton": "metric tonne"}
+
+
 def format_quantity_unit(unit, plural=False):
     """
     Format unit to printable string (eg. "meter")
@@ -104,12 +516,7 @@ def format_quantity_unit(unit, plural=False):
     :rtype: String
     """
 
-    outputs = {"degC": "°C", "degF": "°F", "yd2": "square yard", "mi2": "square mile", "ft2": "square foot",
-               "in2": "square inch", "cm2": "square centimeter", "dm2": "square decimeter", "m2": "square meter",
-               "km2": "square kilometer", "fp": "football pitch", "tc": "tennis court", "et": "Eiffel Tower",
-               "esb": "Empire State Building", "bb": "Big Ben", "US_ton": "US ton", "metric_ton": "metric tonne"}
-
-    unit_string = outputs.get('{:C}'.format(unit), '{:P}'.format(unit))
+    unit_string = UNIT_OUTPUTS.get('{:C}'.format(unit), '{:P}'.format(unit))
     if plural and unit != "degC" and unit != "degF" and "[currency]" not in list(unit.dimensionality):
         if unit_string == "foot":
           unit_string = "feet"
@@ -119,17 +526,69 @@ def format_quantity_unit(unit, plural=False):
     return unit_string
 
 
-def format_unit(unit):
+@lru_cache(maxsize=config.UNIT_FORMAT_CACHE_SIZE)
+def _format_unit_cached(unit, plural):
+    """
+    Formats unit to printable string, the results are cached
+    :param unit: unit identifier (eg. 'm' for meters) or units of a quantity
+    :type unit: String or pint.util.UnitsContainer
+    :param plural:
+    :type plural: Boolean
+    :return: formated quantity string (eg. "meter")
+    :rtype: String
+    """
+
+    if isinstance(unit, str):
+        return format_quantity_unit(get_registry().parse_units(unit), plural)
+    else:
+        return format_quantity_unit(get_registry().Unit(unit), plural)
+
+
+def format_cache_info():
+    """
+    Returns statistics of the unit format cache
+    :return: hits, misses, maximal and current size of the cache
+    :rtype: functools._CacheInfo
+    """
+
+    return _format_unit_cached.cache_info()
+
+
+def warm_format_cache(units):
+    """
+    Fills the unit format cache with the provided units, units which can not be parsed or formatted are skipped
+    :param units: unit identifiers (eg. ['m', 'cm'])
+    :type units: [String]
+    :return: skipped units with the errors raised by them
+    :rtype: [(String, Exception)]
+    """
+
+    failed = []
+    for unit in units:
+        # Pint raises various errors for malformed units, a single bad unit must not stop the others from warming
+        try:
+            units_container = get_registry().parse_units(unit)._units
+            for plural in (False, True):
+                _format_unit_cached(unit, plural)
+                _format_unit_cached(units_container, plural)
+        except Exception as e:
+            failed.append((unit, e))
+
+    return failed
+
+
+def format_unit(unit, plural=False):
     """
     Format unit to printable string (eg. "meter")
     :param unit: unit identifier (eg. 'm' for meters)
     :type unit: String
+    :param plural:
+    :type plural: Boolean
     :return: formated quantity string (eg. "meter")
     :rtype: String
     """
 
-    q = ureg.parse_units(unit)
-    return format_quantity_unit(q)
+    return _format_unit_cached(unit, bool(plural))
 
 
 def format_quantity(quantity):
@@ -141,7 +600,8 @@ def format_quantity(quantity):
     :rtype: String
     """
 
-    return "{0} {1}".format(format_number(quantity.magnitude), format_quantity_unit(quantity.units, quantity.magnitude > 1))
+    magnitude = quantity.magnitude
+    return "{0} {1}".format(format_number(magnitude), _format_unit_cached(quantity._units, bool(magnitude > 1)))
 
 
 def format_value(unit_from, value_from):
@@ -155,10 +615,4 @@ def format_value(unit_from, value_from):
     :rtype: String
     """
 
-    return format_quantity(ureg.Quantity(value_from, unit_from))
-
-
-ureg = UnitRegistry()
-rates = currency.get_currency_rates(config)
-register_exchange_rates(rates)
-ureg.load_definitions(os.path.join(os.path.dirname(__file__), 'config/custom_units.txt'))
+    return "{0} {1}".format(format_number(value_from), format_unit(unit_from, value_from > 1))
@@ -1,8 +1,18 @@
 import math
+import numpy as np
+from typing import Iterable, List, Set
 
+from app.engine.history import add_history_row
 from app.extensions import db
-from app.models import QuestionHistory
-from app.models.Task import TaskRunQuestion
+from app.models import Question, QuestionHistory
+from app.models.Skill import UserSkill, UserSkillHistory
+from app.models.Task import TaskRunQuestion, TaskRun
+
+# parameters of the model, the functions computing deltas accept other values for replays (see app.engine.replay)
+K_SUCCESS = 3.4
+K_FAILURE = 0.4
+ALPHA = 1.0
+BETA = 0.06
 
 
 def compute_expected_response(user_skill: float, difficulty: float, response_time: float = 1) -> float:
@@ -10,6 +20,11 @@ def compute_expected_response(user_skill: float, difficulty: float, response_tim
     return 1. / (1 + math.exp(difficulty - math.log(response_time) - user_skill))
 
 
+def compute_expected_responses(user_skill: float, difficulties: np.ndarray) -> np.ndarray:
+    # same as compute_expected_response() for an array of difficulties
+    return 1. / (1 + np.exp(difficulties - user_skill))
+
+
 def compute_expected_response_time(user_speed: float, question_speed) -> float:
     if user_speed == 0:
         return 1
@@ -17,23 +32,20 @@ def compute_expected_response_time(user_speed: float, question_speed) -> float:
         return math.exp(question_speed - user_speed)
 
 
-def compute_user_skill_delta(response: float, expected_response: float) -> float:
-    K_SUCCESS = 3.4
-    K_FAILURE = 0.4
-
+def compute_user_skill_delta(response: float, expected_response: float, k_success: float = K_SUCCESS,
+                             k_failure: float = K_FAILURE) -> float:
     if response >= expected_response:
-        delta = K_SUCCESS * (response - expected_response)
+        delta = k_success * (response - expected_response)
     else:
-        delta = K_FAILURE * (response - expected_response)
+        delta = k_failure * (response - expected_response)
 
     return delta
 
 
-def compute_difficulty_delta(response: float, expected_response: float, first_attempts_count: float) -> float:
-    ALPHA = 1.0
-    BETA = 0.06
+def compute_difficulty_delta(response: float, expected_response: float, first_attempts_count: float,
+                             alpha: float = ALPHA, beta: float = BETA) -> float:
     # each question has initial difficulty which is treated as a regular rank, so we do not lower first_attempts_count by one
-    K = ALPHA / (1 + BETA * first_attempts_count)
+    K = alpha / (1 + beta * first_attempts_count)
 
     delta = K * (expected_response - response)  # = K * ((1 - response) - (1 - expected_response))
     return delta
@@ -43,46 +55,156 @@ def compute_target_time_delta(response_time: float, target_time: float, attempts
     return (math.log(response_time) - target_time) / attempts_count
 
 
+def fetch_first_attempts(question_runs: List[TaskRunQuestion]) -> Set[int]:
+    """
+    Fetches ids of questions which the user of the TaskRun answered for the first time, answers in later TaskRuns
+    are not taken into account as they may be already stored when the answers are applied from the queue
+    :param question_runs: answered questions of a single TaskRun
+    :return: set of question ids
+    """
+
+    taskrun = question_runs[0].taskrun
+    question_ids = [question_run.question_id for question_run in question_runs]
+
+    answered_before_rows = db.session.query(TaskRunQuestion.question_id).distinct() \
+        .join(TaskRun, TaskRunQuestion.taskrun_id == TaskRun.id) \
+        .filter(TaskRunQuestion.taskrun_id < taskrun.id,
+                TaskRunQuestion.question_id.in_(question_ids),
+                TaskRun.user_id == taskrun.user_id,
+                TaskRunQuestion.correct != None)
+
+    answered_before = set(row.question_id for row in answered_before_rows)
+    return set(question_id for question_id in question_ids if question_id not in answered_before)
+
+
+def lock_questions(question_ids: Iterable[int]) -> List[Question]:
+    """
+    Locks rows of the questions until the end of the transaction and reloads their ratings, so that concurrent updates
+    of the same question are applied one after another instead of overwriting each other. The rows are locked in
+    the order of ids, so transactions locking overlapping questions can not deadlock.
+    :param question_ids: ids of questions to lock
+    :return: locked questions
+    """
+
+    question_ids = sorted(set(question_ids))
+    if len(question_ids) == 0:
+        return []
+
+    return Question.query\
+        .filter(Question.id.in_(question_ids))\
+        .order_by(Question.id)\
+        .with_for_update()\
+        .populate_existing()\
+        .all()
+
+
 def update(question_run: TaskRunQuestion):
     """
     Updates model with the provided TaskRunQuestion
     :param question_run: question to update
     """
 
+    update_many([question_run])
+
+
+def update_many(question_runs: List[TaskRunQuestion], new_answers: Set[int] = frozenset()):
+    """
+    Updates model with the provided TaskRunQuestions of a single TaskRun. Statistics needed for the update are fetched
+    for all questions at once, so the number of queries does not depend on the number of questions. The questions are
+    locked until the end of the transaction (see lock_questions()), the skills of the user are expected to be updated
+    by a single process at a time (see app.engine.elo_queue).
+    :param question_runs: questions to update
+    :param new_answers: ids of questions answered by this update, their answer counters are incremented
+    """
+
+    if len(question_runs) == 0:
+        return
+
+    lock_questions([question_run.question_id for question_run in question_runs])
+    first_attempts = fetch_first_attempts(question_runs)
+    user_skill = question_runs[0].taskrun.corresponding_skill()
+
+    for question_run in question_runs:
+        is_users_first_attempt = question_run.question_id in first_attempts
+
+        if question_run.question_id in new_answers:
+            record_answer(question_run.question, is_users_first_attempt)
+
+        if not has_response_time(question_run):
+            # counted as an answer, but the model can not be updated without the response time (log of the time)
+            continue
+
+        apply_update(question_run, user_skill, is_users_first_attempt, question_run.question.answered_count,
+                     question_run.question.answered_users_count)
+
+
+def has_response_time(question_run: TaskRunQuestion) -> bool:
+    """
+    :param question_run: answered question
+    :return: whether the answer has a positive response time, answers without it are skipped by the model updates
+    (same as by the replay, see app.engine.replay.AnswerLog.append())
+    """
+
+    return question_run.time is not None and question_run.time > 0
+
+
+def record_answer(question: Question, is_users_first_attempt: bool):
+    """
+    Increments answer counters of the question
+    :param question: answered question
+    :param is_users_first_attempt: whether the user answered the question for the first time
+    """
+
+    question.answered_count += 1
+    if is_users_first_attempt:
+        question.answered_users_count += 1
+
+
+def apply_update(question_run: TaskRunQuestion, user_skill: UserSkill, is_users_first_attempt: bool,
+                 answered_times: int, answered_first_time_times: int):
+    """
+    Updates model with the provided TaskRunQuestion using prefetched statistics
+    :param question_run: question to update
+    :param user_skill: skill of the user for the task of the question
+    :param is_users_first_attempt: whether the user answered the question for the first time
+    :param answered_times: number of answers of the question
+    :param answered_first_time_times: number of distinct users who answered the question
+    """
+
+    question = question_run.question
+    user = question_run.taskrun.user
+
     # update target time
-    if question_run.is_users_first_attempt:
+    if is_users_first_attempt:
         # update only on first attempt, otherwase it may be influenced by learning
-        question_run.question.target_time += compute_target_time_delta(question_run.time,
-                                                                       question_run.question.target_time,
-                                                                       question_run.question.answered_times())
+        question.target_time += compute_target_time_delta(question_run.time, question.target_time, answered_times)
 
     # update skills
     response = question_run.get_score()
-    user_skill = question_run.taskrun.corresponding_skill()
 
     # task skill
-    expected_response = compute_expected_response(user_skill.value, question_run.question.difficulty, question_run.time)
+    expected_response = compute_expected_response(user_skill.value, question.difficulty, question_run.time)
     user_skill_delta = compute_user_skill_delta(response, expected_response)
     user_skill.value += user_skill_delta
     print("respose:", response, "expected response:", expected_response, "skill delta:", user_skill_delta)
 
+    # the trajectory of the skill keeps a row per answer, the rows are written by one INSERT at the commit
+    add_history_row(db.session(), UserSkillHistory.__table__, task_id=user_skill.task_id, user_id=user_skill.user_id,
+                    value=user_skill.value)
+
     # user speed
     user_speed_delta = compute_target_time_delta(question_run.time, user_skill.speed, 1)
     user_skill.speed += user_speed_delta
 
     # global user skill
-    expected_response_global = compute_expected_response(question_run.taskrun.user.skill_value, question_run.question.difficulty, question_run.time)
+    expected_response_global = compute_expected_response(user.skill_value, question.difficulty, question_run.time)
     user_skill_delta_global = compute_user_skill_delta(response, expected_response_global)
-    question_run.taskrun.user.skill_value += user_skill_delta_global
+    user.skill_value += user_skill_delta_global
 
     # update question difficuilty
-    if question_run.is_users_first_attempt:
+    if is_users_first_attempt:
         # update only on first attempt, otherwase it may be influenced by learning
-        question_run.question.difficulty += compute_difficulty_delta(response,
-                                                                     expected_response,
-                                                                     question_run.question.answered_first_time_times())
-
-    if question_run.is_users_first_attempt:
-        history = QuestionHistory(question_id=question_run.question.id, target_time=question_run.question.target_time, difficulty=question_run.question.difficulty)
-        db.session.add(history)
+        question.difficulty += compute_difficulty_delta(response, expected_response, answered_first_time_times)
 
+        add_history_row(db.session(), QuestionHistory.__table__, question_id=question.id,
+                        target_time=question.target_time, difficulty=question.difficulty)
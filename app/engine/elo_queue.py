@@ -0,0 +1,178 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import Iterable, List
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import joinedload
+
+from app.config import config
+from app.engine import elo
+from app.extensions import db
+from app.models import TaskRun, EloUpdate
+from app.models.Task import TaskRunQuestion
+
+# class of the advisory locks held while the answers of an user are applied (second key is the user id)
+USER_LOCK_CLASS = 7001
+
+# errors after which the answers are retried as they are, eg. lost connection or a deadlock
+TRANSIENT_ERRORS = (OperationalError,)
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_answers(taskrun: TaskRun, question_ids: Iterable[int]):
+    """
+    Appends new answers of the TaskRun to the queue of model updates, committed together with the answers. Only stored
+    answers (TaskRunQuestion.correct is set) are queued and each of them at most once, so an answer sent again does not
+    update the model twice.
+    :param taskrun: answered TaskRun
+    :param question_ids: ids of the questions answered for the first time in the TaskRun, in the order of the update
+    """
+
+    params = [{"user_id": taskrun.user_id, "taskrun_id": taskrun.id, "question_id": question_id}
+              for question_id in question_ids]
+    if len(params) == 0:
+        return
+
+    db.session.execute(text('INSERT INTO elo_update_queue (user_id, taskrun_id, question_id) '
+                            'SELECT :user_id, taskrun_id, question_id FROM taskrun_question '
+                            'WHERE taskrun_id = :taskrun_id AND question_id = :question_id AND correct IS NOT NULL '
+                            'ON CONFLICT (taskrun_id, question_id) DO NOTHING'),
+                       params)
+
+
+def process_user(user_id: int, wait: bool = False) -> int:
+    """
+    Applies all queued answers of the user in the order they were queued. The updates and the removal of the answers
+    from the queue are committed in one transaction, and the answers of an user are applied by a single process at
+    a time (advisory lock), so every answer is applied exactly once. Answers of a TaskRun which can not be applied
+    (other than by a transient database error) are set aside with the error, so they do not block later answers.
+    :param user_id: user to apply answers of
+    :param wait: whether to wait for the process applying the answers of the user, otherwise the answers are left to it
+    :return: number of applied answers, 0 if the answers are being applied by another process
+    """
+
+    if wait:
+        db.session.execute(text('SELECT pg_advisory_xact_lock(:lock_class, :user_id)'),
+                           {"lock_class": USER_LOCK_CLASS, "user_id": user_id or 0})
+    else:
+        locked = db.session.execute(text('SELECT pg_try_advisory_xact_lock(:lock_class, :user_id)'),
+                                    {"lock_class": USER_LOCK_CLASS, "user_id": user_id or 0}).scalar()
+        if not locked:
+            db.session.rollback()
+            return 0
+
+    # the answers stay locked until they are removed, the queue is locked by app.engine.replay.write_result() while
+    # the model is replaced
+    events = EloUpdate.query\
+        .filter(EloUpdate.user_id == user_id, EloUpdate.error == None)\
+        .order_by(EloUpdate.id)\
+        .with_for_update()\
+        .all()
+
+    # all questions are locked at once in the order of ids, locking them TaskRun by TaskRun could deadlock with
+    # another process
+    elo.lock_questions(event.question_id for event in events)
+
+    # answers of a TaskRun are applied at once, TaskRuns in the order of their first queued answer
+    taskruns = OrderedDict()
+    for event in events:
+        taskruns.setdefault(event.taskrun_id, []).append(event.question_id)
+
+    taskrun_id = None
+    try:
+        for taskrun_id, question_ids in taskruns.items():
+            apply_taskrun(taskrun_id, question_ids)
+    except TRANSIENT_ERRORS:
+        raise
+    except Exception as e:
+        db.session.rollback()
+        logger.exception("answers of TaskRun %s of user %s can not be applied, they are set aside", taskrun_id, user_id)
+        set_aside(user_id, taskrun_id, repr(e))
+        return 0
+
+    if len(events) > 0:
+        EloUpdate.query.filter(EloUpdate.id.in_([event.id for event in events])).delete(synchronize_session=False)
+
+    db.session.commit()
+    return len(events)
+
+
+def apply_taskrun(taskrun_id: int, question_ids: List[int]):
+    """
+    Applies queued answers of the TaskRun, all of them are answered for the first time
+    :param taskrun_id: answered TaskRun
+    :param question_ids: ids of the answered questions in the order they were queued
+    """
+
+    question_runs = dict((question_run.question_id, question_run) for question_run in TaskRunQuestion.query
+                         .options(joinedload(TaskRunQuestion.taskrun).joinedload(TaskRun.user),
+                                  joinedload(TaskRunQuestion.question))
+                         .filter(TaskRunQuestion.taskrun_id == taskrun_id,
+                                 TaskRunQuestion.question_id.in_(question_ids)))
+
+    elo.update_many([question_runs[question_id] for question_id in question_ids if question_id in question_runs],
+                    set(question_ids))
+
+
+def set_aside(user_id: int, taskrun_id: int, error: str):
+    """
+    Marks queued answers of the TaskRun as failed, they stay in the queue for inspection and are skipped by the worker
+    until retried (see retry_failed())
+    :param user_id: user of the TaskRun
+    :param taskrun_id: TaskRun with the answers
+    :param error: description of the error
+    """
+
+    db.session.execute(text('UPDATE elo_update_queue SET error = :error '
+                            'WHERE user_id = :user_id AND taskrun_id = :taskrun_id AND error IS NULL'),
+                       {"user_id": user_id, "taskrun_id": taskrun_id, "error": error})
+    db.session.commit()
+
+
+def retry_failed() -> int:
+    """
+    Returns the answers set aside back to the queue, eg. after the cause of their failure was fixed
+    :return: number of returned answers
+    """
+
+    count = db.session.execute(text('UPDATE elo_update_queue SET error = NULL WHERE error IS NOT NULL')).rowcount
+    db.session.commit()
+    return count
+
+
+def process_pending(limit: int = 100) -> int:
+    """
+    Applies queued answers of users with the oldest queued answers
+    :param limit: maximal number of users to process
+    :return: number of applied answers
+    """
+
+    user_ids = [row.user_id for row in db.session.execute(
+        text('SELECT user_id FROM elo_update_queue WHERE error IS NULL GROUP BY user_id ORDER BY min(id) '
+             'LIMIT :limit'),
+        {"limit": limit})]
+    db.session.rollback()
+
+    processed = 0
+    for user_id in user_ids:
+        try:
+            processed += process_user(user_id)
+        except Exception:
+            # the answers stay in the queue and are retried in the next round, the worker keeps running
+            db.session.rollback()
+            logger.exception("applying answers of user %s failed", user_id)
+
+    return processed
+
+
+def run_worker():
+    """
+    Applies queued answers until interrupted, polls the queue every ELO_WORKER_POLL_INTERVAL seconds when it is empty
+    """
+
+    while True:
+        if process_pending() == 0:
+            time.sleep(config.ELO_WORKER_POLL_INTERVAL)
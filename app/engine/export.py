@@ -0,0 +1,228 @@
+import datetime
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+from sqlalchemy import text
+
+from app.config import config
+from app.extensions import db
+
+# name of the file in the export directory with the watermark and the list of exported chunks
+MANIFEST_NAME = 'manifest.json'
+
+EXPORT_QUERY = ("SELECT taskrun.id AS taskrun_id, taskrun.task_id, taskrun.user_id, taskrun.date, "
+                "taskrun.answer_date, taskrun.completed, taskrun.summary, taskrun_question.question_id, "
+                "taskrun_question.position, taskrun_question.correct, taskrun_question.hint_shown, "
+                "taskrun_question.time, taskrun_question.answer, question.type AS question_type, \"user\".language, "
+                "\"user\".is_metric, \"user\".app_version FROM taskrun_question "
+                "JOIN taskrun ON taskrun_question.taskrun_id = taskrun.id "
+                "JOIN question ON taskrun_question.question_id = question.id "
+                "LEFT JOIN \"user\" ON taskrun.user_id = \"user\".id "
+                "WHERE (taskrun.answer_date, taskrun.id) > (CAST(:watermark_date AS TIMESTAMP), :watermark_taskrun_id) "
+                "AND taskrun.answer_date < :settled "
+                "ORDER BY taskrun.answer_date, taskrun.id, taskrun_question.position")
+
+# columns of the query stored with a fixed type, nullable integers and booleans are stored as floats with NaN
+EXPORT_COLUMNS = OrderedDict([
+    ('taskrun_id', np.int64),
+    ('task_id', np.float64),
+    ('user_id', np.float64),
+    ('date', 'datetime64[us]'),
+    ('answer_date', 'datetime64[us]'),
+    ('completed', np.float64),
+    ('question_id', np.int64),
+    ('position', np.float64),
+    ('correct', np.float64),
+    ('hint_shown', np.float64),
+    ('time', np.float64),
+    ('question_type', str),
+    ('language', str),
+    ('is_metric', np.float64),
+    ('app_version', str),
+])
+
+# JSONB columns flattened into a column per key
+JSON_COLUMNS = ('answer', 'summary')
+
+
+def flatten_json(value, prefix: str, columns: dict):
+    """
+    Flattens a JSON value into columns named by the path of keys joined by dots, lists are stored as JSON strings
+    :param value: JSON value
+    :param prefix: name of the column of the value
+    :param columns: flattened values by column names to add the values to
+    """
+
+    if isinstance(value, dict):
+        for key, item in value.items():
+            flatten_json(item, '{0}.{1}'.format(prefix, key), columns)
+    elif isinstance(value, list):
+        columns[prefix] = json.dumps(value)
+    elif value is not None:
+        columns[prefix] = value
+
+
+def to_array(values: list, dtype=None) -> np.ndarray:
+    """
+    Converts a column to an array, numbers and booleans are stored as floats with NaN for missing values, dates as
+    datetime64 and anything else as strings with '' for missing values
+    :param values: values of the column
+    :param dtype: type of the column, detected from the values if None
+    :return: array of the column
+    """
+
+    if dtype is None:
+        dtype = np.float64 if all(value is None or isinstance(value, (int, float)) for value in values) else str
+
+    if dtype is str:
+        return np.array(['' if value is None else str(value) for value in values], dtype=str)
+    if dtype == 'datetime64[us]':
+        return np.array(values, dtype=dtype)
+    if dtype is np.float64:
+        return np.array([np.nan if value is None else value for value in values], dtype=dtype)
+    return np.array(values, dtype=dtype)
+
+
+def read_manifest(directory: str) -> dict:
+    """
+    Reads the manifest of the export directory
+    :param directory: export directory
+    :return: watermark (answer date and id of the last exported TaskRun) and the list of exported chunks
+    """
+
+    path = os.path.join(directory, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {"watermark_date": datetime.datetime(1970, 1, 1).isoformat(), "watermark_taskrun_id": 0, "chunks": []}
+
+    with open(path) as file:
+        return json.load(file)
+
+
+def write_manifest(directory: str, manifest: dict):
+    """
+    Replaces the manifest of the export directory atomically, so an interrupted export continues from the last
+    written chunk
+    """
+
+    path = os.path.join(directory, MANIFEST_NAME)
+    with open(path + '.tmp', 'w') as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def write_chunk(directory: str, manifest: dict, rows: list):
+    """
+    Writes the rows as a compressed NPZ file with an array per column and moves the watermark to their last TaskRun,
+    chunks are numbered in the order of the export as a TaskRun answered again is exported again in a later chunk
+    :param directory: export directory
+    :param manifest: manifest of the directory
+    :param rows: exported rows of whole TaskRuns
+    """
+
+    columns = OrderedDict((name, to_array([row[name] for row in rows], dtype))
+                          for name, dtype in EXPORT_COLUMNS.items())
+
+    flattened = [{} for row in rows]
+    for row, row_columns in zip(rows, flattened):
+        for name in JSON_COLUMNS:
+            flatten_json(row[name], name, row_columns)
+    for name in sorted(set(name for row_columns in flattened for name in row_columns)):
+        columns[name] = to_array([row_columns.get(name) for row_columns in flattened])
+
+    name = 'answers_{0:06d}.npz'.format(len(manifest['chunks']))
+    np.savez_compressed(os.path.join(directory, name), **columns)
+
+    manifest['watermark_date'] = rows[-1]['answer_date'].isoformat()
+    manifest['watermark_taskrun_id'] = rows[-1]['taskrun_id']
+    manifest['chunks'].append({"file": name, "rows": len(rows),
+                               "first_answer_date": rows[0]['answer_date'].isoformat(),
+                               "last_answer_date": rows[-1]['answer_date'].isoformat(),
+                               "exported_at": datetime.datetime.utcnow().isoformat()})
+    write_manifest(directory, manifest)
+
+
+def export_answers(directory: str, chunk_size: int = None) -> int:
+    """
+    Exports TaskRuns answered after the watermark of the export directory into compressed chunks, a TaskRun answered
+    again after its export (eg. games of /api/startBatch played later) is exported again with all its answers. The
+    answers are streamed by a server-side cursor and only one chunk is held in memory. TaskRuns answered in the last
+    EXPORT_SETTLE_TIME are left for the next export as concurrent answers may not be committed yet.
+    :param directory: export directory, created if it does not exist
+    :param chunk_size: minimal number of rows of a chunk (chunks end with a whole TaskRun), EXPORT_CHUNK_SIZE by default
+    :return: number of exported rows
+    """
+
+    chunk_size = chunk_size or config.EXPORT_CHUNK_SIZE
+    os.makedirs(directory, exist_ok=True)
+    manifest = read_manifest(directory)
+    settled = datetime.datetime.utcnow() - datetime.timedelta(seconds=config.EXPORT_SETTLE_TIME)
+
+    result = db.session.connection().execution_options(stream_results=True)\
+        .execute(text(EXPORT_QUERY), {"watermark_date": manifest['watermark_date'],
+                                      "watermark_taskrun_id": manifest['watermark_taskrun_id'], "settled": settled})
+
+    exported = 0
+    rows = []
+    while True:
+        fetched = result.fetchmany(config.EXPORT_FETCH_SIZE)
+        for row in fetched:
+            if len(rows) >= chunk_size and row.taskrun_id != rows[-1]['taskrun_id']:
+                write_chunk(directory, manifest, rows)
+                exported += len(rows)
+                rows = []
+            rows.append(dict(row))
+
+        if len(fetched) == 0:
+            break
+
+    if len(rows) > 0:
+        write_chunk(directory, manifest, rows)
+        exported += len(rows)
+
+    db.session.rollback()
+    return exported
+
+
+def load_export(directory: str) -> dict:
+    """
+    Loads all chunks of the export directory into one array per column, columns missing in some chunks are filled
+    with NaN or ''. TaskRuns exported more times are loaded from their latest export.
+    :param directory: export directory
+    :return: arrays by column names
+    """
+
+    chunks = []
+    for chunk in read_manifest(directory)['chunks']:
+        with np.load(os.path.join(directory, chunk['file'])) as data:
+            chunks.append(dict((name, data[name]) for name in data.files))
+
+    names = list(EXPORT_COLUMNS)
+    names += sorted(set(name for chunk in chunks for name in chunk) - set(names))
+
+    columns = OrderedDict()
+    for name in names:
+        # a column detected as numeric in one chunk may contain strings in another one
+        string = any(name in chunk and chunk[name].dtype.kind == 'U' for chunk in chunks)
+        parts = []
+        for chunk in chunks:
+            if name in chunk:
+                parts.append(chunk[name].astype(str) if string else chunk[name])
+            else:
+                length = len(chunk['taskrun_id'])
+                parts.append(np.full(length, '', dtype=str) if string else np.full(length, np.nan))
+        if len(parts) > 0:
+            columns[name] = np.concatenate(parts)
+
+    if len(chunks) == 0:
+        return columns
+
+    # rows of the latest chunk of each TaskRun
+    chunk_numbers = np.concatenate([np.full(len(chunk['taskrun_id']), i) for i, chunk in enumerate(chunks)])
+    taskrun_ids, inverse = np.unique(columns['taskrun_id'], return_inverse=True)
+    latest = np.full(len(taskrun_ids), -1)
+    np.maximum.at(latest, inverse, chunk_numbers)
+    latest_rows = chunk_numbers == latest[inverse]
+
+    return OrderedDict((name, column[latest_rows]) for name, column in columns.items())
@@ -1,19 +1,26 @@
 import random
 import datetime
 from math import sqrt
-from typing import List
+from typing import List, Tuple
 
 import math
-from sqlalchemy import text
+import numpy as np
 
-from app.engine.elo import compute_expected_response, compute_expected_response_time
+from app.engine.elo import compute_expected_response, compute_expected_response_time, compute_expected_responses
+from app.engine.users import UserProfile
 from app.extensions import db
-from app.models import TaskRun, Question, Task, User
+from app.models import TaskRun, Question, Task, UserQuestionStats
 from app.models.Task import TaskRunQuestion
 from app.models.Skill import UserSkill
 
+RESPONSE_GOAL = 0.75
 
-def generate_game(task: Task, user: User) -> TaskRun:
+ANSWERED_COUNT_WEIGHT = 10
+TIME_WEIGHT = 120
+PROBABILITY_WEIGHT = 10
+
+
+def generate_game(task: Task, user: UserProfile) -> TaskRun:
     """
     Generates a new game
     :param task: task for which to generate a game
@@ -21,53 +28,233 @@ def generate_game(task: Task, user: User) -> TaskRun:
     :return: freshly generated game
     """
 
+    return generate_games(task, user, 1)[0]
+
+
+def generate_games(task: Task, user: UserProfile, count: int) -> List[TaskRun]:
+    """
+    Generates upcoming games of the user in one transaction. The question pool and the statistics of the user are
+    fetched only once, questions chosen to a game are counted as answered just now when choosing questions of the next
+    games, so the games do not repeat questions while there are others with a similar priority.
+    :param task: task for which to generate the games
+    :param user: user for which to generate the games
+    :param count: number of games to generate
+    :return: freshly generated games in the order they are played
+    """
+
     NUMBER_OF_QUESTIONS_FIRST = 5
     NUMBER_OF_QUESTIONS = 6
 
-    taskrun = TaskRun(task_id=task.id, user_id=user.id)
+    taskruns = [TaskRun(task_id=task.id, user_id=user.id) for i in range(count)]
 
-    skill = taskrun.corresponding_skill(create_if_none=False)
-    number_of_questions_load = NUMBER_OF_QUESTIONS_FIRST if skill is None else NUMBER_OF_QUESTIONS
+    skill = taskruns[0].corresponding_skill(create_if_none=False)
     skill_value = 0 if skill is None else skill.value
     speed_value = 0 if skill is None else skill.speed
 
-    taskrun.questions = choose_questions(task, user, number_of_questions_load, skill_value, speed_value)
-    db.session.add(taskrun)
+    pool = get_user_pool(task, user)
+    answered_counts, last_answer_dates = fetch_questions_stats(pool.questions, user)
+
+    for i, taskrun in enumerate(taskruns):
+        # the skill is created by answers of the first game
+        number_of_questions_load = NUMBER_OF_QUESTIONS_FIRST if skill is None and i == 0 else NUMBER_OF_QUESTIONS
+        questions = select_questions(pool, number_of_questions_load, answered_counts, last_answer_dates,
+                                     skill_value, speed_value)
+
+        # the questions of the pool are shared between requests and must not be added to the session
+        taskrun.questions = [TaskRunQuestion(question_id=question.id, position=position)
+                             for position, question in enumerate(questions)]
+        record_chosen_questions(questions, answered_counts, last_answer_dates)
+
+    db.session.add_all(taskruns)
     db.session.commit()
-    return taskrun
+    return taskruns
+
+
+def get_user_pool(task: Task, user: UserProfile):
+    """
+    Returns the pool of questions of the task in the unit system of the user
+    :param task: task of the questions
+    :param user: user to choose the questions for
+    :return: pool of the questions
+    :rtype: QuestionPool
+    """
+
+    from app.engine import bank
+
+    # same questions as Task.questions_m and Task.questions_i
+    if not user.is_metric:
+        return bank.get_task_pool(task, "metric")
+    else:
+        return bank.get_task_pool(task, "imperial")
+
+
+def record_chosen_questions(questions: List[Question], answered_counts: {}, last_answer_dates: {}):
+    """
+    Updates statistics of the user as if the questions were answered just now
+    :param questions: questions chosen to a game
+    :param answered_counts: answered counts of specific questions, updated in place
+    :param last_answer_dates: last answered dates of specific questions, updated in place
+    """
+
+    for question in questions:
+        answered_counts[question.id] = answered_counts.get(question.id, 0) + 1
+        last_answer_dates[question.id] = 0
+
 
+class QuestionPool:
+    """
+    Candidate questions of a task held as column arrays, so that priorities of all of them are scored at once
+    """
 
-def choose_questions(task: Task, user: User, number: int, skill: float, speed: float) -> [TaskRunQuestion]:
+    def __init__(self, questions: List[Question], is_test: bool = False):
+        """
+        :param questions: candidate questions
+        :type questions: list
+        :param is_test: whether the questions belong to the testing task, which keeps the order of questions
+        :type is_test: bool
+        """
+
+        self.questions = list(questions)
+        self.is_test = is_test
+        self.index = dict((question.id, i) for i, question in enumerate(self.questions))
+
+        self.ids = np.array([question.id for question in self.questions], dtype=np.int64)
+        self.difficulty = np.array([question.difficulty for question in self.questions], dtype=np.float64)
+        self.target_time = np.array([question.target_time for question in self.questions], dtype=np.float64)
+        self.types, self.type_codes = np.unique([question.type for question in self.questions], return_inverse=True)
+
+    def __len__(self):
+        return len(self.questions)
+
+    def user_column(self, values: {}, default: float) -> np.ndarray:
+        """
+        Builds a column aligned with the questions from per question values of an user
+        :param values: values by question id
+        :type values: dict
+        :param default: value of questions missing in values
+        :type default: float
+        :return: column of the values
+        :rtype: numpy.ndarray
+        """
+
+        column = np.full(len(self.questions), default, dtype=np.float64)
+        known = [(self.index[question_id], value) for question_id, value in values.items()
+                 if question_id in self.index]
+        if len(known) > 0:
+            indices, known_values = zip(*known)
+            column[list(indices)] = known_values
+
+        return column
+
+
+def _tie_ends(ranked_priorities: np.ndarray) -> np.ndarray:
+    """
+    Finds where the groups of equal priorities end in a ranking
+    :param ranked_priorities: priorities in the ranked order
+    :return: for each position the position after the last one of equal priority
     """
-    Choose questions to newly created TaskRun
-    :param task: task for which to choose questions
-    :param user: user for which to choose questions
-    :param number: number of questions to choose
+
+    ends = np.append(np.flatnonzero(ranked_priorities[1:] != ranked_priorities[:-1]) + 1, len(ranked_priorities))
+    return np.repeat(ends, np.diff(ends, prepend=0))
+
+
+def select_questions(pool: QuestionPool, number: int, answered_counts: {}, last_answer_dates: {},
+                     skill: float, speed: float) -> List[Question]:
+    """
+    Selects questions with the highest priority, ties are broken randomly
+    :param pool: questions to select from
+    :param number: number of questions to select
+    :param answered_counts: answered counts of specific questions
+    :param last_answer_dates: last answered dates of specific questions
     :param skill: skill of the user for the current task
     :param speed: speed of the user for the current task
-    :return: list of questions
+    :return: list of selected questions
     """
 
-    if not user.is_metric:
-        q = task.questions_m
+    # Only the same type penalty changes after a question is selected and it is the same for all questions of
+    # a type, so the questions of each type are ranked once by the rest of the priority. The best question is then
+    # one of the best ranked remaining questions of the types. The questions of the testing task are not penalized
+    # and are ranked together under None. Same as by sorting shuffled questions for every pick, each pick is drawn
+    # uniformly from all remaining questions of the highest priority, that is from the questions tied at the heads
+    # of the best types.
+    if pool.is_test:
+        static_priorities = pool.ids.astype(np.float64)
+        rankings = {None: np.argsort(-static_priorities, kind='mergesort')}
     else:
-        q = task.questions_i
+        static_priorities = question_static_priorities(pool, answered_counts, last_answer_dates, skill, speed)
+        ranking = np.argsort(-static_priorities, kind='mergesort')
+        ranked_codes = pool.type_codes[ranking]
+        rankings = dict((question_type, ranking[ranked_codes == code]) for code, question_type in enumerate(pool.types))
+
+    # the drawn question is swapped within its group of equal priorities, so the groups are found once
+    tie_ends = dict((question_type, _tie_ends(static_priorities[ranking]).tolist())
+                    for question_type, ranking in rankings.items())
+    rankings = dict((question_type, ranking.tolist()) for question_type, ranking in rankings.items())
+    positions = dict((question_type, 0) for question_type in rankings)
+
+    choosen_questions = []
+    choosen_types_counts = {}
 
-    # shuffle questions
-    questions = random.sample(q, len(q))
+    for i in range(0, number):
+        # (priority, number of questions tied at the head) of the best types
+        best_priority = None
+        best_types = []
+        for question_type, ranking in rankings.items():
+            position = positions[question_type]
+            if position >= len(ranking):
+                continue
+
+            index = ranking[position]
+            priority = static_priorities[index]
+            if question_type is not None:
+                priority += same_type_penalty_priority(pool.questions[index], choosen_types_counts)
+
+            if best_priority is None or priority > best_priority:
+                best_priority = priority
+                best_types = []
+            if priority == best_priority:
+                best_types.append((question_type, tie_ends[question_type][position] - position))
+
+        if len(best_types) == 0:
+            break
+
+        # a question of the tied ones is moved to the head of its type and taken
+        draw = random.randrange(sum(tied for question_type, tied in best_types))
+        for question_type, tied in best_types:
+            if draw < tied:
+                break
+            draw -= tied
+
+        ranking, position = rankings[question_type], positions[question_type]
+        ranking[position], ranking[position + draw] = ranking[position + draw], ranking[position]
+        question = pool.questions[ranking[position]]
+        positions[question_type] += 1
+        choosen_questions.append(question)
+        choosen_types_counts[question.type] = choosen_types_counts.get(question.type, 0) + 1
 
-    answered_counts, last_answer_dates = fetch_questions_stats(questions, user)
+    return choosen_questions
+
+
+def select_questions_sorting(questions: List[Question], number: int, answered_counts: {}, last_answer_dates: {},
+                             skill: float, speed: float) -> List[Question]:
+    """
+    Same as select_questions() but sorting all questions by their priority for each selected question, kept as
+    a reference for benchmarks
+    """
+
+    questions = random.sample(questions, len(questions))
+    answered_counts = dict(answered_counts)
 
     choosen_questions = []
     choosen_types_counts = {}
 
     for i in range(0, number):
         random.shuffle(questions)
-        questions.sort(key=lambda k: question_priority(k, user, choosen_types_counts, answered_counts,
+        questions.sort(key=lambda k: question_priority(k, choosen_types_counts, answered_counts,
                                                        last_answer_dates, skill, speed), reverse=True)
 
         if len(questions) > 0:
-            choosen_questions.append(TaskRunQuestion(question=questions[0], position=i))
+            choosen_questions.append(questions[0])
             choosen_types_counts[questions[0].type] = choosen_types_counts.get(questions[0].type, 0) + 1
             answered_counts[questions[0].id] = answered_counts.get(questions[0].id, 0) + 1
             questions = questions[1:]
@@ -75,12 +262,11 @@ def choose_questions(task: Task, user: User, number: int, skill: float, speed: f
     return choosen_questions
 
 
-def question_priority(question: Question, user: User, choosen_types_counts: {}, answered_counts: {},
-                      last_answer_dates: {}, skill_value: float, user_speed: float) -> float:
+def question_priority(question: Question, choosen_types_counts: {}, answered_counts: {}, last_answer_dates: {},
+                      skill_value: float, user_speed: float) -> float:
     """
     Returns a question priority for the specified parameters
     :param question: question to compute priority for
-    :param user: user to compute priority for
     :param choosen_types_counts: types already chosen in the generated task run
     :param answered_counts: answered counts of specific questions
     :param last_answer_dates: last answered dates of specific questions
@@ -89,22 +275,49 @@ def question_priority(question: Question, user: User, choosen_types_counts: {},
     :return: priority of the question
     """
 
-    # a hack to keep order of questions consistent when using testing task
-    if question.tasks[0].identifier == "test":
-        return question.id
+    static_priority, penalized = question_static_priority(question, answered_counts, last_answer_dates, skill_value,
+                                                          user_speed)
+    if penalized:
+        return static_priority + same_type_penalty_priority(question, choosen_types_counts)
+    else:
+        return static_priority
 
-    RESPONSE_GOAL = 0.75
 
-    ANSWERED_COUNT_WEIGHT = 10
+def same_type_penalty_priority(question: Question, choosen_types_counts: {}) -> float:
+    """
+    Returns the part of question priority depending on the questions already chosen to the task run
+    :param question: question to compute priority for
+    :param choosen_types_counts: types already chosen in the generated task run
+    :return: weighted same type penalty score
+    """
+
     SAME_TYPE_PENALTY_WEIGHT = 10
-    TIME_WEIGHT = 120
-    PROBABILITY_WEIGHT = 10
 
-    # score for total answered count for the user
-    answered_count_score = 1. / sqrt(1 + answered_counts.get(question.id, 0))
     # score for number of selected questions of the same type
     same_type_penalty_score = 1. / sqrt(1 + choosen_types_counts.get(question.type, 0))
 
+    return same_type_penalty_score * SAME_TYPE_PENALTY_WEIGHT
+
+
+def question_static_priority(question: Question, answered_counts: {}, last_answer_dates: {}, skill_value: float,
+                             user_speed: float) -> Tuple[float, bool]:
+    """
+    Returns the part of question priority not depending on the questions already chosen to the task run
+    :param question: question to compute priority for
+    :param answered_counts: answered counts of specific questions
+    :param last_answer_dates: last answered dates of specific questions
+    :param skill_value: skill of the user aplicable for the question
+    :param user_speed: speed of the user aplicable for the question
+    :return: tuple with the priority and flag whether the same type penalty applies to the question
+    """
+
+    # a hack to keep order of questions consistent when using testing task
+    if question.tasks[0].identifier == "test":
+        return question.id, False
+
+    # score for total answered count for the user
+    answered_count_score = 1. / sqrt(1 + answered_counts.get(question.id, 0))
+
     # score for time from last answer of the question
     if question.id in last_answer_dates:
         time_score = -1. / (last_answer_dates[question.id]) if last_answer_dates[question.id] > 0 else -1
@@ -119,10 +332,37 @@ def question_priority(question: Question, user: User, choosen_types_counts: {},
     else:
         probability_score = (1 - expected_response) / (1 - RESPONSE_GOAL)
 
-    return answered_count_score * ANSWERED_COUNT_WEIGHT + same_type_penalty_score * SAME_TYPE_PENALTY_WEIGHT + time_score * TIME_WEIGHT + probability_score * PROBABILITY_WEIGHT
+    return answered_count_score * ANSWERED_COUNT_WEIGHT + time_score * TIME_WEIGHT + probability_score * PROBABILITY_WEIGHT, True
+
+
+def question_static_priorities(pool: QuestionPool, answered_counts: {}, last_answer_dates: {}, skill_value: float,
+                               user_speed: float) -> np.ndarray:
+    """
+    Same as question_static_priority() for all questions of the pool at once
+    :param pool: questions to compute priorities for
+    :param answered_counts: answered counts of specific questions
+    :param last_answer_dates: last answered dates of specific questions
+    :param skill_value: skill of the user aplicable for the questions
+    :param user_speed: speed of the user aplicable for the questions
+    :return: priorities of the questions in the order of the pool
+    """
+
+    # score for total answered count for the user
+    answered_count_score = 1. / np.sqrt(1 + pool.user_column(answered_counts, 0))
+
+    # score for time from last answer of the question, questions never answered have infinite time and zero score
+    seconds = pool.user_column(last_answer_dates, np.inf)
+    time_score = np.divide(-1., seconds, out=np.full(len(pool), -1.), where=seconds > 0)
+
+    # score for probability of correct answer
+    expected_response = compute_expected_responses(skill_value, pool.difficulty)
+    probability_score = np.where(RESPONSE_GOAL > expected_response, expected_response / RESPONSE_GOAL,
+                                 (1 - expected_response) / (1 - RESPONSE_GOAL))
+
+    return answered_count_score * ANSWERED_COUNT_WEIGHT + time_score * TIME_WEIGHT + probability_score * PROBABILITY_WEIGHT
 
 
-def fetch_questions_stats(questions: List[Question], user: User):
+def fetch_questions_stats(questions: List[Question], user: UserProfile):
     """
     Fetch statistical information about questions for an user
     :param questions: questions to fetch statistics about
@@ -130,27 +370,18 @@ def fetch_questions_stats(questions: List[Question], user: User):
     :return: tuple with answered counts and last answered dates
     """
 
-    answered_counts_rows = db.session.execute(text('SELECT question.id, count(question.id) AS count FROM question '
-                                                   'JOIN taskrun_question ON taskrun_question.question_id = question.id '
-                                                   'JOIN taskrun ON taskrun_question.taskrun_id = taskrun.id '
-                                                   'WHERE taskrun_question.correct is not null AND taskrun.user_id = :userid '
-                                                   'AND question.id IN :questions '
-                                                   'GROUP BY question.id'),
-                                              params={"userid": user.id,
-                                                      "questions": tuple(map((lambda x: x.id), questions))})
+    if len(questions) == 0:
+        return {}, {}
 
-    answered_counts = dict((x.id, x.count) for x in answered_counts_rows)
+    rows = db.session.query(UserQuestionStats.question_id, UserQuestionStats.answered_count,
+                            UserQuestionStats.last_answer_date)\
+        .filter(UserQuestionStats.user_id == user.id,
+                UserQuestionStats.question_id.in_([question.id for question in questions]))\
+        .all()
 
-    last_answer_date_rows = db.session.execute(text('SELECT question.id, MAX(taskrun.date) AS date FROM question '
-                                                    'JOIN taskrun_question ON taskrun_question.question_id = question.id '
-                                                    'JOIN taskrun ON taskrun_question.taskrun_id = taskrun.id '
-                                                    'WHERE taskrun_question.correct is not null AND taskrun.user_id = :userid '
-                                                    'AND question.id IN :questions '
-                                                    'GROUP BY question.id'),
-                                               params={"userid": user.id,
-                                                       "questions": tuple(map((lambda x: x.id), questions))})
+    answered_counts = dict((x.question_id, x.answered_count) for x in rows)
 
     now = datetime.datetime.now()
-    last_answer_dates = dict((x.id, (now - x.date).total_seconds()) for x in last_answer_date_rows)
+    last_answer_dates = dict((x.question_id, (now - x.last_answer_date).total_seconds()) for x in rows)
 
     return answered_counts, last_answer_dates
@@ -0,0 +1,138 @@
+import datetime
+from collections import OrderedDict
+
+from sqlalchemy import Table, text
+from sqlalchemy.event import listens_for
+from sqlalchemy.orm import Session
+
+from app.extensions import db
+
+# key of Session.info with history rows waiting for the commit
+BUFFER_KEY = 'history_rows'
+
+
+def add_history_row(session: Session, table: Table, **values):
+    """
+    Buffers a history row, rows of the transaction are written just before its commit by one INSERT per table
+    :param session: session of the transaction
+    :param table: history table
+    :param values: values of the row, date is set to the current time if not present
+    """
+
+    values.setdefault('date', datetime.datetime.utcnow())
+    session.info.setdefault(BUFFER_KEY, OrderedDict()).setdefault(table, []).append(values)
+
+
+def write_history_rows(session: Session):
+    """
+    Writes buffered history rows of the session, each table by a single multi-row INSERT in the order of buffering
+    :param session: session with buffered rows
+    """
+
+    buffer = session.info.pop(BUFFER_KEY, None)
+    if not buffer:
+        return
+
+    for table, rows in buffer.items():
+        session.execute(table.insert().values(rows))
+
+
+@listens_for(Session, 'before_commit')
+def flush_history_rows(session):
+    # pending changes are flushed first, so the history rows follow the updates they record
+    session.flush()
+    write_history_rows(session)
+
+
+@listens_for(Session, 'after_rollback')
+def discard_history_rows(session):
+    session.info.pop(BUFFER_KEY, None)
+
+
+# history tables partitioned by date (see the history_partitions migration) with their daily aggregates, key columns
+# and columns with values of the history
+HISTORY_ROLLUPS = OrderedDict([
+    ('question_history', ('question_history_daily', ('question_id',), ('target_time', 'difficulty'))),
+    ('user_skill_history', ('user_skill_history_daily', ('user_id', 'task_id'), ('value',))),
+])
+
+
+def is_partitioned(table_name: str) -> bool:
+    """
+    Checks whether the table is partitioned
+    :param table_name: name of the table
+    :return: whether the table is partitioned
+    """
+
+    relkind = db.session.execute(text('SELECT relkind FROM pg_class WHERE relname = :name'),
+                                 {"name": table_name}).scalar()
+    return relkind == 'p'
+
+
+def month_start(date: datetime.date, months: int = 0) -> datetime.date:
+    """
+    Returns the first day of the month shifted by the number of months from the month of the date
+    """
+
+    month = date.year * 12 + date.month - 1 + months
+    return datetime.date(month // 12, month % 12 + 1, 1)
+
+
+def create_history_partitions(months_ahead: int = 3):
+    """
+    Creates monthly partitions of history tables for the current month and the months ahead. Rows without a partition
+    go to the default partition, and the partition of their month can not be created then, so this needs to be run
+    regularly (it is run by rollup_history).
+    :param months_ahead: number of months ahead to create partitions for
+    """
+
+    today = datetime.date.today()
+    for table_name in HISTORY_ROLLUPS:
+        if not is_partitioned(table_name):
+            continue
+
+        for months in range(0, months_ahead + 1):
+            start = month_start(today, months)
+            db.session.execute(text('CREATE TABLE IF NOT EXISTS {0}_p{1:%Y%m} PARTITION OF {0} '
+                                    'FOR VALUES FROM (:start) TO (:end)'.format(table_name, start)),
+                               {"start": start, "end": month_start(start, 1)})
+
+    db.session.commit()
+
+
+def rollup_history(before: datetime.date):
+    """
+    Aggregates history rows older than the date into daily aggregates (the last values of the day and the number of
+    rows) and removes them, monthly partitions older than the date are dropped
+    :param before: date of the oldest history to keep
+    """
+
+    for table_name, (daily_table_name, keys, values) in HISTORY_ROLLUPS.items():
+        key_columns = ', '.join(keys)
+        value_columns = ', '.join(values)
+        last_values = ', '.join('(array_agg({0} ORDER BY date DESC, id DESC))[1]'.format(value) for value in values)
+        updates = ', '.join('{0} = EXCLUDED.{0}'.format(value) for value in values)
+
+        db.session.execute(text('INSERT INTO {daily} ({keys}, day, {values}, count) '
+                                'SELECT {keys}, date::date, {last_values}, count(*) FROM {table} '
+                                'WHERE date < :before GROUP BY {keys}, date::date '
+                                'ON CONFLICT ({keys}, day) DO UPDATE SET {updates}, '
+                                'count = {daily}.count + EXCLUDED.count'
+                                .format(daily=daily_table_name, table=table_name, keys=key_columns,
+                                        values=value_columns, last_values=last_values, updates=updates)),
+                           {"before": before})
+
+        if is_partitioned(table_name):
+            partitions = db.session.execute(text('SELECT inhrelid::regclass::text AS name FROM pg_inherits '
+                                                 'WHERE inhparent = CAST(:table AS regclass)'),
+                                            {"table": table_name})
+            for partition in [row.name for row in partitions]:
+                month = partition[len(table_name) + 2:]
+                if partition.startswith(table_name + '_p') and month.isdigit() and \
+                        month_start(datetime.date(int(month[:4]), int(month[4:]), 1), 1) <= before:
+                    db.session.execute(text('DROP TABLE {0}'.format(partition)))
+
+        db.session.execute(text('DELETE FROM {0} WHERE date < :before'.format(table_name)), {"before": before})
+
+    db.session.commit()
+    create_history_partitions()
@@ -0,0 +1,369 @@
+import multiprocessing
+import time
+from array import array
+from collections import namedtuple, OrderedDict
+from typing import List, Optional
+
+import numpy as np
+from psycopg2.extras import execute_values
+from sqlalchemy import text
+
+from app.engine import elo
+from app.extensions import db
+from app.models.Task import compute_score
+
+# parameters of the model (see app.engine.elo)
+EloParameters = namedtuple('EloParameters', ['k_success', 'k_failure', 'alpha', 'beta'])
+DEFAULT_PARAMETERS = EloParameters(elo.K_SUCCESS, elo.K_FAILURE, elo.ALPHA, elo.BETA)
+
+# final values of a replay indexed the same way as the AnswerLog, and the task skill predictions (expected responses)
+# of all answers of the log
+ReplayResult = namedtuple('ReplayResult', ['difficulty', 'target_time', 'skill', 'speed', 'user_skill',
+                                           'expected_responses'])
+
+# metrics of expected responses against the observed responses (scores of the answers)
+ReplayMetrics = namedtuple('ReplayMetrics', ['log_loss', 'rmse', 'auc'])
+
+# answers with at least this score are the correct ones for AUC (correct on the first try without the hint)
+CORRECT_RESPONSE = 0.6
+
+ANSWERS_QUERY = ("SELECT taskrun.user_id, taskrun.task_id, taskrun_question.question_id, taskrun_question.correct, "
+                 "taskrun_question.hint_shown, taskrun_question.time, taskrun_question.answer->>'answer' AS answer, "
+                 "taskrun_question.answer->>'tolerance' AS tolerance, "
+                 "taskrun_question.answer->>'correctAnswer' AS correct_answer FROM taskrun_question "
+                 "JOIN taskrun ON taskrun_question.taskrun_id = taskrun.id "
+                 "WHERE taskrun_question.correct IS NOT NULL AND taskrun.user_id IS NOT NULL "
+                 "ORDER BY taskrun.date, taskrun.id, taskrun_question.position")
+
+# number of answers loaded by ANSWERS_QUERY
+ANSWERS_COUNT_QUERY = ("SELECT count(*) FROM taskrun_question JOIN taskrun ON taskrun_question.taskrun_id = taskrun.id "
+                       "WHERE taskrun_question.correct IS NOT NULL AND taskrun.user_id IS NOT NULL")
+
+ANSWERS_CHUNK_SIZE = 10000
+
+# answer columns of AnswerLog with their types
+ANSWER_COLUMNS = OrderedDict([
+    ('question', np.int32),
+    ('user', np.int32),
+    ('skill', np.int32),
+    ('time', np.float64),
+    ('response', np.float64),
+    ('first', np.int8),
+    ('answered_count', np.int32),
+    ('answered_users_count', np.int32),
+])
+
+
+class AnswerLog:
+    """
+    All answers in chronological order stored as columns. Everything not depending on the parameters of the model
+    (scores, first attempts, answer counters) is computed when the log is loaded, so the log can be replayed with
+    different parameters.
+    """
+
+    def __init__(self, question_ids: list, initial_difficulties: list):
+        """
+        :param question_ids: ids of all questions
+        :type question_ids: list
+        :param initial_difficulties: difficulties of the questions before any answer
+        :type initial_difficulties: list
+        """
+
+        self.question_ids = question_ids
+        self.initial_difficulties = list(initial_difficulties)
+        self.question_index = dict((question_id, i) for i, question_id in enumerate(question_ids))
+        self.user_ids = []
+        self.user_index = {}
+        self.skill_keys = []  # (user_id, task_id) of UserSkill
+        self.skill_index = {}
+        self.skipped = 0  # answers not replayed (of unknown questions or without response time), see append()
+        self.unknown_initial_difficulties = 0  # questions replayed from difficulty 0 as their initial one is unknown
+
+        # answer columns
+        self.question = array('i')
+        self.user = array('i')
+        self.skill = array('i')
+        self.time = array('d')
+        self.response = array('d')
+        self.first = array('b')  # whether the user answered the question for the first time
+        self.answered_count = array('i')  # answers of the question including this one
+        self.answered_users_count = array('i')  # users who answered the question including this one
+
+        self.answered_counts = [0] * len(question_ids)
+        self.answered_users_counts = [0] * len(question_ids)
+        self._answered = set()
+
+    def __len__(self):
+        return len(self.question)
+
+    def save(self, path: str):
+        """
+        Stores the log to a compressed NPZ file
+        :param path: path of the file
+        :type path: str
+        """
+
+        columns = dict((name, np.frombuffer(getattr(self, name), dtype=ANSWER_COLUMNS[name]))
+                       for name in ANSWER_COLUMNS)
+        np.savez_compressed(path, question_ids=np.array(self.question_ids, dtype=np.int64),
+                            answered=np.array(sorted(self._answered), dtype=np.int64).reshape(-1, 2),
+                            initial_difficulties=np.array(self.initial_difficulties, dtype=np.float64),
+                            user_ids=np.array(self.user_ids, dtype=np.int64),
+                            skill_keys=np.array(self.skill_keys, dtype=np.int64).reshape(-1, 2),
+                            answered_counts=np.array(self.answered_counts, dtype=np.int64),
+                            answered_users_counts=np.array(self.answered_users_counts, dtype=np.int64),
+                            skipped=self.skipped, unknown_initial_difficulties=self.unknown_initial_difficulties,
+                            **columns)
+
+    @classmethod
+    def load(cls, path: str) -> 'AnswerLog':
+        """
+        Loads the log stored by save()
+        :param path: path of the file
+        :type path: str
+        :return: loaded log
+        :rtype: AnswerLog
+        """
+
+        with np.load(path) as data:
+            log = cls(data['question_ids'].tolist(), data['initial_difficulties'].tolist())
+            log.user_ids = data['user_ids'].tolist()
+            log.user_index = dict((user_id, i) for i, user_id in enumerate(log.user_ids))
+            log.skill_keys = [tuple(key) for key in data['skill_keys'].tolist()]
+            log.skill_index = dict((key, i) for i, key in enumerate(log.skill_keys))
+            log.answered_counts = data['answered_counts'].tolist()
+            log.answered_users_counts = data['answered_users_counts'].tolist()
+            log.skipped = int(data['skipped'])
+            log.unknown_initial_difficulties = int(data['unknown_initial_difficulties'])
+
+            for name, dtype in ANSWER_COLUMNS.items():
+                getattr(log, name).frombytes(data[name].astype(dtype).tobytes())
+
+            # users answered the questions before answers appended to the loaded log
+            log._answered = set(tuple(pair) for pair in data['answered'].tolist())
+
+        return log
+
+    def append(self, user_id: int, task_id: int, question_id: int, response_time: float, response: float):
+        """
+        Appends an answer, answers have to be appended in chronological order. Answers without a positive response time
+        are counted in the answer counters but skipped by the replay, same as by elo.update_many().
+        """
+
+        question = self.question_index.get(question_id)
+        if question is None:
+            self.skipped += 1
+            return
+
+        user = self.user_index.get(user_id)
+        if user is None:
+            user = self.user_index[user_id] = len(self.user_ids)
+            self.user_ids.append(user_id)
+
+        first = (user, question) not in self._answered
+        if first:
+            self._answered.add((user, question))
+            self.answered_users_counts[question] += 1
+        self.answered_counts[question] += 1
+
+        if response_time is None or response_time <= 0:
+            self.skipped += 1
+            return
+
+        skill = self.skill_index.get((user_id, task_id))
+        if skill is None:
+            skill = self.skill_index[(user_id, task_id)] = len(self.skill_keys)
+            self.skill_keys.append((user_id, task_id))
+
+        self.question.append(question)
+        self.user.append(user)
+        self.skill.append(skill)
+        self.time.append(response_time)
+        self.response.append(response)
+        self.first.append(first)
+        self.answered_count.append(self.answered_counts[question])
+        self.answered_users_count.append(self.answered_users_counts[question])
+
+
+def load_answer_log() -> AnswerLog:
+    """
+    Streams all answers from the database into an AnswerLog
+    :return: loaded log
+    :rtype: AnswerLog
+    """
+
+    questions = db.session.execute(text('SELECT id, initial_difficulty FROM question ORDER BY id')).fetchall()
+    log = AnswerLog([row.id for row in questions], [row.initial_difficulty or 0 for row in questions])
+    log.unknown_initial_difficulties = sum(1 for row in questions if row.initial_difficulty is None)
+
+    result = db.session.connection().execution_options(stream_results=True).execute(text(ANSWERS_QUERY))
+    while True:
+        rows = result.fetchmany(ANSWERS_CHUNK_SIZE)
+        if len(rows) == 0:
+            break
+
+        for row in rows:
+            answer = dict((key, value) for key, value in (('answer', row.answer), ('tolerance', row.tolerance),
+                                                          ('correctAnswer', row.correct_answer))
+                          if value is not None)
+            log.append(row.user_id, row.task_id, row.question_id, row.time,
+                       compute_score(row.correct, row.hint_shown, answer))
+
+    result.close()
+    return log
+
+
+def replay(log: AnswerLog, parameters: EloParameters = DEFAULT_PARAMETERS) -> ReplayResult:
+    """
+    Applies all answers of the log to the model from its initial state, same as elo.apply_update() does for each
+    answer
+    :param log: answers to replay
+    :type log: AnswerLog
+    :param parameters: parameters of the model
+    :type parameters: EloParameters
+    :return: final values of the model
+    :rtype: ReplayResult
+    """
+
+    k_success, k_failure, alpha, beta = parameters
+
+    difficulty = list(log.initial_difficulties)
+    target_time = [0.] * len(log.question_ids)
+    skill = [0.] * len(log.skill_keys)
+    speed = [0.] * len(log.skill_keys)
+    user_skill = [0.] * len(log.user_ids)
+    expected_responses = array('d')
+
+    for question, user, user_task, response_time, response, first, answered_count, answered_users_count in \
+            zip(log.question, log.user, log.skill, log.time, log.response, log.first, log.answered_count,
+                log.answered_users_count):
+        if first:
+            target_time[question] += elo.compute_target_time_delta(response_time, target_time[question],
+                                                                   answered_count)
+
+        expected_response = elo.compute_expected_response(skill[user_task], difficulty[question], response_time)
+        skill[user_task] += elo.compute_user_skill_delta(response, expected_response, k_success, k_failure)
+        speed[user_task] += elo.compute_target_time_delta(response_time, speed[user_task], 1)
+
+        expected_response_global = elo.compute_expected_response(user_skill[user], difficulty[question],
+                                                                 response_time)
+        user_skill[user] += elo.compute_user_skill_delta(response, expected_response_global, k_success, k_failure)
+
+        if first:
+            difficulty[question] += elo.compute_difficulty_delta(response, expected_response, answered_users_count,
+                                                                 alpha, beta)
+
+        expected_responses.append(expected_response)
+
+    return ReplayResult(difficulty, target_time, skill, speed, user_skill, expected_responses)
+
+
+def evaluate(log: AnswerLog, result: ReplayResult) -> ReplayMetrics:
+    """
+    Evaluates expected responses of the replay against the observed responses
+    :param log: replayed answers
+    :type log: AnswerLog
+    :param result: result of the replay
+    :type result: ReplayResult
+    :return: log-loss (cross entropy of the responses), RMSE and AUC (of correct answers, see CORRECT_RESPONSE)
+    :rtype: ReplayMetrics
+    """
+
+    responses = np.frombuffer(log.response, dtype=np.float64)
+    predictions = np.clip(np.frombuffer(result.expected_responses, dtype=np.float64), 1e-15, 1 - 1e-15)
+    if len(responses) == 0:
+        return ReplayMetrics(float('nan'), float('nan'), float('nan'))
+
+    log_loss = -np.mean(responses * np.log(predictions) + (1 - responses) * np.log(1 - predictions))
+    rmse = np.sqrt(np.mean((responses - predictions) ** 2))
+
+    # Mann-Whitney U statistic with average ranks of ties
+    correct = responses >= CORRECT_RESPONSE
+    positives = np.count_nonzero(correct)
+    negatives = len(correct) - positives
+    if positives == 0 or negatives == 0:
+        auc = float('nan')
+    else:
+        values, inverse, counts = np.unique(predictions, return_inverse=True, return_counts=True)
+        ranks = (np.cumsum(counts) - (counts - 1) / 2.)[inverse]
+        auc = (ranks[correct].sum() - positives * (positives + 1) / 2.) / (positives * negatives)
+
+    return ReplayMetrics(float(log_loss), float(rmse), float(auc))
+
+
+def write_result(log: AnswerLog, result: ReplayResult):
+    """
+    Replaces ratings of questions, UserSkills and users with the result of the replay, answer counters of questions
+    are replaced with the counts of the log. The history of the model is kept as it is. The queued answers are
+    contained in the replay, so they are removed from the queue in the same transaction.
+    :param log: replayed answers
+    :type log: AnswerLog
+    :param result: result of the replay
+    :type result: ReplayResult
+    :raise ValueError: if answers were stored after the log was loaded, the log has to be loaded again
+    """
+
+    # the queue is locked before the questions in the same order as by the worker (app.engine.elo_queue.process_user),
+    # answers stored while the result is written are queued after it and applied to the result
+    db.session.execute(text('LOCK TABLE elo_update_queue, question IN EXCLUSIVE MODE'))
+    stored = db.session.execute(text(ANSWERS_COUNT_QUERY)).scalar()
+    if stored != len(log) + log.skipped:
+        db.session.rollback()
+        raise ValueError("{0} answers are stored, but the log contains {1}".format(stored, len(log) + log.skipped))
+
+    cursor = db.session.connection().connection.cursor()
+
+    execute_values(cursor,
+                   'UPDATE question SET difficulty = v.difficulty, target_time = v.target_time, '
+                   'answered_count = v.answered_count, answered_users_count = v.answered_users_count '
+                   'FROM (VALUES %s) AS v (id, difficulty, target_time, answered_count, answered_users_count) '
+                   'WHERE question.id = v.id',
+                   list(zip(log.question_ids, result.difficulty, result.target_time, log.answered_counts,
+                            log.answered_users_counts)))
+
+    execute_values(cursor,
+                   'INSERT INTO user_skill (user_id, task_id, value, speed) VALUES %s '
+                   'ON CONFLICT (task_id, user_id) DO UPDATE SET value = EXCLUDED.value, speed = EXCLUDED.speed',
+                   [(user_id, task_id, value, speed)
+                    for (user_id, task_id), value, speed in zip(log.skill_keys, result.skill, result.speed)])
+
+    execute_values(cursor,
+                   'UPDATE "user" SET skill_value = v.skill_value FROM (VALUES %s) AS v (id, skill_value) '
+                   'WHERE "user".id = v.id',
+                   list(zip(log.user_ids, result.user_skill)))
+
+    db.session.execute(text('DELETE FROM elo_update_queue'))
+    db.session.commit()
+
+
+# log replayed by processes of the sweep
+_sweep_log = None
+
+
+def _init_sweep(log: AnswerLog):
+    global _sweep_log
+    _sweep_log = log
+
+
+def _replay_parameters(parameters: EloParameters) -> tuple:
+    start = time.perf_counter()
+    result = replay(_sweep_log, parameters)
+    replay_seconds = time.perf_counter() - start
+    return parameters, evaluate(_sweep_log, result), replay_seconds
+
+
+def sweep(log: AnswerLog, parameter_sets: List[EloParameters], processes: Optional[int] = None) -> list:
+    """
+    Replays the log with each of the parameter sets in a pool of processes
+    :param log: answers to replay
+    :type log: AnswerLog
+    :param parameter_sets: parameters to replay the log with
+    :type parameter_sets: list
+    :param processes: number of processes, number of CPUs by default
+    :type processes: int
+    :return: tuples of parameters, their metrics and seconds of the replay, in the order of parameter_sets
+    :rtype: list
+    """
+
+    with multiprocessing.Pool(processes, initializer=_init_sweep, initargs=(log,)) as pool:
+        return pool.map(_replay_parameters, parameter_sets, chunksize=1)
@@ -0,0 +1,87 @@
+from typing import Iterable, List, Tuple
+
+from sqlalchemy import text
+
+from app.extensions import db
+from app.models import TaskRun
+
+
+def rebuild_answer_counts():
+    """
+    Recomputes answer counters of all questions (Question.answered_count and Question.answered_users_count) from
+    the answer history
+    """
+
+    db.session.execute(text('UPDATE question SET answered_count = 0, answered_users_count = 0'))
+    db.session.execute(text('UPDATE question SET answered_count = stats.answered_count, '
+                            'answered_users_count = stats.answered_users_count '
+                            'FROM (SELECT taskrun_question.question_id, count(*) AS answered_count, '
+                            'count(DISTINCT taskrun.user_id) AS answered_users_count FROM taskrun_question '
+                            'JOIN taskrun ON taskrun_question.taskrun_id = taskrun.id '
+                            'WHERE taskrun_question.correct IS NOT NULL '
+                            'GROUP BY taskrun_question.question_id) AS stats '
+                            'WHERE question.id = stats.question_id'))
+    db.session.commit()
+
+
+def record_answers(taskrun: TaskRun, question_ids: Iterable[int]):
+    """
+    Records new answers of the TaskRun to the statistics of its user (UserQuestionStats)
+    :param taskrun: answered TaskRun
+    :param question_ids: ids of newly answered questions
+    """
+
+    params = [{"user_id": taskrun.user_id, "question_id": question_id, "date": taskrun.date}
+              for question_id in question_ids]
+    if len(params) == 0:
+        return
+
+    db.session.execute(text('INSERT INTO user_question_stats (user_id, question_id, answered_count, last_answer_date) '
+                            'VALUES (:user_id, :question_id, 1, :date) '
+                            'ON CONFLICT (user_id, question_id) DO UPDATE SET '
+                            'answered_count = user_question_stats.answered_count + 1, '
+                            'last_answer_date = GREATEST(user_question_stats.last_answer_date, '
+                            'EXCLUDED.last_answer_date)'),
+                       params)
+
+
+# statistics of users' answers computed from the answer history, same columns as user_question_stats table
+USER_QUESTION_STATS_QUERY = ('SELECT taskrun.user_id, taskrun_question.question_id, count(*) AS answered_count, '
+                             'MAX(taskrun.date) AS last_answer_date FROM taskrun_question '
+                             'JOIN taskrun ON taskrun_question.taskrun_id = taskrun.id '
+                             'WHERE taskrun_question.correct IS NOT NULL AND taskrun.user_id IS NOT NULL '
+                             'GROUP BY taskrun.user_id, taskrun_question.question_id')
+
+
+def backfill_user_question_stats():
+    """
+    Recomputes the whole user_question_stats table from the answer history
+    """
+
+    db.session.execute(text('LOCK TABLE user_question_stats IN EXCLUSIVE MODE'))
+    db.session.execute(text('DELETE FROM user_question_stats'))
+    db.session.execute(text('INSERT INTO user_question_stats (user_id, question_id, answered_count, last_answer_date) '
+                            + USER_QUESTION_STATS_QUERY))
+    db.session.commit()
+
+
+def check_user_question_stats(limit: int = 100) -> List[Tuple]:
+    """
+    Compares user_question_stats table with the answer history
+    :param limit: maximal number of returned inconsistencies
+    :return: inconsistent rows as tuples (user_id, question_id, stored count, stored date, actual count, actual date)
+    """
+
+    rows = db.session.execute(text('SELECT COALESCE(stored.user_id, actual.user_id) AS user_id, '
+                                   'COALESCE(stored.question_id, actual.question_id) AS question_id, '
+                                   'stored.answered_count, stored.last_answer_date, '
+                                   'actual.answered_count, actual.last_answer_date '
+                                   'FROM user_question_stats AS stored '
+                                   'FULL OUTER JOIN (' + USER_QUESTION_STATS_QUERY + ') AS actual '
+                                   'ON stored.user_id = actual.user_id AND stored.question_id = actual.question_id '
+                                   'WHERE stored.answered_count IS DISTINCT FROM actual.answered_count '
+                                   'OR stored.last_answer_date IS DISTINCT FROM actual.last_answer_date '
+                                   'ORDER BY 1, 2 LIMIT :limit'),
+                              params={"limit": limit})
+
+    return [tuple(row) for row in rows]
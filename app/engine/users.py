@@ -0,0 +1,69 @@
+from collections import namedtuple
+from typing import Optional
+
+from sqlalchemy import text
+
+from app.extensions import db
+
+# columns of the user updated by every game start, included in the unique index on uuid (ix_user_uuid), so the user
+# is looked up by an index-only scan
+PROFILE_COLUMNS = ('app_version', 'language', 'is_metric', 'ip_address')
+
+UserProfile = namedtuple('UserProfile', ('id',) + PROFILE_COLUMNS)
+
+# same values as accepted for true by PostgreSQL boolean input
+TRUE_VALUES = ('t', 'true', 'y', 'yes', 'on', '1')
+
+
+def parse_boolean(value: Optional[str]) -> Optional[bool]:
+    """
+    :param value: boolean request parameter
+    :return: the parameter as a boolean, None if not present
+    """
+
+    return None if value is None else value.strip().lower() in TRUE_VALUES
+
+
+def find_user(uuid: str) -> Optional[UserProfile]:
+    """
+    Finds the user by uuid
+    :param uuid: uuid of the user
+    :return: id and profile of the user, None if there is no such user
+    """
+
+    row = db.session.execute(text('SELECT id, {0} FROM "user" WHERE uuid = :uuid'.format(', '.join(PROFILE_COLUMNS))),
+                             {"uuid": uuid}).first()
+    return UserProfile(*row) if row is not None else None
+
+
+def update_user_profile(uuid: str, profile: dict) -> UserProfile:
+    """
+    Gets or creates the user and updates the profile of the user. The user row is written only when it is created or
+    the profile changed. Users created by concurrent requests do not get duplicated, the insert of the request
+    that lost the race does nothing and the user of the other request is taken. Changes are not committed.
+    :param uuid: uuid of the user
+    :param profile: values of PROFILE_COLUMNS
+    :return: id and the updated profile of the user
+    """
+
+    user = find_user(uuid)
+
+    if user is None:
+        row = db.session.execute(text('INSERT INTO "user" (uuid, skill_value, {0}) VALUES (:uuid, 0, {1}) '
+                                      'ON CONFLICT (uuid) DO NOTHING RETURNING id'
+                                      .format(', '.join(PROFILE_COLUMNS),
+                                              ', '.join(':' + column for column in PROFILE_COLUMNS))),
+                                 dict(profile, uuid=uuid)).first()
+        if row is not None:
+            return UserProfile(id=row.id, **profile)
+
+        # the user was inserted by a concurrent request, which committed it already
+        user = find_user(uuid)
+
+    updated = UserProfile(id=user.id, **profile)
+    if updated != user:
+        db.session.execute(text('UPDATE "user" SET {0} WHERE id = :id'
+                                .format(', '.join('{0} = :{0}'.format(column) for column in PROFILE_COLUMNS))),
+                           updated._asdict())
+
+    return updated
@@ -1,4 +1,11 @@
-from app.models import Task
+from typing import Set
+
+from flask import current_app
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.engine import convert
+from app.extensions import db
+from app.models import Task, NumericQuestion, ScaleQuestion, CurrencyQuestion, CloseEndedAnswer, SortAnswer
 
 
 def get_tolerance(unit: str, value: float) -> float:
@@ -16,4 +23,38 @@ def get_tolerance(unit: str, value: float) -> float:
     elif unit == "degC":
         return 8.0
     else:
-        return value * FIXED_TOLERANCE_PERCENTS / 100
\ No newline at end of file
+        return value * FIXED_TOLERANCE_PERCENTS / 100
+
+
+def get_question_bank_units() -> Set[str]:
+    """
+    Returns all units used by questions and answers in the question bank
+    :return: set of unit identifiers
+    """
+
+    columns = [NumericQuestion.from_unit, NumericQuestion.to_unit, ScaleQuestion.from_unit, ScaleQuestion.to_unit,
+               CurrencyQuestion.from_unit, CurrencyQuestion.to_unit, CloseEndedAnswer.unit, SortAnswer.unit]
+
+    units = set()
+    for column in columns:
+        units.update(row[0] for row in db.session.query(column).distinct() if row[0])
+
+    return units
+
+
+def warm_caches():
+    """
+    Fills caches used when serializing questions, called before the first request of the worker. Failures are only
+    logged, Flask would call the hook again on every request until it succeeds.
+    """
+
+    try:
+        units = get_question_bank_units()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        current_app.logger.warning("Could not load question bank units: {}".format(e))
+        return
+
+    for unit, error in convert.warm_format_cache(units):
+        current_app.logger.warning("Could not format unit {0!r} of the question bank: {1!r}".format(unit, error))
+    current_app.logger.info("Unit format cache warmed: {}".format(convert.format_cache_info()))
@@ -2,7 +2,7 @@ from sqlalchemy import Column, Integer, ForeignKey, String, Boolean, Float
 from sqlalchemy.dialects.postgresql import ENUM
 from sqlalchemy.orm import relationship
 
-from app.engine.convert import format_unit, convert, format_value, format_quantity
+from app.engine.convert import format_unit, convert, convert_value, format_value, format_quantity
 from app.extensions import db
 
 
@@ -31,9 +31,9 @@ class ScaleHint(Hint):
 
     @classmethod
     def create_unit_hint(cls, from_unit, to_unit):
-        converted_value = convert(from_unit, 1, to_unit).magnitude
+        converted_value = convert_value(from_unit, 1, to_unit)
         if converted_value < 1:
-            converted_value = convert(to_unit, 1, from_unit).magnitude
+            converted_value = convert_value(to_unit, 1, from_unit)
             return ScaleHint(top_unit=from_unit, top_min=0, top_max=converted_value, bottom_unit=to_unit, bottom_min=0, bottom_max=1)
         else:
             return ScaleHint(top_unit=from_unit, top_min=0, top_max=1, bottom_unit=to_unit, bottom_min=0, bottom_max=converted_value)
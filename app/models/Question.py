@@ -4,7 +4,8 @@ from typing import Optional
 
 import datetime
 
-from sqlalchemy import Column, Integer, ForeignKey, String, Boolean, Float, Table, func, distinct, DateTime
+from sqlalchemy import Column, Integer, ForeignKey, String, Boolean, Float, Table, func, distinct, DateTime, Date, \
+    Index
 from sqlalchemy.dialects.postgresql import ENUM, ARRAY
 from sqlalchemy.event import listens_for
 from sqlalchemy.ext.hybrid import hybrid_property
@@ -25,15 +26,25 @@ class QuestionTaskAssociation(db.Model):
     task = relationship('Task')
 
 
+def default_initial_difficulty(context):
+    return context.current_parameters.get('difficulty') or 0
+
+
 class Question(db.Model):
     __tablename__ = 'question'
     id = Column(Integer, primary_key=True)
     target_time = Column(Float, default=0)
     difficulty = Column(Float, default=0)
-    # answered_times = Column(Integer, default=0) -- do we need this for recommendation?
+    # difficulty the question was loaded with, the model is replayed from it (see app.engine.replay)
+    initial_difficulty = Column(Float, default=default_initial_difficulty, nullable=True)
+    # denormalized answered_times() and answered_first_time_times(), maintained when answers are recorded
+    answered_count = Column(Integer, default=0, server_default='0', nullable=False)
+    answered_users_count = Column(Integer, default=0, server_default='0', nullable=False)
     implicit_hint = Column(ENUM('None', 'Text', 'Scale', name='implicit_hint'))
     type = Column(String(50))
     enabled = Column(Boolean, default=True)
+    # identifies questions loaded by load_questions.py so that reloading updates them instead of adding duplicates
+    natural_key = Column(String, nullable=True, unique=True, index=True)
 
     task_associations = relationship('QuestionTaskAssociation')
     tasks = relationship('Task', secondary='question_task_association', back_populates="questions")
@@ -81,6 +92,44 @@ class QuestionHistory(db.Model):
 
     question = relationship('Question')
 
+    __table_args__ = (Index('ix_question_history_question_id_date', 'question_id', 'date'),)
+
+
+class QuestionHistoryDaily(db.Model):
+    """
+    Daily aggregates of QuestionHistory rolled up from the old history (see app.engine.history.rollup_history)
+    """
+
+    __tablename__ = 'question_history_daily'
+    question_id = Column(Integer, ForeignKey("question.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    target_time = Column(Float)  # the last value of the day
+    difficulty = Column(Float)  # the last value of the day
+    count = Column(Integer, nullable=False)  # number of history rows of the day
+
+
+class UserQuestionStats(db.Model):
+    """
+    Statistics of user's answers of a question, maintained when answers are recorded
+    """
+
+    __tablename__ = 'user_question_stats'
+    user_id = Column(Integer, ForeignKey("user.id"), primary_key=True)
+    question_id = Column(Integer, ForeignKey("question.id"), primary_key=True)
+    answered_count = Column(Integer, default=0, nullable=False)
+    last_answer_date = Column(DateTime)  # date of the latest TaskRun with an answer to the question
+
+
+class QuestionBank(db.Model):
+    """
+    Version of the question bank (questions, their answers and task associations), bumped on every change of the bank
+    so that processes caching the bank know when to reload it
+    """
+
+    __tablename__ = 'question_bank'
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, default=0, nullable=False)
+
 
 # close ended
 
@@ -104,6 +153,7 @@ class CloseEndedAnswer(db.Model):
     value = Column(Float)  # eg. 10
     unit = Column(String)  # eg. cm
     correct = Column(Boolean)
+    title = Column(String, nullable=True)  # formatted value and unit (eg. 10 centimeters), set by load_questions.py
 
     question = relationship('CloseEndedQuestion')
 
@@ -131,14 +181,20 @@ class NumericQuestion(Question):
     from_unit = Column(String)  # eg. cm
     to_unit = Column(String)   # eg. m
     image_name = Column(String, nullable=True)
+    # precomputed by load_questions.py, computed on use for questions created otherwise
+    stored_to_value = Column('to_value', Float, nullable=True)
+    from_unit_name = Column(String, nullable=True)  # eg. centimeter
+    to_unit_name = Column(String, nullable=True)
 
     @property
     def to_value(self):
-        return convert.convert(self.from_unit, self.from_value, self.to_unit).magnitude
+        if self.stored_to_value is not None:
+            return self.stored_to_value
+        return convert.convert_value(self.from_unit, self.from_value, self.to_unit)
 
     @property
     def hint(self):
-        dimensionalities = list(convert.ureg.parse_units(self.to_unit).dimensionality)
+        dimensionalities = list(convert.get_registry().parse_units(self.to_unit).dimensionality)
         isTemperature = "[temperature]" in dimensionalities
         isCurrency = "[currency]" in dimensionalities
 
@@ -163,10 +219,16 @@ class ScaleQuestion(Question):
     from_value = Column(Float)  # eg. 10
     from_unit = Column(String)  # eg. cm
     to_unit = Column(String)   # eg. m
+    # precomputed by load_questions.py, computed on use for questions created otherwise
+    stored_to_value = Column('to_value', Float, nullable=True)
+    from_unit_name = Column(String, nullable=True)  # eg. centimeter
+    to_unit_name = Column(String, nullable=True)
 
     @property
     def to_value(self):
-        return convert.convert(self.from_unit, self.from_value, self.to_unit).magnitude
+        if self.stored_to_value is not None:
+            return self.stored_to_value
+        return convert.convert_value(self.from_unit, self.from_value, self.to_unit)
 
     __mapper_args__ = {'polymorphic_identity': 'questionScale'}
 
@@ -222,11 +284,16 @@ class SortAnswer(db.Model):
     value = Column(Float)  # eg. 10
     unit = Column(String)  # eg. cm
     presented_pos = Column(Integer)
+    # precomputed by load_questions.py, computed on use for answers created otherwise
+    stored_normalized_value = Column('normalized_value', Float, nullable=True)
+    title = Column(String, nullable=True)  # formatted value and unit (eg. 10 centimeters)
     correct_pos = None
 
     question = relationship('SortQuestion')
 
     def normalized_value(self):
+        if self.stored_normalized_value is not None:
+            return self.stored_normalized_value
         return convert.to_normalized(self.unit, self.value)
 
     @property
@@ -257,10 +324,13 @@ class CurrencyQuestion(Question):
     from_value = Column(Float)  # eg. 10
     from_unit = Column(String)  # eg. CZK
     to_unit = Column(String)   # eg. EUR
+    # set by load_questions.py, to_value is always converted with the current exchange rates
+    from_unit_name = Column(String, nullable=True)
+    to_unit_name = Column(String, nullable=True)
 
     @hybrid_property
     def to_value(self):
-        return convert.convert(self.from_unit, self.from_value, self.to_unit).magnitude
+        return convert.convert_value(self.from_unit, self.from_value, self.to_unit)
 
     @property
     def hint(self):
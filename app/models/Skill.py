@@ -1,7 +1,6 @@
 import datetime
-from sqlalchemy import Column, Integer, ForeignKey, String, DateTime, Boolean, Float, Table
+from sqlalchemy import Column, Integer, ForeignKey, String, DateTime, Date, Boolean, Float, Table, Index
 from sqlalchemy.orm import relationship
-from sqlalchemy.event import listens_for
 
 from app.extensions import db
 
@@ -19,6 +18,10 @@ class User(db.Model):
     skills = relationship('UserSkill', back_populates="user")
     taskruns = relationship('TaskRun', back_populates="user")
 
+    # users are looked up and created by uuid (app.engine.users), the migration includes the profile columns in the
+    # index so that the lookup is an index-only scan
+    __table_args__ = (Index('ix_user_uuid', 'uuid', unique=True),)
+
 
 class UserSkill(db.Model):
     __tablename__ = 'user_skill'
@@ -39,12 +42,6 @@ class UserSkill(db.Model):
     user = relationship('User')
 
 
-@listens_for(UserSkill, 'before_update')
-def create_history_record(mapper, connect, self):
-    history = UserSkillHistory(task_id=self.task_id, user_id=self.user_id, value=self.value)
-    db.session.add(history)
-
-
 class UserSkillHistory(db.Model):
     __tablename__ = 'user_skill_history'
     id = Column(Integer, primary_key=True)
@@ -52,3 +49,18 @@ class UserSkillHistory(db.Model):
     user_id = Column(Integer, ForeignKey('user.id'))
     value = Column(Float, default=0)
     date = Column(DateTime, default=datetime.datetime.utcnow)
+
+    __table_args__ = (Index('ix_user_skill_history_user_id_task_id_date', 'user_id', 'task_id', 'date'),)
+
+
+class UserSkillHistoryDaily(db.Model):
+    """
+    Daily aggregates of UserSkillHistory rolled up from the old history (see app.engine.history.rollup_history)
+    """
+
+    __tablename__ = 'user_skill_history_daily'
+    user_id = Column(Integer, ForeignKey('user.id'), primary_key=True)
+    task_id = Column(Integer, ForeignKey('task.id'), primary_key=True)
+    day = Column(Date, primary_key=True)
+    value = Column(Float)  # the last value of the day
+    count = Column(Integer, nullable=False)  # number of history rows of the day
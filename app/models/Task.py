@@ -2,7 +2,8 @@ import datetime
 from typing import Optional
 
 import math
-from sqlalchemy import Column, Integer, ForeignKey, String, DateTime, Boolean, Float, select, func, join, sql
+from sqlalchemy import Column, Integer, ForeignKey, String, DateTime, Boolean, Float, select, func, join, sql, \
+    Index, text, Text
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import relationship, column_property, aliased
@@ -47,6 +48,8 @@ class TaskRun(db.Model):
     task_id = Column(Integer, ForeignKey("task.id"))
     user_id = Column(Integer, ForeignKey("user.id"))
     date = Column(DateTime, default=datetime.datetime.utcnow)
+    # date of the last answers sent, the date of the start until answered (exported by, see app.engine.export)
+    answer_date = Column(DateTime, default=datetime.datetime.utcnow)
     completed = Column(Boolean, nullable=True)
     summary = Column(JSONB, nullable=True)
 
@@ -54,6 +57,10 @@ class TaskRun(db.Model):
     user = relationship("User", back_populates="taskruns")
     questions = relationship("TaskRunQuestion", back_populates="taskrun", order_by="TaskRunQuestion.position")
 
+    # answers of an user (fetch_first_attempts(), TaskRunQuestion.is_users_first_attempt), TaskRuns to export
+    __table_args__ = (Index('ix_taskrun_user_id_id', 'user_id', 'id'),
+                      Index('ix_taskrun_answer_date_id', 'answer_date', 'id'))
+
     def corresponding_skill(self, create_if_none=True) -> UserSkill:
         """
         Returns skill corresponding to the user and the question of the TaskRunQuestion
@@ -89,6 +96,11 @@ class TaskRunQuestion(db.Model):
     taskrun = relationship("TaskRun")
     question = relationship("Question")
 
+    # answers of a question (fetch_first_attempts(), TaskRunQuestion.is_users_first_attempt), the primary key covers
+    # answers of a TaskRun
+    __table_args__ = (Index('ix_taskrun_question_question_id_answered', 'question_id', 'taskrun_id',
+                            postgresql_where=text('correct IS NOT NULL')),)
+
     @hybrid_property
     def is_users_first_attempt(self) -> bool:
         """
@@ -111,28 +123,56 @@ class TaskRunQuestion(db.Model):
         :return: score [0, 1] of the answer, null if question not answered yet
         """
 
-        if self.correct is None:
-            return None
+        return compute_score(self.correct, self.hint_shown, self.answer)
+
 
-        if self.correct:
-            # answer was correct
+def compute_score(correct: Optional[bool], hint_shown: Optional[bool], answer: dict) -> Optional[float]:
+    """
+    Computes score of an answer (how good the answer was), see TaskRunQuestion.get_score()
+    :param correct: whether the answer was correct, null if question not answered yet
+    :param hint_shown: whether the hint was shown
+    :param answer: details of the answer sent by the app
+    :return: score [0, 1] of the answer, null if question not answered yet
+    """
 
-            if self.hint_shown:
-                # hint was shown - user did not answer correctly on the first try and needed hint
-                return 0.2
-            else:
-                # user answered correctly on first try without using hint
-                accuracy = 1
+    if correct is None:
+        return None
 
-                if 'answer' in self.answer and 'tolerance' in self.answer and 'correctAnswer' in self.answer:
-                    answer, tolerance, correctAnswer = float(self.answer["answer"]), float(
-                        self.answer["tolerance"]), float(self.answer["correctAnswer"])
-                    correctAnswer = round(correctAnswer)
-                    
-                    # question has allowed tolerance, can adjust accuracy analyzing that
-                    accuracy = 1 - (abs(correctAnswer - answer) / tolerance)
+    if correct:
+        # answer was correct
 
-                return 0.6 + 0.4 * accuracy
+        if hint_shown:
+            # hint was shown - user did not answer correctly on the first try and needed hint
+            return 0.2
         else:
-            # answer was not correct
-            return 0
+            # user answered correctly on first try without using hint
+            accuracy = 1
+
+            if 'answer' in answer and 'tolerance' in answer and 'correctAnswer' in answer:
+                value, tolerance, correctAnswer = float(answer["answer"]), float(
+                    answer["tolerance"]), float(answer["correctAnswer"])
+                correctAnswer = round(correctAnswer)
+
+                # question has allowed tolerance, can adjust accuracy analyzing that
+                accuracy = 1 - (abs(correctAnswer - value) / tolerance)
+
+            return 0.6 + 0.4 * accuracy
+    else:
+        # answer was not correct
+        return 0
+
+
+class EloUpdate(db.Model):
+    """
+    Answer waiting in the queue for the update of the model, see app.engine.elo_queue
+    """
+
+    __tablename__ = 'elo_update_queue'
+    # an answer is queued only once, when it is stored
+    __table_args__ = (Index('ix_elo_update_queue_taskrun_id_question_id', 'taskrun_id', 'question_id', unique=True),)
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("user.id"), index=True)
+    taskrun_id = Column(Integer, ForeignKey("taskrun.id"))
+    question_id = Column(Integer, ForeignKey("question.id"))
+    # error of the answer which could not be applied, the answer is set aside and skipped by the worker
+    error = Column(Text)
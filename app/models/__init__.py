@@ -1,5 +1,5 @@
-from .Task import Task, TaskRun, TaskRunQuestion
+from .Task import Task, TaskRun, TaskRunQuestion, EloUpdate
 from .Question import Question, CloseEndedAnswer, CloseEndedQuestion, NumericQuestion, ScaleQuestion, SortAnswer, \
-    SortQuestion, CurrencyQuestion, QuestionHistory
+    SortQuestion, CurrencyQuestion, QuestionHistory, QuestionHistoryDaily, UserQuestionStats, QuestionBank
 from .Hint import Hint, ScaleHint, TextHint
-from .Skill import User, UserSkill
+from .Skill import User, UserSkill, UserSkillHistory, UserSkillHistoryDaily
@@ -1,6 +1,7 @@
 from marshmallow import Schema, fields
 
 from app.models import ScaleHint, TextHint
+from app.serialization.compiler import compile_schema
 
 
 class HintSchema(Schema):
@@ -30,4 +31,26 @@ class ScaleHintSchema(HintSchema):
 
 
 class TextHintSchema(HintSchema):
-    text = fields.String()
\ No newline at end of file
+    text = fields.String()
+
+
+# compiled serializers of hints by their classes, same output as task_schema_serialization_disambiguation
+hint_serializers = {
+    ScaleHint: compile_schema(ScaleHintSchema),
+    TextHint: compile_schema(TextHintSchema),
+}
+
+
+def dump_hint(hint) -> dict:
+    """
+    Serializes the hint by the compiled serializer of its class
+    :param hint: hint to serialize
+    :return: serialized hint
+    """
+
+    try:
+        serialize = hint_serializers[hint.__class__]
+    except KeyError:
+        raise TypeError("Could not detect type.")
+
+    return serialize(hint)
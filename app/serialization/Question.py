@@ -1,8 +1,8 @@
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
 import random
 
 from flask import logging, url_for
-from marshmallow import Schema, fields, post_load, pre_load
+from marshmallow import Schema, fields, post_load, pre_load, missing
 from marshmallow_polyfield import PolyField
 from marshmallow.decorators import post_dump
 
@@ -10,12 +10,23 @@ from app.engine.utils import get_tolerance
 from app.models import NumericQuestion, ScaleQuestion, SortQuestion, CloseEndedQuestion, CurrencyQuestion, TextHint, \
     Hint
 from app.engine.convert import format_unit, format_value, format_number, format_quantity
-from app.serialization.Hint import TextHintSchema, task_schema_serialization_disambiguation
+from app.serialization.Hint import TextHintSchema, task_schema_serialization_disambiguation, dump_hint
+from app.serialization.compiler import compile_schema
+from app.serialization.encoding import encode, encode_members, encode_object
 
 
 class UnitField(fields.Field):
+    """
+    Unit name, the name precomputed in the name_attribute of the object is used when present
+    """
+
+    def __init__(self, name_attribute=None, **kwargs):
+        super(UnitField, self).__init__(**kwargs)
+        self.name_attribute = name_attribute
+
     def _serialize(self, value, attr, obj):
-        return format_unit(value)
+        name = getattr(obj, self.name_attribute, None) if self.name_attribute else None
+        return name or format_unit(value)
 
 
 class QuestionSchema(Schema):
@@ -58,10 +69,119 @@ def question_schema_serialization_disambiguation(base_object, _):
     raise TypeError("Could not detect type.")
 
 
+# static parts of serialized questions (without keys of DYNAMIC_QUESTION_KEYS), keyed by question id
+rendered_questions = {}
+
+# keys of serialized question that may change between requests
+DYNAMIC_QUESTION_KEYS = ('targetTime', 'hint')
+
+# static part of a question encoded into JSON: members of the object without the answers and the encoded answers,
+# which are shuffled for every request (None if the question has no answers)
+EncodedQuestion = namedtuple('EncodedQuestion', ['members', 'answers'])
+
+# encoded static parts of questions, keyed by question id
+encoded_questions = {}
+
+
+def render_static_question(question) -> dict:
+    """
+    Serializes parts of the question that do not change between requests
+    :param question: question to serialize
+    :return: serialized question without keys of DYNAMIC_QUESTION_KEYS
+    """
+
+    try:
+        serialize = static_question_serializers[question.__class__]
+    except KeyError:
+        raise TypeError("Could not detect type.")
+
+    return serialize(question)
+
+
+def dump_question(question) -> dict:
+    """
+    Serializes the question, the static part is rendered only once and then reused
+    :param question: question to serialize
+    :return: serialized question, same as dumped by its schema
+    """
+
+    static_data = rendered_questions.get(question.id)
+    if static_data is None:
+        static_data = render_static_question(question)
+        rendered_questions[question.id] = static_data
+
+    data = dict(static_data)
+    data['targetTime'] = question.expected_time()
+
+    hint = getattr(question, 'hint', missing)
+    if hint is not missing:
+        data['hint'] = dump_hint(hint) if hint is not None else None
+
+    if 'answers' in data:
+        data['answers'] = list(data['answers'])
+        random.shuffle(data['answers'])
+
+    return data
+
+
+def encode_static_question(question) -> EncodedQuestion:
+    """
+    Encodes parts of the question that do not change between requests into JSON fragments
+    :param question: question to encode
+    :return: encoded static part of the question
+    """
+
+    static_data = rendered_questions.get(question.id)
+    if static_data is None:
+        static_data = render_static_question(question)
+        rendered_questions[question.id] = static_data
+
+    members = dict(static_data)
+    answers = members.pop('answers', None)
+    return EncodedQuestion(encode_members(members), [encode(answer) for answer in answers] if answers is not None
+                           else None)
+
+
+def encode_question(question) -> bytes:
+    """
+    Encodes the question into JSON, same as encode(dump_question(question)) but the static part is encoded only once
+    and then reused
+    :param question: question to encode
+    :return: encoded question
+    """
+
+    encoded = encoded_questions.get(question.id)
+    if encoded is None:
+        encoded = encode_static_question(question)
+        encoded_questions[question.id] = encoded
+
+    dynamic_data = {'targetTime': question.expected_time()}
+    hint = getattr(question, 'hint', missing)
+    if hint is not missing:
+        dynamic_data['hint'] = dump_hint(hint) if hint is not None else None
+
+    answers = b''
+    if encoded.answers is not None:
+        shuffled = list(encoded.answers)
+        random.shuffle(shuffled)
+        answers = b'"answers":[' + b','.join(shuffled) + b']'
+
+    return encode_object(encoded.members, encode_members(dynamic_data), answers)
+
+
+def clear_rendered_questions():
+    """
+    Removes all cached static parts of serialized and encoded questions
+    """
+
+    rendered_questions.clear()
+    encoded_questions.clear()
+
+
 # close ended
 
 class CloseEndedAnswerSchema(Schema):
-    answer = fields.Function(lambda obj: format_value(obj.unit, obj.value))
+    answer = fields.Function(lambda obj: obj.title or format_value(obj.unit, obj.value))
     explanation = fields.String()
     correct = fields.Boolean()
 
@@ -100,8 +220,8 @@ class CloseEndedQuestionSchema(QuestionSchema):
 
 class NumericQuestionSchema(QuestionSchema):
     fromValue = fields.Float(attribute="from_value")
-    fromUnit = UnitField(attribute="from_unit")
-    toUnit = UnitField(attribute="to_unit")
+    fromUnit = UnitField(attribute="from_unit", name_attribute="from_unit_name")
+    toUnit = UnitField(attribute="to_unit", name_attribute="to_unit_name")
     toValue = fields.Float(attribute="to_value")
     tolerance = fields.Function(lambda obj: get_tolerance(obj.to_unit, obj.to_value))
     imagePath = fields.Method("get_image_path")
@@ -110,8 +230,8 @@ class NumericQuestionSchema(QuestionSchema):
 class ScaleQuestionSchema(QuestionSchema):
     question = fields.Method("get_task")
     fromValue = fields.Float(attribute="from_value")
-    fromUnit = UnitField(attribute="from_unit")
-    toUnit = UnitField(attribute="to_unit")
+    fromUnit = UnitField(attribute="from_unit", name_attribute="from_unit_name")
+    toUnit = UnitField(attribute="to_unit", name_attribute="to_unit_name")
     correctValue = fields.Float(attribute="to_value")
     correctTolerance = fields.Function(lambda obj: get_tolerance(obj.to_unit, obj.scale_max - obj.scale_min))
     scaleMin = fields.Float(attribute="scale_min")
@@ -119,13 +239,14 @@ class ScaleQuestionSchema(QuestionSchema):
 
     @staticmethod
     def get_task(obj):
-        return "Convert {} to {}".format(format_value(obj.from_unit, obj.from_value), format_unit(obj.to_unit))
+        return "Convert {} to {}".format(format_value(obj.from_unit, obj.from_value),
+                                         obj.to_unit_name or format_unit(obj.to_unit))
 
 
 # sort
 
 class SortAnswerSchema(Schema):
-    title = fields.Function(lambda obj: format_value(obj.unit, obj.value))
+    title = fields.Function(lambda obj: obj.title or format_value(obj.unit, obj.value))
     correctPosition = fields.Integer(attribute="correct_pos")
     presentedPosition = fields.Integer(attribute="presented_pos")
     errorExplanation = fields.String(attribute="explanation")
@@ -149,8 +270,8 @@ class SortQuestionSchema(QuestionSchema):
 
 class CurrencySchema(QuestionSchema):
     fromValue = fields.Float(attribute="from_value")
-    fromCurrency = UnitField(attribute="from_unit")
-    toCurrency = UnitField(attribute="to_unit")
+    fromCurrency = UnitField(attribute="from_unit", name_attribute="from_unit_name")
+    toCurrency = UnitField(attribute="to_unit", name_attribute="to_unit_name")
     toValue = fields.Float(attribute="to_value")
     tolerance = fields.Function(lambda obj: get_tolerance(obj.to_unit, obj.to_value))
     availableNotes = fields.Method("get_available_notes")
@@ -185,4 +306,22 @@ class CurrencySchema(QuestionSchema):
         if count is not None:
             note["count"] = count
 
-        return note
\ No newline at end of file
+        return note
+
+
+# schemas of question classes, same as selected by question_schema_serialization_disambiguation
+QUESTION_SCHEMAS = {
+    NumericQuestion: NumericQuestionSchema,
+    ScaleQuestion: ScaleQuestionSchema,
+    SortQuestion: SortQuestionSchema,
+    CloseEndedQuestion: CloseEndedQuestionSchema,
+    CurrencyQuestion: CurrencySchema,
+}
+
+# serializers compiled from the schemas once, the full ones and the ones rendering only the static parts, which keep
+# the answers in their order (they are shuffled for every request by dump_question(), same as by randomize_answers)
+question_serializers = dict((question_class, compile_schema(schema))
+                            for question_class, schema in QUESTION_SCHEMAS.items())
+static_question_serializers = dict((question_class, compile_schema(schema, exclude=DYNAMIC_QUESTION_KEYS,
+                                                                   post_dump=False))
+                                   for question_class, schema in QUESTION_SCHEMAS.items())
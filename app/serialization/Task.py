@@ -1,8 +1,11 @@
 from marshmallow import Schema, fields, post_load
-from marshmallow_polyfield import PolyField
+from sqlalchemy.orm import with_polymorphic, joinedload, subqueryload
 
+from app.models import Question, TaskRun
 from app.models.Task import TaskRunQuestion
-from app.serialization.Question import question_schema_serialization_disambiguation
+from app.serialization.Question import dump_question, encode_question
+from app.serialization.compiler import compile_schema
+from app.serialization.encoding import encode_members, encode_object
 
 
 class TaskSchema(Schema):
@@ -12,7 +15,7 @@ class TaskSchema(Schema):
 
 
 class TaskRunQuestionSchema(Schema):
-    question = PolyField(serialization_schema_selector=question_schema_serialization_disambiguation)
+    question = fields.Function(lambda obj: dump_question(obj.question))
 
     @post_load
     def make_object(self, data):
@@ -30,4 +33,69 @@ class TaskRunSchema(Schema):
 task_schema = TaskSchema()
 tasks_schema = TaskSchema(many=True)
 
-taskrun_schema = TaskRunSchema()
\ No newline at end of file
+taskrun_schema = TaskRunSchema()
+
+# compiled serializer producing the same output as taskrun_schema.dump(taskrun).data
+dump_taskrun = compile_schema(TaskRunSchema)
+# serializer of the TaskRun without its questions, which are encoded from pre-encoded fragments
+dump_taskrun_members = compile_schema(TaskRunSchema, exclude=('questions',))
+
+
+def encode_taskrun(taskrun: TaskRun) -> bytes:
+    """
+    Encodes the TaskRun into JSON, same as encode(dump_taskrun(taskrun)) but static parts of the questions are reused
+    pre-encoded
+    :param taskrun: TaskRun to encode
+    :return: encoded TaskRun
+    """
+
+    questions = b'"questions":[' + b','.join(encode_question(taskrun_question.question)
+                                            for taskrun_question in taskrun.questions) + b']'
+    return encode_object(encode_members(dump_taskrun_members(taskrun)), questions)
+
+
+def encode_taskruns(taskruns: list) -> bytes:
+    """
+    Encodes the TaskRuns generated at once into JSON object with the list of them under "taskruns"
+    :param taskruns: TaskRuns to encode
+    :return: encoded TaskRuns
+    """
+
+    return b'{"taskruns":[' + b','.join(encode_taskrun(taskrun) for taskrun in taskruns) + b']}'
+
+
+def taskrun_loading_options() -> list:
+    """
+    Returns query options loading everything needed to serialize a TaskRun by taskrun_schema: its questions with
+    columns of all question types (joined) and answers of the questions (one query per question type with answers).
+    Questions of the answers (used by their explanations) are then taken from the session without a query.
+    :return: query options for TaskRun query
+    """
+
+    question = with_polymorphic(Question, '*', flat=True)
+    questions = joinedload(TaskRun.questions).joinedload(TaskRunQuestion.question.of_type(question))
+
+    return [questions.subqueryload(question.CloseEndedQuestion.answers),
+            questions.subqueryload(question.SortQuestion.answers)]
+
+
+def load_taskrun(taskrun_id: int) -> TaskRun:
+    """
+    Loads TaskRun for serialization with a fixed number of queries
+    :param taskrun_id: id of the TaskRun to load
+    :return: loaded TaskRun
+    """
+
+    return TaskRun.query.options(*taskrun_loading_options()).filter(TaskRun.id == taskrun_id).one()
+
+
+def load_taskruns(taskrun_ids: list) -> list:
+    """
+    Loads TaskRuns for serialization with the same number of queries as a single one
+    :param taskrun_ids: ids of the TaskRuns to load
+    :return: loaded TaskRuns in the order of the ids
+    """
+
+    taskruns = dict((taskrun.id, taskrun) for taskrun in
+                    TaskRun.query.options(*taskrun_loading_options()).filter(TaskRun.id.in_(taskrun_ids)))
+    return [taskruns[taskrun_id] for taskrun_id in taskrun_ids]
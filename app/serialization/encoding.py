@@ -0,0 +1,109 @@
+import json
+from collections import namedtuple
+
+from flask import Response
+
+from app.config import config
+
+# JSON backend encoding values into UTF-8 bytes
+JsonBackend = namedtuple('JsonBackend', ['name', 'dumps'])
+
+# backends tried in this order when JSON_BACKEND is "auto", the stdlib json is always available
+JSON_BACKENDS = ('orjson', 'ujson', 'json')
+
+
+def stdlib_dumps(value) -> bytes:
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def load_json_backend(name: str) -> JsonBackend:
+    """
+    Loads the JSON backend, all backends produce compact JSON without escaping of non-ASCII characters
+    :param name: name of the backend (one of JSON_BACKENDS)
+    :return: the backend
+    :raise ImportError: if the library of the backend is not installed
+    """
+
+    if name == 'orjson':
+        import orjson
+        return JsonBackend(name, orjson.dumps)
+    if name == 'ujson':
+        import ujson
+        return JsonBackend(name, lambda value: ujson.dumps(value, ensure_ascii=False).encode('utf-8'))
+    if name == 'json':
+        return JsonBackend(name, stdlib_dumps)
+
+    raise ValueError("Unknown JSON backend {0}".format(name))
+
+
+def available_json_backends() -> list:
+    """
+    :return: names of the backends which libraries are installed
+    """
+
+    available = []
+    for name in JSON_BACKENDS:
+        try:
+            load_json_backend(name)
+            available.append(name)
+        except ImportError:
+            pass
+    return available
+
+
+def select_json_backend(name: str) -> JsonBackend:
+    """
+    Selects the backend used by encode()
+    :param name: name of the backend or "auto" for the first installed one of JSON_BACKENDS
+    :return: the selected backend
+    """
+
+    global _backend
+
+    _backend = load_json_backend(available_json_backends()[0] if name == 'auto' else name)
+    return _backend
+
+
+_backend = select_json_backend(config.JSON_BACKEND)
+
+
+def encode(value) -> bytes:
+    """
+    Encodes the value into JSON by the selected backend
+    :param value: value made of dicts, lists, strings, numbers, booleans and None
+    :return: compact UTF-8 encoded JSON
+    """
+
+    return _backend.dumps(value)
+
+
+def encode_members(data: dict) -> bytes:
+    """
+    Encodes members of the object without the enclosing braces, so that they can be joined with other members
+    :param data: object to encode
+    :return: encoded members separated by commas, empty for an empty object
+    """
+
+    return encode(data)[1:-1]
+
+
+def encode_object(*members: bytes) -> bytes:
+    """
+    Joins encoded members (from encode_members() or pre-encoded fragments) into an object
+    :param members: encoded members, empty ones are skipped
+    :return: encoded object
+    """
+
+    return b'{' + b','.join(member for member in members if member) + b'}'
+
+
+def json_response(body: bytes) -> Response:
+    """
+    Creates the response of the encoded JSON, compressed by Flask-Compress according to COMPRESS_MIN_SIZE and
+    COMPRESS_LEVEL
+    :param body: encoded JSON
+    :return: the response
+    """
+
+    return Response(body, mimetype='application/json')
+
@@ -1,7 +1,7 @@
+set -e
+
 python run.py initdb;
-python load_questions.py csv/closeended.csv closeended;
-python load_questions.py csv/numeric.csv numeric;
-python load_questions.py csv/scale.csv scale;
-python load_questions.py csv/sort.csv sort;
-python load_questions.py csv/currency.csv currency;
+python migrate.py db upgrade;
+python run.py dump_registry;
+python load_questions.py csv;
 # python run.py run;
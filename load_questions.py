@@ -1,16 +1,49 @@
+import os
 import sys
 import csv
+import itertools
+import time
+from collections import namedtuple, OrderedDict
+
+from psycopg2.extras import execute_values
 
 from app.app import create_app
 from app.config import config
 from app.models import *
+from app.engine import bank, convert
 from app.extensions import db
-from app.models.Question import QuestionTaskAssociation
 
 app = create_app(config)
 db.init_app(app)
 db.app = app
 
+# rows of a CSV file parsed, validated and written at once
+BATCH_SIZE = 1000
+
+# question parsed from a CSV row
+# key: natural key of the question (see question_key)
+# difficulty: initial difficulty
+# values: values of the columns of the question type table (QuestionLoader.columns)
+# associations: (task id, unit system constraint) of tasks of the question
+# answers: values of the columns of the answer table (QuestionLoader.answer_columns), starting with value and unit
+# unit_pairs: (from unit, to unit) conversions the question needs
+# conversion: (from value, from unit, to unit) of the converted amount of the question, None for questions without it
+ParsedQuestion = namedtuple('ParsedQuestion', ['key', 'difficulty', 'values', 'associations', 'answers',
+                                               'unit_pairs', 'conversion'])
+
+# loader of a CSV file type
+# model: Question subclass
+# columns: columns of the question type table filled from CSV besides id
+# updated_columns: columns updated when the question is loaded again (the others are part of its natural key)
+# answer_model, answer_columns: answer table and its columns filled from CSV besides question_id (answers are
+# inserted only with new questions)
+# parse: function parsing a CSV row to a ParsedQuestion, returns None for rows to skip
+# derived_columns, answer_derived_columns: columns precomputed by precompute_units, updated on every load (question
+# columns to_value, from_unit_name, to_unit_name, answer columns normalized_value, title)
+QuestionLoader = namedtuple('QuestionLoader', ['model', 'columns', 'updated_columns', 'answer_model',
+                                               'answer_columns', 'parse', 'derived_columns',
+                                               'answer_derived_columns'])
+
 
 def get_tasks():
     tasks = db.session.query(Task).all()
@@ -21,129 +54,378 @@ def get_tasks():
     return tasks_dict
 
 
-def load_numeric(file):
-    tasks = get_tasks()
-    questions = []
-
-    for row in file:
-        task_name = row[0]
-
-        if len(task_name) > 0 and task_name in tasks:
-            global question
-            if len(row[5]) > 0:
-                question = NumericQuestion(difficulty=float(row[1].replace(',','.')), from_value=float(row[2].replace(',','.')), from_unit=row[3], to_unit=row[4], image_name=row[5], tasks=[tasks[task_name]])
-            else:
-                question = NumericQuestion(difficulty=float(row[1].replace(',','.')), from_value=float(row[2].replace(',','.')), from_unit=row[3], to_unit=row[4], tasks=[tasks[task_name]])
-
-            questions.append(question)
-
-    db.session.add_all(questions)
-    db.session.commit()
-
-
-def load_sort(file):
-    tasks = get_tasks()
-    questions = []
-
-    for row in file:
-        task_name = row[0]
-
-        if len(task_name) > 0 and len(row[1]) > 0 and task_name in tasks:
-            dimensionality = task_name.split('_')[0]
-            question = SortQuestion(difficulty=float(row[2].replace(',','.')), dimensionality=dimensionality, order=row[1], tasks=[tasks[task_name]])
-            questions.append(question)
-
-            for i in range(0,4):
-                value = row[3+i*2]
-                unit = row[4+i*2]
-
-                if len(value) > 0 and len(unit) > 0:
-                    questions.append(SortAnswer(question=question, value=value, unit=unit, presented_pos=i))
-
-    db.session.add_all(questions)
-    db.session.commit()
+def number(value):
+    return float(value.replace(',', '.'))
+
+
+def question_key(*parts):
+    """
+    Joins parts of the natural key of a question, numbers are formatted the same way as PostgreSQL prints them (see
+    the question_natural_key migration). Repeated rows of a file get the number of the occurrence appended (see
+    load_file), so reloading keeps them as separate questions.
+    """
+
+    return '|'.join('{0:.15g}'.format(part) if isinstance(part, float) else part for part in parts)
+
+
+def parse_numeric(row, tasks):
+    task_name = row[0]
+    if len(task_name) == 0 or task_name not in tasks:
+        return None
+
+    from_value = number(row[2])
+    return ParsedQuestion(key=question_key('numeric', task_name, from_value, row[3], row[4]),
+                          difficulty=number(row[1]),
+                          values=(from_value, row[3], row[4], row[5] or None),
+                          associations=[(tasks[task_name].id, None)],
+                          answers=[],
+                          unit_pairs=[(row[3], row[4])],
+                          conversion=(from_value, row[3], row[4]))
+
+
+def parse_sort(row, tasks):
+    task_name = row[0]
+    if len(task_name) == 0 or len(row[1]) == 0 or task_name not in tasks:
+        return None
+
+    answers = []
+    for i in range(0, 4):
+        value = row[3 + i * 2]
+        unit = row[4 + i * 2]
+
+        if len(value) > 0 and len(unit) > 0:
+            answers.append((number(value), unit, i))
+
+    dimensionality = task_name.split('_')[0]
+    return ParsedQuestion(key=question_key('sort', task_name, row[1],
+                                           *('{0:.15g} {1}'.format(value, unit) for value, unit, _ in answers)),
+                          difficulty=number(row[2]),
+                          values=(dimensionality, row[1]),
+                          associations=[(tasks[task_name].id, None)],
+                          answers=answers,
+                          unit_pairs=[(unit, answers[0][1]) for _, unit, _ in answers],
+                          conversion=None)
+
+
+def parse_scale(row, tasks):
+    task_name = row[0]
+    if len(task_name) == 0 or task_name not in tasks:
+        return None
+
+    from_value = number(row[2])
+    return ParsedQuestion(key=question_key('scale', task_name, from_value, row[3], row[4]),
+                          difficulty=number(row[1]),
+                          values=(from_value, row[3], row[4], number(row[5]), number(row[6])),
+                          associations=[(tasks[task_name].id, None)],
+                          answers=[],
+                          unit_pairs=[(row[3], row[4])],
+                          conversion=(from_value, row[3], row[4]))
+
+
+def parse_closeended(row, tasks):
+    task_name = row[0]
+    if len(task_name) == 0 or len(row[5]) == 0 or task_name not in tasks:
+        return None
+
+    associations = [(tasks[task_name].id, None)]
+
+    # check if question can be assigned as a dependent question to 'combined' task
+    q_type = row[1].split("_")
+    q_task = task_name.split("_")
+    if q_type[0] == "estimate" and len(q_task) == 2 and (q_task[1] == "m" or q_task[1] == "i") and \
+            q_task[0] + "_c" in tasks:
+        unit = "metric" if q_task[1] == "m" else "imperial"
+        associations.append((tasks[q_task[0] + "_c"].id, unit))
+
+    answers = []
+    for i in range(0, 3):
+        value = row[6 + i * 3]
+        unit = row[7 + i * 3]
+        correct = row[8 + i * 3]
+
+        if len(value) > 0 and len(unit) > 0 and len(correct) > 0:
+            answers.append((number(value), unit, correct.lower() == "true"))
+
+    # explanations of the answers are converted to the unit of the correct one
+    correct_units = [unit for _, unit, correct in answers if correct]
+    return ParsedQuestion(key=question_key('closeended', task_name, row[1], row[3],
+                                           *('{0:.15g} {1}'.format(value, unit) for value, unit, _ in answers)),
+                          difficulty=number(row[5]),
+                          values=(row[1], row[2], row[3], row[4] or None),
+                          associations=associations,
+                          answers=answers,
+                          unit_pairs=[(unit, correct_units[0]) for _, unit, _ in answers if len(correct_units) > 0],
+                          conversion=None)
+
+
+def parse_currency(row, tasks):
+    task_name = row[0]
+    if len(task_name) == 0 or task_name not in tasks:
+        return None
+
+    from_value = number(row[2])
+    return ParsedQuestion(key=question_key('currency', task_name, from_value, row[3], row[4]),
+                          difficulty=number(row[1]),
+                          values=(from_value, row[3], row[4]),
+                          associations=[(tasks[task_name].id, None)],
+                          answers=[],
+                          unit_pairs=[(row[3], row[4])],
+                          conversion=(from_value, row[3], row[4]))
+
+
+# loaders by the CSV file type in the order of loading
+LOADERS = OrderedDict([
+    ("closeended", QuestionLoader(CloseEndedQuestion, ('question_type', 'question_cz', 'question_en', 'image_name'),
+                                  ('question_cz', 'image_name'), CloseEndedAnswer, ('value', 'unit', 'correct'),
+                                  parse_closeended, (), ('title',))),
+    ("numeric", QuestionLoader(NumericQuestion, ('from_value', 'from_unit', 'to_unit', 'image_name'),
+                               ('image_name',), None, (), parse_numeric,
+                               ('to_value', 'from_unit_name', 'to_unit_name'), ())),
+    ("scale", QuestionLoader(ScaleQuestion, ('from_value', 'from_unit', 'to_unit', 'scale_min', 'scale_max'),
+                             ('scale_min', 'scale_max'), None, (), parse_scale,
+                             ('to_value', 'from_unit_name', 'to_unit_name'), ())),
+    ("sort", QuestionLoader(SortQuestion, ('dimensionality', 'order'), (), SortAnswer,
+                            ('value', 'unit', 'presented_pos'), parse_sort, (), ('normalized_value', 'title'))),
+    # converted amounts of currencies depend on the current exchange rates, so they are not stored
+    ("currency", QuestionLoader(CurrencyQuestion, ('from_value', 'from_unit', 'to_unit'), (), None, (),
+                                parse_currency, ('from_unit_name', 'to_unit_name'), ())),
+])
+
+
+def question_units(question):
+    """
+    Returns all units the question uses
+    """
+
+    units = set(unit for pair in question.unit_pairs for unit in pair)
+    units.update(answer[1] for answer in question.answers)
+    if question.conversion is not None:
+        units.update(question.conversion[1:])
+
+    return units
+
+
+def precompute_units(loader, questions):
+    """
+    Checks units of the batch and precomputes the values derived from them, so that they are not computed when the
+    questions are served. Every distinct unit is parsed and every distinct conversion is resolved once, converted
+    amounts are computed by one pass over the batch.
+    :param loader: loader of the questions
+    :param questions: (line, ParsedQuestion) of the batch
+    :return: (valid questions with values of the derived columns appended to values and answers,
+    [(line, error)] of the invalid ones)
+    """
+
+    errors = {}
+    names = {}
+    for unit in set(unit for _, question in questions for unit in question_units(question)):
+        try:
+            names[unit] = convert.format_unit(unit)
+            if 'normalized_value' in loader.answer_derived_columns:
+                convert.get_base_conversion(unit)
+        except ValueError as e:
+            errors[unit] = str(e)
+
+    for pair in set(pair for _, question in questions for pair in question.unit_pairs):
+        if pair[0] in names and pair[1] in names:
+            try:
+                convert.get_conversion(*pair)
+            except ValueError as e:
+                errors[pair] = str(e)
+
+    valid, rejected = [], []
+    for line, question in questions:
+        question_errors = [errors[unit] for unit in sorted(question_units(question)) if unit in errors]
+        question_errors += [errors[pair] for pair in question.unit_pairs if pair in errors]
+        if len(question_errors) > 0:
+            rejected.append((line, "; ".join(question_errors)))
+        else:
+            valid.append((line, question))
+
+    conversions = [question.conversion for _, question in valid if question.conversion is not None]
+    to_values = iter([])
+    if 'to_value' in loader.derived_columns:
+        to_values = iter(convert.convert_many([unit for _, unit, _ in conversions],
+                                              [value for value, _, _ in conversions],
+                                              [unit for _, _, unit in conversions]).tolist())
+
+    answers = [answer for _, question in valid for answer in question.answers]
+    normalized_values = iter([])
+    if 'normalized_value' in loader.answer_derived_columns:
+        normalized_values = iter(convert.to_normalized_many([answer[1] for answer in answers],
+                                                            [answer[0] for answer in answers]).tolist())
+
+    precomputed = []
+    for line, question in valid:
+        derived = {}
+        if question.conversion is not None:
+            derived = {"to_value": next(to_values, None), "from_unit_name": names[question.conversion[1]],
+                       "to_unit_name": names[question.conversion[2]]}
+
+        question_answers = []
+        for answer in question.answers:
+            answer_derived = {"normalized_value": next(normalized_values, None),
+                              "title": convert.format_value(answer[1], answer[0])}
+            question_answers.append(answer + tuple(answer_derived[column]
+                                                   for column in loader.answer_derived_columns))
+
+        precomputed.append((line, question._replace(
+            values=question.values + tuple(derived[column] for column in loader.derived_columns),
+            answers=question_answers)))
+
+    return precomputed, rejected
+
+
+def write_questions(loader, questions):
+    """
+    Upserts the questions by their natural keys, answers are inserted only with new questions, answers of the
+    loaded questions get only their derived columns updated
+    :param loader: loader of the questions
+    :param questions: ParsedQuestions with the derived columns (see precompute_units)
+    :return: number of inserted questions
+    """
+
+    if len(questions) == 0:
+        return 0
+
+    cursor = db.session.connection().connection.cursor()
+    question_type = loader.model.__mapper_args__['polymorphic_identity']
+
+    # the no-op update makes RETURNING include existing questions, xmax is 0 only for inserted rows
+    rows = execute_values(cursor,
+                          'INSERT INTO question (type, difficulty, initial_difficulty, target_time, answered_count, '
+                          'answered_users_count, enabled, natural_key) VALUES %s '
+                          'ON CONFLICT (natural_key) DO UPDATE SET natural_key = EXCLUDED.natural_key '
+                          'RETURNING natural_key, id, xmax = 0',
+                          [(question_type, question.difficulty, question.difficulty, 0, 0, 0, True, question.key)
+                           for question in questions],
+                          page_size=len(questions), fetch=True)
+    ids = dict((key, (question_id, inserted)) for key, question_id, inserted in rows)
+
+    updated_columns = loader.updated_columns + loader.derived_columns
+    if len(updated_columns) > 0:
+        conflict = 'DO UPDATE SET ' + ', '.join('{0} = EXCLUDED.{0}'.format(column) for column in updated_columns)
+    else:
+        conflict = 'DO NOTHING'
+    execute_values(cursor,
+                   'INSERT INTO "{0}" (id, {1}) VALUES %s ON CONFLICT (id) {2}'
+                   .format(loader.model.__tablename__,
+                           ', '.join('"{0}"'.format(column) for column in loader.columns + loader.derived_columns),
+                           conflict),
+                   [(ids[question.key][0],) + question.values for question in questions],
+                   page_size=len(questions))
+
+    execute_values(cursor,
+                   'INSERT INTO question_task_association (question_id, task_id, unit_system_constraint) VALUES %s '
+                   'ON CONFLICT (question_id, task_id) DO NOTHING',
+                   [(ids[question.key][0], task_id, unit_system)
+                    for question in questions for task_id, unit_system in question.associations],
+                   page_size=len(questions))
+
+    answer_columns = loader.answer_columns + loader.answer_derived_columns
+    answers = [(ids[question.key][0],) + answer
+               for question in questions if ids[question.key][1] for answer in question.answers]
+    if len(answers) > 0:
+        execute_values(cursor,
+                       'INSERT INTO "{0}" (question_id, {1}) VALUES %s'
+                       .format(loader.answer_model.__tablename__, ', '.join(answer_columns)),
+                       answers, page_size=len(answers))
+
+    # answers are part of the natural key, so the answers of a loaded question are identified by value and unit
+    updated_answers = [(ids[question.key][0],) + answer[:2] + answer[len(loader.answer_columns):]
+                       for question in questions if not ids[question.key][1] for answer in question.answers]
+    if len(updated_answers) > 0 and len(loader.answer_derived_columns) > 0:
+        execute_values(cursor,
+                       'UPDATE "{0}" SET {1} FROM (VALUES %s) AS v (question_id, value, unit, {2}) '
+                       'WHERE "{0}".question_id = v.question_id AND "{0}".value = v.value AND "{0}".unit = v.unit'
+                       .format(loader.answer_model.__tablename__,
+                               ', '.join('{0} = v.{0}'.format(column) for column in loader.answer_derived_columns),
+                               ', '.join(loader.answer_derived_columns)),
+                       updated_answers, page_size=len(updated_answers))
+
+    return sum(1 for _, inserted in ids.values() if inserted)
+
+
+def load_file(path, file_type, tasks):
+    """
+    Loads a CSV file batch by batch, every batch is committed separately and reloading the file updates the questions
+    loaded before, so an interrupted load can be run again
+    :param path: path of the CSV file
+    :param file_type: type of the file (key of LOADERS)
+    :param tasks: tasks by identifiers
+    :return: number of written questions
+    """
+
+    loader = LOADERS[file_type]
+    timings = OrderedDict([("parse", 0), ("units", 0), ("write", 0)])
+    loaded, inserted, rejected = 0, 0, []
+    occurrences = {}  # numbers of rows with the same natural key
+
+    with open(path, 'r') as file:
+        rows = csv.reader(file, delimiter=';')
 
+        # skip the header
+        next(rows, None)
 
-def load_scale(file):
-    tasks = get_tasks()
-    questions = []
-
-    for row in file:
-        task_name = row[0]
-
-        if len(task_name) > 0 and task_name in tasks:
-            question = ScaleQuestion(difficulty=float(row[1].replace(',','.')), from_value=float(row[2].replace(',','.')), from_unit=row[3], to_unit=row[4], scale_min=float(row[5].replace(',','.')), scale_max=float(row[6].replace(',','.')), tasks=[tasks[task_name]])
-            questions.append(question)
-
-    db.session.add_all(questions)
-    db.session.commit()
-
-
-def load_closeended(file):
-    tasks = get_tasks()
-    questions = []
-
-    for row in file:
-        task_name = row[0]
-
-        if len(task_name) > 0 and len(row[5]) > 0 and task_name in tasks:
-            global question
-            if len(row[4]) > 0:
-                question = CloseEndedQuestion(difficulty=float(row[5].replace(',','.')), question_cz=row[2], question_en=row[3], question_type=row[1], tasks=[tasks[task_name]], image_name=row[4])
-            else:
-                question = CloseEndedQuestion(difficulty=float(row[5].replace(',','.')), question_cz=row[2], question_en=row[3], question_type=row[1], tasks=[tasks[task_name]])
-            questions.append(question)
-
-            # check if question can be assigned as a dependent question to 'combined' task
-            q_type = row[1].split("_")
-            q_task = task_name.split("_")
-            if q_type[0] == "estimate" and len(q_task) == 2 and (q_task[1] == "m" or q_task[1] == "i") and q_task[0]+"_c" in tasks:
-                unit = "metric" if q_task[1] == "m" else "imperial"
-                task = tasks.get(q_task[0]+"_c")
+        lines = enumerate(rows, start=2)
+        while True:
+            batch = list(itertools.islice(lines, BATCH_SIZE))
+            if len(batch) == 0:
+                break
 
-                question.task_associations.append(QuestionTaskAssociation(task=task, unit_system_constraint=unit))
+            start = time.perf_counter()
+            questions = []
+            for line, row in batch:
+                try:
+                    question = loader.parse(row, tasks)
+                except (ValueError, IndexError) as e:
+                    rejected.append((line, "invalid row: {0}".format(e)))
+                    continue
 
-            for i in range(0,3):
-                value = row[6+i*3]
-                unit = row[7+i*3]
-                correct = row[8+i*3]
+                if question is None:
+                    continue
 
-                if len(value) > 0 and len(unit) > 0 and len(correct) > 0:
-                    questions.append(CloseEndedAnswer(question=question, value=float(value.replace(',','.')), unit=unit, correct=correct))
+                occurrence = occurrences[question.key] = occurrences.get(question.key, 0) + 1
+                if occurrence > 1:
+                    question = question._replace(key="{0}#{1}".format(question.key, occurrence))
+                questions.append((line, question))
+            timings["parse"] += time.perf_counter() - start
 
-    db.session.add_all(questions)
-    db.session.commit()
+            start = time.perf_counter()
+            questions, invalid = precompute_units(loader, questions)
+            rejected += invalid
+            timings["units"] += time.perf_counter() - start
 
+            start = time.perf_counter()
+            inserted += write_questions(loader, [question for _, question in questions])
+            db.session.commit()
+            loaded += len(questions)
+            timings["write"] += time.perf_counter() - start
 
-def load_currency(file):
-    tasks = get_tasks()
-    questions = []
+    for line, error in sorted(rejected):
+        print("{0}:{1}: {2}".format(path, line, error), file=sys.stderr)
 
-    for row in file:
-        task_name = row[0]
+    print("{0}: {1} questions loaded ({2} new, {3} updated), {4} rows rejected; {5}".format(
+        path, loaded, inserted, loaded - inserted, len(rejected),
+        ", ".join("{0} {1:.3f} s".format(phase, seconds) for phase, seconds in timings.items())))
 
-        if len(task_name) > 0 and task_name in tasks:
-            questions.append(CurrencyQuestion(difficulty=float(row[1].replace(',','.')), from_value=float(row[2].replace(',','.')), from_unit=row[3], to_unit=row[4], tasks=[tasks[task_name]]))
-
-    db.session.add_all(questions)
-    db.session.commit()
+    return loaded
 
 
 if __name__ == "__main__":
-    with open(sys.argv[1], 'r') as file:
-        task_type = sys.argv[2]
-        csv_file = csv.reader(file, delimiter=';')
+    # python load_questions.py <file> <type> loads one file, python load_questions.py <directory> loads all files of
+    # the directory named by their types (eg. csv/numeric.csv)
+    if len(sys.argv) > 2:
+        files = [(sys.argv[1], sys.argv[2])]
+    else:
+        directory = sys.argv[1] if len(sys.argv) > 1 else "csv"
+        files = [(os.path.join(directory, file_type + ".csv"), file_type) for file_type in LOADERS
+                 if os.path.exists(os.path.join(directory, file_type + ".csv"))]
+
+    start = time.perf_counter()
+    tasks = get_tasks()
+    loaded = sum(load_file(path, file_type, tasks) for path, file_type in files)
+    print("{0} questions loaded in {1:.3f} s".format(loaded, time.perf_counter() - start))
 
-        # skip the header
-        next(csv_file, None)
-
-        if task_type == "numeric":
-            load_numeric(csv_file)
-        elif task_type == "sort":
-            load_sort(csv_file)
-        elif task_type == "scale":
-            load_scale(csv_file)
-        elif task_type == "closeended":
-            load_closeended(csv_file)
-        elif task_type == "currency":
-            load_currency(csv_file)
\ No newline at end of file
+    if loaded > 0:
+        bank.bump_bank_version()
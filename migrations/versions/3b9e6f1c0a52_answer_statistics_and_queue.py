@@ -0,0 +1,65 @@
+"""Answer counters of questions, statistics of users' answers, question bank version and the queue of model updates
+
+Revision ID: 3b9e6f1c0a52
+Revises: None
+Create Date: 2026-10-18 08:00:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3b9e6f1c0a52'
+down_revision = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # the columns and tables exist already in databases created by initdb, the statistics are recomputed from
+    # the answer history either way
+    op.execute('ALTER TABLE question ADD COLUMN IF NOT EXISTS answered_count INTEGER NOT NULL DEFAULT 0')
+    op.execute('ALTER TABLE question ADD COLUMN IF NOT EXISTS answered_users_count INTEGER NOT NULL DEFAULT 0')
+    op.execute('UPDATE question SET answered_count = stats.answered_count, '
+               'answered_users_count = stats.answered_users_count '
+               'FROM (SELECT taskrun_question.question_id, count(*) AS answered_count, '
+               'count(DISTINCT taskrun.user_id) AS answered_users_count FROM taskrun_question '
+               'JOIN taskrun ON taskrun_question.taskrun_id = taskrun.id '
+               'WHERE taskrun_question.correct IS NOT NULL '
+               'GROUP BY taskrun_question.question_id) AS stats '
+               'WHERE question.id = stats.question_id')
+
+    op.execute('CREATE TABLE IF NOT EXISTS user_question_stats ('
+               'user_id INTEGER NOT NULL REFERENCES "user" (id), '
+               'question_id INTEGER NOT NULL REFERENCES question (id), '
+               'answered_count INTEGER NOT NULL, '
+               'last_answer_date TIMESTAMP WITHOUT TIME ZONE, '
+               'PRIMARY KEY (user_id, question_id))')
+    op.execute('DELETE FROM user_question_stats')
+    op.execute('INSERT INTO user_question_stats (user_id, question_id, answered_count, last_answer_date) '
+               'SELECT taskrun.user_id, taskrun_question.question_id, count(*), MAX(taskrun.date) '
+               'FROM taskrun_question JOIN taskrun ON taskrun_question.taskrun_id = taskrun.id '
+               'WHERE taskrun_question.correct IS NOT NULL AND taskrun.user_id IS NOT NULL '
+               'GROUP BY taskrun.user_id, taskrun_question.question_id')
+
+    op.execute('CREATE TABLE IF NOT EXISTS question_bank ('
+               'id SERIAL PRIMARY KEY, '
+               'version INTEGER NOT NULL)')
+
+    # answers applied before the queue existed are not queued
+    op.execute('CREATE TABLE IF NOT EXISTS elo_update_queue ('
+               'id SERIAL PRIMARY KEY, '
+               'user_id INTEGER REFERENCES "user" (id), '
+               'taskrun_id INTEGER REFERENCES taskrun (id), '
+               'question_id INTEGER REFERENCES question (id), '
+               'error TEXT)')
+    op.execute('CREATE INDEX IF NOT EXISTS ix_elo_update_queue_user_id ON elo_update_queue (user_id)')
+    op.execute('CREATE UNIQUE INDEX IF NOT EXISTS ix_elo_update_queue_taskrun_id_question_id '
+               'ON elo_update_queue (taskrun_id, question_id)')
+
+
+def downgrade():
+    op.execute('DROP TABLE IF EXISTS elo_update_queue')
+    op.execute('DROP TABLE IF EXISTS question_bank')
+    op.execute('DROP TABLE IF EXISTS user_question_stats')
+    op.drop_column('question', 'answered_users_count')
+    op.drop_column('question', 'answered_count')
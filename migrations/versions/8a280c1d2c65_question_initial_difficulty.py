@@ -0,0 +1,29 @@
+"""Initial difficulty of questions
+
+Revision ID: 8a280c1d2c65
+Revises: de72c91e0905
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8a280c1d2c65'
+down_revision = 'de72c91e0905'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # the column exists already in databases created by initdb
+    op.execute('ALTER TABLE question ADD COLUMN IF NOT EXISTS initial_difficulty FLOAT')
+
+    # the initial difficulty is known only for questions whose difficulty was never updated
+    op.execute('UPDATE question SET initial_difficulty = difficulty '
+               'WHERE NOT EXISTS (SELECT 1 FROM question_history WHERE question_history.question_id = question.id) '
+               'AND NOT EXISTS (SELECT 1 FROM question_history_daily '
+               'WHERE question_history_daily.question_id = question.id)')
+
+
+def downgrade():
+    op.drop_column('question', 'initial_difficulty')
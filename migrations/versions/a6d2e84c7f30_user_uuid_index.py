@@ -0,0 +1,31 @@
+"""Unique index of users by uuid covering their profile
+
+Revision ID: a6d2e84c7f30
+Revises: e5b7d04a1f93
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'a6d2e84c7f30'
+down_revision = 'e5b7d04a1f93'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # users duplicated by concurrent requests keep their answers under the uuid with their id appended, the oldest
+    # one keeps the uuid
+    op.execute('UPDATE "user" SET uuid = "user".uuid || \'#\' || "user".id '
+               'FROM (SELECT uuid, min(id) AS id FROM "user" WHERE uuid IS NOT NULL GROUP BY uuid HAVING count(*) > 1) '
+               'AS first WHERE "user".uuid = first.uuid AND "user".id != first.id')
+
+    # the index created by initdb has no included columns
+    op.execute('DROP INDEX IF EXISTS ix_user_uuid')
+    op.execute('CREATE UNIQUE INDEX ix_user_uuid ON "user" (uuid) '
+               'INCLUDE (id, app_version, language, is_metric, ip_address)')
+
+
+def downgrade():
+    op.execute('DROP INDEX IF EXISTS ix_user_uuid')
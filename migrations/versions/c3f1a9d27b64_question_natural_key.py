@@ -0,0 +1,70 @@
+"""Natural keys of questions loaded from CSV files
+
+Revision ID: c3f1a9d27b64
+Revises: 8a280c1d2c65
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'c3f1a9d27b64'
+down_revision = '8a280c1d2c65'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# natural keys of existing questions in the format of load_questions.question_key, questions are identified by the
+# task they were loaded for (the association without a unit system constraint)
+KEYS_QUERY = """
+SELECT question_numeric.id, concat_ws('|', 'numeric', task.identifier, from_value::text, from_unit, to_unit) AS key
+FROM question_numeric
+JOIN question_task_association a ON a.question_id = question_numeric.id AND a.unit_system_constraint IS NULL
+JOIN task ON task.id = a.task_id
+UNION ALL
+SELECT question_scale.id, concat_ws('|', 'scale', task.identifier, from_value::text, from_unit, to_unit)
+FROM question_scale
+JOIN question_task_association a ON a.question_id = question_scale.id AND a.unit_system_constraint IS NULL
+JOIN task ON task.id = a.task_id
+UNION ALL
+SELECT question_currency.id, concat_ws('|', 'currency', task.identifier, from_value::text, from_unit, to_unit)
+FROM question_currency
+JOIN question_task_association a ON a.question_id = question_currency.id AND a.unit_system_constraint IS NULL
+JOIN task ON task.id = a.task_id
+UNION ALL
+SELECT q.id, concat_ws('|', 'closeended', task.identifier, q.question_type, q.question_en,
+                       string_agg(answer.value::text || ' ' || answer.unit, '|' ORDER BY answer.id))
+FROM "question_closeEnded" q
+JOIN question_task_association a ON a.question_id = q.id AND a.unit_system_constraint IS NULL
+JOIN task ON task.id = a.task_id
+LEFT JOIN "answer_closeEnded" answer ON answer.question_id = q.id
+GROUP BY q.id, task.identifier, q.question_type, q.question_en
+UNION ALL
+SELECT question_sort.id, concat_ws('|', 'sort', task.identifier, question_sort.order::text,
+                                   string_agg(answer_sort.value::text || ' ' || answer_sort.unit, '|'
+                                              ORDER BY answer_sort.presented_pos))
+FROM question_sort
+JOIN question_task_association a ON a.question_id = question_sort.id AND a.unit_system_constraint IS NULL
+JOIN task ON task.id = a.task_id
+LEFT JOIN answer_sort ON answer_sort.question_id = question_sort.id
+GROUP BY question_sort.id, task.identifier, question_sort.order
+"""
+
+
+def upgrade():
+    # the column exists already in databases created by initdb
+    op.execute('ALTER TABLE question ADD COLUMN IF NOT EXISTS natural_key VARCHAR')
+
+    # repeated questions get the number of the occurrence appended in the order of loading, as repeated rows of
+    # a CSV file do
+    op.execute("UPDATE question SET natural_key = keys.key || CASE WHEN keys.n > 1 THEN '#' || keys.n ELSE '' END "
+               'FROM (SELECT id, key, row_number() OVER (PARTITION BY key ORDER BY id) AS n '
+               'FROM ({0}) AS question_keys) AS keys '
+               'WHERE question.id = keys.id AND question.natural_key IS NULL'.format(KEYS_QUERY))
+
+    op.execute('CREATE UNIQUE INDEX IF NOT EXISTS ix_question_natural_key ON question (natural_key)')
+
+
+def downgrade():
+    op.execute('DROP INDEX IF EXISTS ix_question_natural_key')
+    op.drop_column('question', 'natural_key')
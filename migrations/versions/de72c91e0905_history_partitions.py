@@ -0,0 +1,131 @@
+"""Indexes of answer lookups, history partitioned by date and daily history aggregates
+
+Requires PostgreSQL 11 (declarative partitioning with primary keys).
+
+Revision ID: de72c91e0905
+Revises: 3b9e6f1c0a52
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'de72c91e0905'
+down_revision = '3b9e6f1c0a52'
+
+import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# partitioned tables with their foreign keys and indexes
+HISTORY_TABLES = [
+    ('question_history', [('question_id', 'question')], ['question_id', 'date']),
+    ('user_skill_history', [('task_id', 'task'), ('user_id', 'user')], ['user_id', 'task_id', 'date']),
+]
+
+
+def month_start(date, months=0):
+    month = date.year * 12 + date.month - 1 + months
+    return datetime.date(month // 12, month % 12 + 1, 1)
+
+
+def is_partitioned(table_name):
+    return op.get_bind().execute(sa.text('SELECT relkind FROM pg_class WHERE relname = :name'),
+                                 name=table_name).scalar() == 'p'
+
+
+def primary_key_name(table_name):
+    return op.get_bind().execute(sa.text("SELECT conname FROM pg_constraint WHERE conrelid = CAST(:name AS regclass) "
+                                         "AND contype = 'p'"),
+                                 name=table_name).scalar()
+
+
+def partition_by_date(table_name, foreign_keys, index_columns):
+    # the existing table becomes the partition of all rows before the current month, rows of the current month are
+    # moved to its monthly partition
+    cutoff = month_start(datetime.date.today())
+
+    op.execute('ALTER TABLE {0} RENAME TO {0}_legacy'.format(table_name))
+    op.execute("UPDATE {0}_legacy SET date = '1970-01-01' WHERE date IS NULL".format(table_name))
+    op.execute('ALTER TABLE {0}_legacy ALTER COLUMN date SET NOT NULL'.format(table_name))
+
+    # primary key of a partition has to contain the partition key, the renamed primary key (id) would also take
+    # the name of the primary key of the partitioned table
+    legacy_primary_key = primary_key_name(table_name + '_legacy')
+    if legacy_primary_key is not None:
+        op.execute('ALTER TABLE {0}_legacy DROP CONSTRAINT {1}'.format(table_name, legacy_primary_key))
+    op.execute('ALTER TABLE {0}_legacy ADD CONSTRAINT {0}_legacy_pkey PRIMARY KEY (id, date)'.format(table_name))
+
+    op.execute('CREATE TABLE {0} (LIKE {0}_legacy INCLUDING DEFAULTS) PARTITION BY RANGE (date)'.format(table_name))
+    op.execute('ALTER TABLE {0} ADD PRIMARY KEY (id, date)'.format(table_name))
+    op.execute('ALTER SEQUENCE {0}_id_seq OWNED BY {0}.id'.format(table_name))
+    for column, referred_table in foreign_keys:
+        op.execute('ALTER TABLE {0} ADD FOREIGN KEY ({1}) REFERENCES "{2}" (id)'.format(table_name, column,
+                                                                                       referred_table))
+
+    op.execute('CREATE TABLE {0}_default PARTITION OF {0} DEFAULT'.format(table_name))
+    for months in range(0, 4):
+        start = month_start(cutoff, months)
+        op.execute("CREATE TABLE {0}_p{1:%Y%m} PARTITION OF {0} FOR VALUES FROM ('{1}') TO ('{2}')"
+                   .format(table_name, start, month_start(start, 1)))
+
+    # the legacy table can be attached only when it has no rows outside of its range
+    op.execute("WITH moved AS (DELETE FROM {0}_legacy WHERE date >= '{1}' RETURNING *) INSERT INTO {0} "
+               "SELECT * FROM moved".format(table_name, cutoff))
+    op.execute("ALTER TABLE {0} ATTACH PARTITION {0}_legacy FOR VALUES FROM (MINVALUE) TO ('{1}')"
+               .format(table_name, cutoff))
+
+    op.execute('DROP INDEX IF EXISTS ix_{0}_{1}'.format(table_name, '_'.join(index_columns)))
+    op.execute('CREATE INDEX ix_{0}_{1} ON {0} ({2})'.format(table_name, '_'.join(index_columns),
+                                                               ', '.join(index_columns)))
+
+
+def upgrade():
+    op.execute('CREATE INDEX IF NOT EXISTS ix_taskrun_user_id_id ON taskrun (user_id, id)')
+    op.execute('CREATE INDEX IF NOT EXISTS ix_taskrun_question_question_id_answered '
+               'ON taskrun_question (question_id, taskrun_id) WHERE correct IS NOT NULL')
+
+    for table_name, foreign_keys, index_columns in HISTORY_TABLES:
+        if not is_partitioned(table_name):
+            partition_by_date(table_name, foreign_keys, index_columns)
+
+    op.execute('CREATE TABLE IF NOT EXISTS question_history_daily ('
+               'question_id INTEGER NOT NULL REFERENCES question (id), '
+               'day DATE NOT NULL, '
+               'target_time FLOAT, '
+               'difficulty FLOAT, '
+               'count INTEGER NOT NULL, '
+               'PRIMARY KEY (question_id, day))')
+    op.execute('CREATE TABLE IF NOT EXISTS user_skill_history_daily ('
+               'user_id INTEGER NOT NULL REFERENCES "user" (id), '
+               'task_id INTEGER NOT NULL REFERENCES task (id), '
+               'day DATE NOT NULL, '
+               'value FLOAT, '
+               'count INTEGER NOT NULL, '
+               'PRIMARY KEY (user_id, task_id, day))')
+
+
+def downgrade():
+    op.execute('DROP TABLE IF EXISTS user_skill_history_daily')
+    op.execute('DROP TABLE IF EXISTS question_history_daily')
+
+    for table_name, foreign_keys, index_columns in HISTORY_TABLES:
+        if not is_partitioned(table_name):
+            continue
+
+        # rows of all partitions are moved back to a plain table
+        op.execute('CREATE TABLE {0}_plain (LIKE {0} INCLUDING DEFAULTS)'.format(table_name))
+        op.execute('INSERT INTO {0}_plain SELECT * FROM {0}'.format(table_name))
+        op.execute('ALTER SEQUENCE {0}_id_seq OWNED BY {0}_plain.id'.format(table_name))
+        op.execute('DROP TABLE {0}'.format(table_name))
+        op.execute('ALTER TABLE {0}_plain RENAME TO {0}'.format(table_name))
+        op.execute('ALTER TABLE {0} ADD PRIMARY KEY (id)'.format(table_name))
+        for column, referred_table in foreign_keys:
+            op.execute('ALTER TABLE {0} ADD FOREIGN KEY ({1}) REFERENCES "{2}" (id)'.format(table_name, column,
+                                                                                           referred_table))
+        op.execute('CREATE INDEX ix_{0}_{1} ON {0} ({2})'.format(table_name, '_'.join(index_columns),
+                                                                   ', '.join(index_columns)))
+
+    op.execute('DROP INDEX IF EXISTS ix_taskrun_question_question_id_answered')
+    op.execute('DROP INDEX IF EXISTS ix_taskrun_user_id_id')
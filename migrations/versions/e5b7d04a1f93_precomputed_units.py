@@ -0,0 +1,37 @@
+"""Converted values and unit names precomputed by load_questions.py
+
+Revision ID: e5b7d04a1f93
+Revises: c3f1a9d27b64
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'e5b7d04a1f93'
+down_revision = 'c3f1a9d27b64'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# added columns by tables, the values are filled by reloading the questions (python load_questions.py csv)
+COLUMNS = [
+    ('question_numeric', [('to_value', 'FLOAT'), ('from_unit_name', 'VARCHAR'), ('to_unit_name', 'VARCHAR')]),
+    ('question_scale', [('to_value', 'FLOAT'), ('from_unit_name', 'VARCHAR'), ('to_unit_name', 'VARCHAR')]),
+    ('question_currency', [('from_unit_name', 'VARCHAR'), ('to_unit_name', 'VARCHAR')]),
+    ('answer_sort', [('normalized_value', 'FLOAT'), ('title', 'VARCHAR')]),
+    ('answer_closeEnded', [('title', 'VARCHAR')]),
+]
+
+
+def upgrade():
+    # the columns exist already in databases created by initdb
+    for table_name, columns in COLUMNS:
+        for column, column_type in columns:
+            op.execute('ALTER TABLE "{0}" ADD COLUMN IF NOT EXISTS {1} {2}'.format(table_name, column, column_type))
+
+
+def downgrade():
+    for table_name, columns in COLUMNS:
+        for column, _ in columns:
+            op.drop_column(table_name, column)
@@ -0,0 +1,26 @@
+"""Date of the last answers of TaskRuns, answers are exported by it
+
+Revision ID: f1d8c3b5e2a7
+Revises: a6d2e84c7f30
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'f1d8c3b5e2a7'
+down_revision = 'a6d2e84c7f30'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # the column exists already in databases created by initdb, TaskRuns answered before are dated by their start
+    op.execute('ALTER TABLE taskrun ADD COLUMN IF NOT EXISTS answer_date TIMESTAMP WITHOUT TIME ZONE')
+    op.execute('UPDATE taskrun SET answer_date = date WHERE answer_date IS NULL')
+    op.execute('CREATE INDEX IF NOT EXISTS ix_taskrun_answer_date_id ON taskrun (answer_date, id)')
+
+
+def downgrade():
+    op.execute('DROP INDEX IF EXISTS ix_taskrun_answer_date_id')
+    op.drop_column('taskrun', 'answer_date')
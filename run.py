@@ -1,12 +1,26 @@
+import csv
+import datetime
+import gzip
+import itertools
+import json
+import os
+import random
+import time
+
+from flask import jsonify
 from flask.ext.script import Manager
 from sqlalchemy import MetaData
+from sqlalchemy.orm import with_polymorphic, subqueryload
 from sqlalchemy.sql.ddl import DropConstraint
 
 from app.app import create_app
 from app.config import config
-from app.engine import elo
+from app.engine import elo, elo_queue, convert, currency, stats, generator, bank, history, replay, export
 from app.extensions import db
 from app.models import *
+from app.serialization.Question import question_schema_serialization_disambiguation, question_serializers
+from app.serialization.Task import taskrun_schema, dump_taskrun, load_taskrun, encode_taskrun
+from app.serialization.encoding import available_json_backends, select_json_backend, encode
 
 app = create_app(config)
 manager = Manager(app)
@@ -25,6 +39,10 @@ def initdb():
 
     db.init_app(app)
 
+    # history tables partitioned by the migrations are dropped together with their partitions, the migrations are
+    # then applied again to the new schema
+    db.engine.execute('DROP TABLE IF EXISTS question_history, user_skill_history, alembic_version CASCADE')
+
     metadata = MetaData(db.engine)
     metadata.reflect()
     for table in metadata.tables.values():
@@ -84,6 +102,7 @@ def initdb():
     ])
 
     db.session.commit()
+    bank.bump_bank_version()
 
 
 @manager.command
@@ -101,6 +120,364 @@ def compute(response, user_skill, difficulty, time, count_res):
     print("respose:", response, "expected response:", expected_response, "skill delta:", user_skill_delta, "difficulty delta:", question_difficulty_delta)
 
 
+@manager.command
+def replay_elo(write="false", success=str(elo.K_SUCCESS), failure=str(elo.K_FAILURE), alpha=str(elo.ALPHA),
+               beta=str(elo.BETA)):
+    """Recompute the model from the whole answer history with given parameters (K_SUCCESS, K_FAILURE, ALPHA, BETA)."""
+
+    start = time.perf_counter()
+    log = replay.load_answer_log()
+    print("{0} answers loaded in {1:.1f} s, {2} skipped".format(len(log), time.perf_counter() - start, log.skipped))
+    if log.unknown_initial_difficulties > 0:
+        print("{0} questions without initial difficulty replayed from 0".format(log.unknown_initial_difficulties))
+
+    start = time.perf_counter()
+    parameters = replay.EloParameters(float(success), float(failure), float(alpha), float(beta))
+    result = replay.replay(log, parameters)
+    metrics = replay.evaluate(log, result)
+    print("replayed in {0:.1f} s, expected responses: log-loss {1:.4f}, rmse {2:.4f}, auc {3:.4f}"
+          .format(time.perf_counter() - start, *metrics))
+
+    if write.lower() == "true":
+        try:
+            replay.write_result(log, result)
+            print("model replaced")
+        except ValueError as e:
+            print("model not replaced, answers were stored during the replay ({0}), run it again".format(e))
+
+
+@manager.command
+def dump_answer_log(path="answers.npz"):
+    """Store the whole answer history to a file replayed by sweep_elo."""
+
+    log = replay.load_answer_log()
+    log.save(path)
+    print("{0} answers stored, {1} skipped".format(len(log), log.skipped))
+
+
+@manager.command
+def sweep_elo(log="answers.npz", success=str(elo.K_SUCCESS), failure=str(elo.K_FAILURE), alpha=str(elo.ALPHA),
+              beta=str(elo.BETA), processes="0", output="sweep.csv"):
+    """Replay answer log stored by dump_answer_log with all combinations of comma separated parameters."""
+
+    answer_log = replay.AnswerLog.load(log)
+    parameter_sets = [replay.EloParameters(*values) for values in itertools.product(
+        *([float(value) for value in values.split(",")] for values in (success, failure, alpha, beta)))]
+
+    start = time.perf_counter()
+    results = replay.sweep(answer_log, parameter_sets, int(processes) or None)
+    print("{0} parameter sets replayed on {1} answers in {2:.1f} s".format(len(parameter_sets), len(answer_log),
+                                                                          time.perf_counter() - start))
+
+    with open(output, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(replay.EloParameters._fields + replay.ReplayMetrics._fields + ("seconds",))
+        for parameters, metrics, seconds in sorted(results, key=lambda result: result[1].log_loss):
+            writer.writerow(parameters + metrics + (round(seconds, 3),))
+            print("k_success {0}, k_failure {1}, alpha {2}, beta {3}: log-loss {4:.4f}, rmse {5:.4f}, auc {6:.4f}, "
+                  "{7:.1f} s".format(*(parameters + metrics + (seconds,))))
+
+
+@manager.command
+def export_answers(directory="export", rows=""):
+    """Export answers since the last export into compressed NPZ files for analysis."""
+
+    start = time.perf_counter()
+    exported = export.export_answers(directory, int(rows) if rows else None)
+    manifest = export.read_manifest(directory)
+    print("{0} answers exported in {1:.1f} s, watermark {2} TaskRun {3}, {4} files in {5}".format(
+        exported, time.perf_counter() - start, manifest["watermark_date"], manifest["watermark_taskrun_id"],
+        len(manifest["chunks"]), directory))
+
+
+@manager.command
+def elo_worker():
+    """Apply queued answers to the model."""
+
+    elo_queue.run_worker()
+
+
+@manager.command
+def retry_failed_answers():
+    """Return queued answers set aside after a failure back to the queue."""
+
+    print("{0} answers returned to the queue".format(elo_queue.retry_failed()))
+
+
+@manager.command
+def rebuild_answer_counts():
+    """Recompute answer counters of questions from the answer history."""
+
+    stats.rebuild_answer_counts()
+
+
+@manager.command
+def backfill_user_question_stats():
+    """Recompute statistics of users' answers from the answer history."""
+
+    stats.backfill_user_question_stats()
+
+
+@manager.command
+def check_user_question_stats():
+    """Compare statistics of users' answers with the answer history."""
+
+    rows = stats.check_user_question_stats()
+    for row in rows:
+        print("user {0}, question {1}: stored count {2}, date {3}; actual count {4}, date {5}".format(*row))
+
+    print("inconsistent rows found:", len(rows))
+
+
+@manager.command
+def set_question_enabled(question_id, enabled="true"):
+    """Enable or disable a question."""
+
+    question = Question.query.get(int(question_id))
+    question.enabled = enabled.lower() == "true"
+    db.session.commit()
+    bank.bump_bank_version()
+
+
+@manager.command
+def bump_question_bank():
+    """Mark question bank as changed after editing it directly in the database."""
+
+    bank.bump_bank_version()
+
+
+@manager.command
+def rollup_history(days="90"):
+    """Aggregate history older than given number of days into daily aggregates."""
+
+    history.rollup_history(datetime.date.today() - datetime.timedelta(days=int(days)))
+
+
+@manager.command
+def create_history_partitions(months="3"):
+    """Create monthly partitions of history tables for given number of months ahead."""
+
+    history.create_history_partitions(int(months))
+
+
+@manager.command
+def dump_registry():
+    """Build unit registry and store it to the snapshot loaded by workers."""
+
+    exchange_rates = currency.get_currency_rates(config)
+    convert.dump_registry_snapshot(convert.build_registry(exchange_rates), config.UNIT_REGISTRY_SNAPSHOT,
+                                   convert.definitions_fingerprint(exchange_rates))
+
+
+@manager.command
+def bench_registry(repeat="5"):
+    """Benchmark building unit registry against loading it from the snapshot."""
+
+    repeat = int(repeat)
+    exchange_rates = currency.get_currency_rates(config)
+    fingerprint = convert.definitions_fingerprint(exchange_rates)
+
+    if not os.path.isfile(config.UNIT_REGISTRY_SNAPSHOT) or \
+            convert.load_registry_snapshot(config.UNIT_REGISTRY_SNAPSHOT, fingerprint) is None:
+        print("snapshot is missing or out of date, run dump_registry first")
+        return
+
+    for name, function in (("build", lambda: convert.build_registry(exchange_rates)),
+                           ("snapshot", lambda: convert.load_registry_snapshot(config.UNIT_REGISTRY_SNAPSHOT,
+                                                                              fingerprint))):
+        start = time.perf_counter()
+        for i in range(repeat):
+            ureg = function()
+            ureg.Quantity(1, "km").to("mi")
+        print("{0}: {1:.1f} ms to first conversion".format(name, (time.perf_counter() - start) / repeat * 1000))
+
+
+@manager.command
+def bench_convert(repeat="10000"):
+    """Benchmark cached conversion table against the plain Pint conversion."""
+
+    repeat = int(repeat)
+    pairs = [("m", "ft"), ("km", "mi"), ("lb", "kg"), ("oz", "g"), ("m2", "ft2"), ("ha", "km2"), ("degC", "degF"),
+             ("degF", "degC")]
+
+    for name, function in (("pint", convert.convert_pint), ("table", convert.convert),
+                           ("table (value only)", convert.convert_value)):
+        start = time.perf_counter()
+        for i in range(repeat):
+            for from_unit, to_unit in pairs:
+                function(from_unit, i, to_unit)
+        elapsed = time.perf_counter() - start
+
+        print("{0}: {1:.3f} s, {2:.2f} us per conversion".format(name, elapsed, elapsed / (repeat * len(pairs)) * 1e6))
+
+
+@manager.command
+def bench_convert_many(rows="100000"):
+    """Benchmark batch conversion of columns against converting row by row."""
+
+    rows = int(rows)
+    pairs = [("m", "ft"), ("km", "mi"), ("lb", "kg"), ("oz", "g"), ("m2", "ft2"), ("ha", "km2"), ("degC", "degF"),
+             ("degF", "degC")]
+    from_units = [pairs[i % len(pairs)][0] for i in range(rows)]
+    to_units = [pairs[i % len(pairs)][1] for i in range(rows)]
+    values = [i / 7 for i in range(rows)]
+
+    for name, function in (("pint row by row", convert.convert_pint), ("table row by row", convert.convert_value)):
+        start = time.perf_counter()
+        for from_unit, value, to_unit in zip(from_units, values, to_units):
+            function(from_unit, value, to_unit)
+        print("{0}: {1:.3f} s".format(name, time.perf_counter() - start))
+
+    start = time.perf_counter()
+    convert.convert_many(from_units, values, to_units)
+    print("convert_many: {0:.3f} s".format(time.perf_counter() - start))
+
+
+@manager.command
+def bench_select_questions(candidates="10000", number="6", repeat="5"):
+    """Benchmark vectorized selection of questions against sorting all candidates for each selected question."""
+
+    candidates, number, repeat = int(candidates), int(number), int(repeat)
+    task = Task(identifier="bench")
+    types = [NumericQuestion, ScaleQuestion, SortQuestion, CloseEndedQuestion, CurrencyQuestion]
+    questions = [types[i % len(types)](id=i, difficulty=random.gauss(0, 1), target_time=random.gauss(2, 0.5),
+                                       type=types[i % len(types)].__mapper_args__["polymorphic_identity"], tasks=[task])
+                 for i in range(candidates)]
+    answered_counts = dict((i, random.randint(1, 5)) for i in range(0, candidates, 3))
+    last_answer_dates = dict((i, random.uniform(60, 10 ** 6)) for i in range(0, candidates, 3))
+
+    start = time.perf_counter()
+    for i in range(repeat):
+        generator.select_questions_sorting(questions, number, answered_counts, last_answer_dates, 0.5, 1.0)
+    print("sorting: {0:.1f} ms per selection".format((time.perf_counter() - start) / repeat * 1000))
+
+    start = time.perf_counter()
+    pool = generator.QuestionPool(questions)
+    print("pool: {0:.1f} ms to build".format((time.perf_counter() - start) * 1000))
+
+    start = time.perf_counter()
+    for i in range(repeat):
+        generator.select_questions(pool, number, answered_counts, last_answer_dates, 0.5, 1.0)
+    print("vectorized: {0:.1f} ms per selection".format((time.perf_counter() - start) / repeat * 1000))
+
+
+@manager.command
+def check_serialization(taskruns="100"):
+    """Compare compiled serializers with marshmallow schemas on all questions and the latest TaskRuns."""
+
+    entity = with_polymorphic(Question, '*')
+    questions = db.session.query(entity)\
+        .options(subqueryload(entity.CloseEndedQuestion.answers), subqueryload(entity.SortQuestion.answers))\
+        .order_by(entity.id)\
+        .all()
+
+    # image paths of questions are generated by url_for
+    with app.test_request_context():
+        mismatches = 0
+        for question in questions:
+            # hints and the order of answers are random, both serializers get the same random sequence
+            random.seed(question.id)
+            expected = question_schema_serialization_disambiguation(question, None).dump(question)
+            random.seed(question.id)
+            actual = question_serializers[question.__class__](question)
+
+            if expected.errors or actual != expected.data:
+                mismatches += 1
+                print("question {0}: expected {1}, errors {2}, got {3}".format(question.id, expected.data,
+                                                                              expected.errors, actual))
+
+        taskrun_ids = [row.id for row in db.session.query(TaskRun.id).order_by(TaskRun.id.desc()).limit(int(taskruns))]
+        for taskrun_id in taskrun_ids:
+            taskrun = load_taskrun(taskrun_id)
+
+            random.seed(taskrun_id)
+            expected = taskrun_schema.dump(taskrun)
+            random.seed(taskrun_id)
+            actual = dump_taskrun(taskrun)
+
+            if expected.errors or actual != expected.data:
+                mismatches += 1
+                print("TaskRun {0}: expected {1}, errors {2}, got {3}".format(taskrun_id, expected.data,
+                                                                             expected.errors, actual))
+
+            # the encoded TaskRun is assembled from pre-encoded fragments
+            random.seed(taskrun_id)
+            encoded = json.loads(encode_taskrun(taskrun).decode('utf-8'))
+            if encoded != expected.data:
+                mismatches += 1
+                print("TaskRun {0}: expected {1}, encoded {2}".format(taskrun_id, expected.data, encoded))
+
+    print("{0} questions and {1} TaskRuns compared, {2} mismatches".format(len(questions), len(taskrun_ids),
+                                                                          mismatches))
+
+
+def bench_questions() -> list:
+    """Questions of all types serialized by the benchmarks, built without the database."""
+
+    questions = [
+        NumericQuestion(id=1, target_time=0, from_value=5, from_unit="m", to_unit="ft", image_name=None),
+        ScaleQuestion(id=2, target_time=0, scale_min=0, scale_max=10, from_value=6, from_unit="lb", to_unit="kg"),
+        SortQuestion(id=3, target_time=0, dimensionality="length", order="asc",
+                     answers=[SortAnswer(value=value, unit=unit, presented_pos=i)
+                              for i, (value, unit) in enumerate([(36, "in"), (1, "ft"), (12, "m"), (1, "km")])]),
+        CloseEndedQuestion(id=4, target_time=0, question_en="bicycle", question_type="estimate_height", image_name=None,
+                           answers=[CloseEndedAnswer(value=3, unit="yd", correct=False),
+                                    CloseEndedAnswer(value=10, unit="in", correct=False),
+                                    CloseEndedAnswer(value=1, unit="yd", correct=True)]),
+    ]
+    questions[2].init_on_load()
+    return questions
+
+
+@manager.command
+def bench_serialization(repeat="1000"):
+    """Benchmark compiled serializers of questions against marshmallow schemas."""
+
+    repeat = int(repeat)
+    questions = bench_questions()
+
+    for name, function in (("marshmallow", lambda question: question_schema_serialization_disambiguation(
+                               question, None).dump(question).data),
+                           ("compiled", lambda question: question_serializers[question.__class__](question))):
+        start = time.perf_counter()
+        for i in range(repeat):
+            for question in questions:
+                function(question)
+        print("{0}: {1:.1f} us per question".format(name, (time.perf_counter() - start) / (repeat * len(questions))
+                                                     * 1e6))
+
+
+@manager.command
+def bench_encoding(repeat="1000"):
+    """Benchmark CPU cost of encoding and compressing a /api/start response by the JSON backends and gzip levels."""
+
+    repeat = int(repeat)
+    questions = bench_questions()
+    taskrun = TaskRun(id=1, questions=[TaskRunQuestion(question=questions[i % len(questions)])
+                                       for i in range(config.QUESTIONS_PER_RUN)])
+    # the speed feedback is looked up in the database otherwise
+    taskrun.allow_speed_feedback = lambda: True
+
+    def measure(function) -> float:
+        start = time.perf_counter()
+        for i in range(repeat):
+            function()
+        return (time.perf_counter() - start) / repeat * 1e6
+
+    with app.test_request_context():
+        print("jsonify(dump_taskrun): {0:.1f} us per response".format(measure(lambda: jsonify(dump_taskrun(taskrun)))))
+
+    for backend in available_json_backends():
+        select_json_backend(backend)
+        print("{0} encode(dump_taskrun): {1:.1f} us, encode_taskrun: {2:.1f} us per response".format(
+            backend, measure(lambda: encode(dump_taskrun(taskrun))), measure(lambda: encode_taskrun(taskrun))))
+    select_json_backend(config.JSON_BACKEND)
+
+    body = encode_taskrun(taskrun)
+    for level in range(1, 10):
+        print("gzip level {0}: {1:.1f} us, {2} of {3} bytes".format(
+            level, measure(lambda: gzip.compress(body, level)), len(gzip.compress(body, level)), len(body)))
+
 
 manager.add_option('-c', '--config',
                    dest="config",
@@ -0,0 +1,5 @@
+import os
+
+# the config reads the database URL when it is imported, tests touching the database need a PostgreSQL database of
+# their own (TEST_DATABASE_URL, its tables are dropped and created again), the others do not connect at all
+os.environ['DATABASE_URL'] = os.environ.get('TEST_DATABASE_URL', 'postgresql:///test')
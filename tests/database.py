@@ -0,0 +1,147 @@
+import os
+import unittest
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from app.app import create_app
+from app.config import TestingConfig
+from app.engine import bank
+from app.extensions import db
+from app.models import Task, NumericQuestion, ScaleQuestion, SortQuestion, SortAnswer, CloseEndedQuestion, \
+    CloseEndedAnswer, User, TaskRun
+from app.models.Question import QuestionTaskAssociation
+from app.models.Task import TaskRunQuestion
+from app.serialization.Question import clear_rendered_questions
+
+TEST_DATABASE_URL = os.environ.get('TEST_DATABASE_URL')
+
+
+@contextmanager
+def count_statements():
+    """
+    Counts statements sent to the database in the block, an executemany counts as one statement (one round trip)
+    :return: list of the statements filled in the block
+    """
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+
+@unittest.skipUnless(TEST_DATABASE_URL, 'TEST_DATABASE_URL is not set')
+class DatabaseTestCase(unittest.TestCase):
+    """
+    Test case with the schema of the models created in the test database, every test starts with empty tables
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = create_app(TestingConfig)
+        cls.app_context = cls.app.app_context()
+        cls.app_context.push()
+
+        db.session.execute('DROP TABLE IF EXISTS question_history, user_skill_history CASCADE')
+        db.session.commit()
+        db.drop_all()
+        db.create_all()
+
+    @classmethod
+    def tearDownClass(cls):
+        db.session.remove()
+        cls.app_context.pop()
+
+    def setUp(self):
+        db.session.execute('TRUNCATE {0} RESTART IDENTITY CASCADE'.format(
+            ', '.join('"{0}"'.format(table.name) for table in db.metadata.sorted_tables)))
+        db.session.commit()
+
+        bank.clear_task_pools()
+        clear_rendered_questions()
+
+    def tearDown(self):
+        db.session.remove()
+
+    @staticmethod
+    def create_task(identifier: str = 'length_m', questions: int = 10) -> Task:
+        """
+        Creates a task with numeric questions (of different values, so they are not repeated)
+        :param identifier: identifier of the task
+        :param questions: number of the questions
+        :return: the committed task
+        """
+
+        task = Task(identifier=identifier, name=identifier)
+        db.session.add(task)
+        db.session.flush()
+
+        for i in range(questions):
+            question = NumericQuestion(from_value=i + 1, from_unit='m', to_unit='ft', difficulty=0, target_time=1,
+                                       enabled=True)
+            db.session.add(question)
+            db.session.flush()
+            db.session.add(QuestionTaskAssociation(question_id=question.id, task_id=task.id))
+
+        db.session.commit()
+        bank.bump_bank_version()
+        return task
+
+    @staticmethod
+    def create_task_of_all_types(identifier: str = 'length_m', questions: int = 2) -> Task:
+        """
+        Creates a task with questions of all types
+        :param identifier: identifier of the task
+        :param questions: number of the questions of each type
+        :return: the committed task
+        """
+
+        task = Task(identifier=identifier, name=identifier)
+        for i in range(questions):
+            task.questions.extend([
+                NumericQuestion(from_value=i + 1, from_unit='m', to_unit='ft', difficulty=0, target_time=1),
+                ScaleQuestion(scale_min=0, scale_max=10, from_value=i + 1, from_unit='lb', to_unit='kg',
+                              difficulty=0, target_time=1),
+                SortQuestion(dimensionality='length', order='asc', difficulty=0, target_time=1,
+                             answers=[SortAnswer(value=value, unit=unit, presented_pos=position)
+                                      for position, (value, unit) in enumerate([(36 + i, 'in'), (1, 'ft'), (12, 'm'),
+                                                                                (1, 'km')])]),
+                CloseEndedQuestion(question_en='bicycle {0}'.format(i), question_type='estimate_height', difficulty=0,
+                                   target_time=1, answers=[CloseEndedAnswer(value=3, unit='yd', correct=False),
+                                                           CloseEndedAnswer(value=1, unit='yd', correct=True)]),
+            ])
+
+        db.session.add(task)
+        db.session.commit()
+        bank.bump_bank_version()
+        return task
+
+    @staticmethod
+    def create_answered_taskrun(task: Task, user: User, answers: int) -> TaskRun:
+        """
+        Creates a TaskRun of the user with the first questions of the task answered
+        :param task: task of the TaskRun
+        :param user: user of the TaskRun
+        :param answers: number of answered questions
+        :return: the committed TaskRun
+        """
+
+        questions = NumericQuestion.query\
+            .join(QuestionTaskAssociation, QuestionTaskAssociation.question_id == NumericQuestion.id)\
+            .filter(QuestionTaskAssociation.task_id == task.id)\
+            .order_by(NumericQuestion.id)\
+            .limit(answers)\
+            .all()
+        taskrun = TaskRun(task_id=task.id, user_id=user.id)
+        taskrun.questions = [TaskRunQuestion(question_id=question.id, position=i, correct=i % 2 == 0, time=2.5,
+                                             hint_shown=False, answer={"answer": "1"})
+                             for i, question in enumerate(questions)]
+        db.session.add(taskrun)
+        db.session.commit()
+        return taskrun
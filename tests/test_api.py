@@ -0,0 +1,38 @@
+import json
+
+from app.extensions import db
+from app.serialization.Task import encode_taskrun, load_taskrun
+from tests.database import DatabaseTestCase, count_statements
+
+START_URL = '/api/start?user=user&task=length_m&metric=1&version=1.0&lang=en'
+
+
+class StartTest(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.create_task_of_all_types(questions=3)
+        self.client = self.app.test_client()
+
+        # the first request loads the pool of the task and the unit caches and creates the user
+        self.assertEqual(self.client.get(START_URL).status_code, 200)
+
+    def test_statements_per_start(self):
+        with count_statements() as statements:
+            response = self.client.get(START_URL)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.data.decode('utf-8'))['questions']), 5)
+        # user, task, skill, bank version, question stats, taskrun and its questions inserted, id refreshed after the
+        # commit, taskrun with the questions, sort answers, close-ended answers, skill of the speed feedback
+        self.assertEqual(len(statements), 12, '\n'.join(statements))
+
+    def test_statements_per_encoded_taskrun(self):
+        taskrun_id = json.loads(self.client.get(START_URL).data.decode('utf-8'))['id']
+        db.session.remove()
+
+        with count_statements() as statements:
+            encode_taskrun(load_taskrun(taskrun_id))
+
+        # taskrun with the questions, sort answers, close-ended answers, skill of the speed feedback
+        self.assertEqual(len(statements), 4, '\n'.join(statements))
@@ -0,0 +1,20 @@
+import unittest
+
+from app.engine import convert
+
+
+class ConvertManyTest(unittest.TestCase):
+
+    def test_same_as_converting_each_row(self):
+        rows = [('m', 5, 'cm'), ('km', 2, 'mi'), ('degC', -40, 'degF'), ('m', 0.0005, 'ft')]
+        converted = convert.convert_many(*zip(*rows))
+
+        self.assertEqual(list(converted), [convert.convert_value(*row) for row in rows])
+
+    def test_columns_of_different_length(self):
+        with self.assertRaises(ValueError):
+            convert.convert_many(['m', 'km'], [5, 2], ['cm', 'm', 'mm'])
+        with self.assertRaises(ValueError):
+            convert.convert_many(['m'], [5, 2], ['cm', 'm'])
+        with self.assertRaises(ValueError):
+            convert.to_normalized_many(['m', 'km'], [5])
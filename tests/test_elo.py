@@ -0,0 +1,105 @@
+import threading
+
+from sqlalchemy.orm import joinedload
+
+from app.engine import elo, elo_queue, replay
+from app.extensions import db
+from app.models import User, TaskRun, UserSkillHistory, QuestionHistory, EloUpdate, NumericQuestion
+from app.models.Task import TaskRunQuestion
+from tests.database import DatabaseTestCase, count_statements
+
+
+class UpdateManyTest(DatabaseTestCase):
+
+    def update(self, answers: int) -> list:
+        """
+        Applies a TaskRun with the number of answers of a new user
+        :return: statements of the update including its commit
+        """
+
+        task = self.create_task('length_m_{0}'.format(answers), questions=answers)
+        user = User(uuid='user{0}'.format(answers), skill_value=0)
+        db.session.add(user)
+        db.session.commit()
+        taskrun_id = self.create_answered_taskrun(task, user, answers).id
+        db.session.remove()
+
+        # loaded the same way as by the queue worker (app.engine.elo_queue.process_user)
+        question_runs = TaskRunQuestion.query\
+            .options(joinedload(TaskRunQuestion.taskrun).joinedload(TaskRun.user),
+                     joinedload(TaskRunQuestion.question))\
+            .filter(TaskRunQuestion.taskrun_id == taskrun_id)\
+            .order_by(TaskRunQuestion.position)\
+            .all()
+
+        with count_statements() as statements:
+            elo.update_many(question_runs, set(question_run.question_id for question_run in question_runs))
+            db.session.commit()
+
+        return statements
+
+    def test_statements_do_not_depend_on_answers(self):
+        for answers in (2, 8):
+            statements = self.update(answers)
+            # locked questions, questions answered before, skill, questions, user and skill updated, skill and
+            # question history inserted
+            self.assertEqual(len(statements), 8, '\n'.join(statements))
+
+    def test_history_row_per_answer(self):
+        statements = self.update(8)
+
+        self.assertEqual(UserSkillHistory.query.count(), 8)
+        self.assertEqual(QuestionHistory.query.count(), 8)
+        self.assertEqual(sum(1 for statement in statements if statement.startswith('INSERT INTO user_skill_history')),
+                         1)
+
+
+class ConcurrentUpdateTest(DatabaseTestCase):
+
+    USERS = 8
+    QUESTIONS = 5
+
+    def test_concurrent_updates_are_not_lost(self):
+        task = self.create_task(questions=self.QUESTIONS)
+        users = [User(uuid='user{0}'.format(i), skill_value=0) for i in range(self.USERS)]
+        db.session.add_all(users)
+        db.session.commit()
+        for user in users:
+            taskrun = self.create_answered_taskrun(task, user, self.QUESTIONS)
+            elo_queue.enqueue_answers(taskrun, [question_run.question_id for question_run in taskrun.questions])
+        db.session.commit()
+        user_ids = [user.id for user in users]
+        db.session.remove()
+
+        # answers of all users are applied at the same time, each user by its own thread and connection
+        barrier = threading.Barrier(self.USERS)
+        errors = []
+
+        def process(user_id: int):
+            with self.app.app_context():
+                try:
+                    barrier.wait()
+                    elo_queue.process_user(user_id)
+                except Exception as e:
+                    errors.append(e)
+                finally:
+                    db.session.remove()
+
+        threads = [threading.Thread(target=process, args=(user_id,)) for user_id in user_ids]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(EloUpdate.query.count(), 0)
+        # every answer was applied to the ratings of its question, none was overwritten, so they are the same as when
+        # the answers are applied one after another (the users answered the same way, so in any order)
+        log = replay.load_answer_log()
+        replayed = replay.replay(log)
+        for question in NumericQuestion.query:
+            self.assertEqual((question.answered_count, question.answered_users_count), (self.USERS, self.USERS))
+            index = log.question_index[question.id]
+            self.assertAlmostEqual(question.difficulty, replayed.difficulty[index])
+            self.assertAlmostEqual(question.target_time, replayed.target_time[index])
+        self.assertEqual(QuestionHistory.query.count(), self.USERS * self.QUESTIONS)
@@ -0,0 +1,74 @@
+import json
+
+from app.engine import elo_queue
+from app.extensions import db
+from app.models import EloUpdate, NumericQuestion, TaskRun, UserSkill
+from tests.database import DatabaseTestCase
+
+
+class EloQueueTest(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.create_task(questions=10)
+        self.client = self.app.test_client()
+        self.taskrun = json.loads(self.client.get('/api/start?user=user&task=length_m&metric=1').data.decode('utf-8'))
+        self.question_ids = [question['id'] for question in self.taskrun['questions']]
+
+    def send(self, answers: dict):
+        """
+        Sends answers of the TaskRun
+        :param answers: answers by question id as tuples (correct, time, answer)
+        """
+
+        response = self.client.post('/api/updateTaskRun', content_type='application/json', data=json.dumps({
+            "id": self.taskrun['id'], "aborted": False,
+            "questions": [{"id": question_id, "correct": correct, "time": time, "hintShown": False, "answer": answer}
+                          for question_id, (correct, time, answer) in answers.items()]}))
+        self.assertEqual(response.status_code, 200)
+        db.session.remove()
+
+    def answered_counts(self) -> list:
+        return [NumericQuestion.query.get(question_id).answered_count for question_id in self.question_ids]
+
+    def test_answer_sent_again_is_applied_once(self):
+        first, second = self.question_ids[:2]
+        self.send({first: (True, 2, {})})
+        self.send({first: (True, 2, {}), second: (None, 0, {})})
+        self.assertEqual([(event.question_id, event.error) for event in EloUpdate.query], [(first, None)])
+
+        self.assertEqual(elo_queue.process_pending(), 1)
+        self.send({first: (True, 2, {}), second: (False, 3, {})})
+        self.assertEqual(elo_queue.process_pending(), 1)
+        self.assertEqual(self.answered_counts()[:2], [1, 1])
+
+    def test_answer_without_time_is_counted_only(self):
+        first = self.question_ids[0]
+        self.send({first: (True, 0, {})})
+        self.assertEqual(elo_queue.process_pending(), 1)
+
+        self.assertEqual(self.answered_counts()[0], 1)
+        self.assertEqual(NumericQuestion.query.get(first).difficulty, 0)
+        self.assertEqual(UserSkill.query.one().value, 0)
+
+    def test_failed_answers_are_set_aside(self):
+        first, second = self.question_ids[:2]
+        self.send({first: (True, 2, {"answer": "nan?", "tolerance": "1", "correctAnswer": "2"})})
+        self.assertEqual(elo_queue.process_pending(), 0)
+        failed = EloUpdate.query.one()
+        self.assertIn('ValueError', failed.error)
+
+        # the answers of the user following the failed one are applied
+        self.send({second: (True, 2, {})})
+        self.assertEqual(elo_queue.process_pending(), 1)
+        self.assertEqual(self.answered_counts()[:2], [0, 1])
+        self.assertEqual(EloUpdate.query.count(), 1)
+
+        # the failed answer is applied once the cause is fixed
+        db.session.execute('UPDATE taskrun_question SET answer = \'{}\' WHERE taskrun_id = :taskrun_id '
+                           'AND question_id = :question_id', {"taskrun_id": self.taskrun['id'], "question_id": first})
+        db.session.commit()
+        self.assertEqual(elo_queue.retry_failed(), 1)
+        self.assertEqual(elo_queue.process_pending(), 1)
+        self.assertEqual(self.answered_counts()[:2], [1, 1])
+        self.assertTrue(TaskRun.query.get(self.taskrun['id']).completed)
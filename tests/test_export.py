@@ -0,0 +1,54 @@
+import json
+import tempfile
+
+import numpy as np
+
+from app.config import config
+from app.engine import export
+from app.extensions import db
+from tests.database import DatabaseTestCase
+
+
+class ExportTest(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.create_task(questions=10)
+        self.client = self.app.test_client()
+        self.directory = tempfile.TemporaryDirectory()
+
+        self.settle_time = config.EXPORT_SETTLE_TIME
+        config.EXPORT_SETTLE_TIME = 0
+
+    def tearDown(self):
+        config.EXPORT_SETTLE_TIME = self.settle_time
+        self.directory.cleanup()
+        super().tearDown()
+
+    def answer(self, taskrun: dict):
+        response = self.client.post('/api/updateTaskRun', content_type='application/json', data=json.dumps({
+            "id": taskrun['id'], "aborted": False,
+            "questions": [{"id": question['id'], "correct": True, "time": 2, "hintShown": False, "answer": {}}
+                          for question in taskrun['questions']]}))
+        self.assertEqual(response.status_code, 200)
+        db.session.remove()
+
+    def test_games_answered_after_export_are_exported_again(self):
+        taskruns = json.loads(self.client.get('/api/startBatch?user=user&task=length_m&metric=1&count=2')
+                              .data.decode('utf-8'))['taskruns']
+        db.session.remove()
+        self.answer(taskruns[0])
+        first = export.export_answers(self.directory.name)
+
+        # the second game of the batch is played after the first export
+        self.answer(taskruns[1])
+        second = export.export_answers(self.directory.name)
+        self.assertEqual(export.export_answers(self.directory.name), 0)
+
+        rows = [len(taskrun['questions']) for taskrun in taskruns]
+        self.assertEqual((first, second), (sum(rows), rows[1]))
+
+        columns = export.load_export(self.directory.name)
+        self.assertEqual(sorted(columns['taskrun_id'].tolist()),
+                         sorted([taskruns[0]['id']] * rows[0] + [taskruns[1]['id']] * rows[1]))
+        self.assertTrue(np.all(columns['correct'] == 1))
@@ -0,0 +1,53 @@
+import math
+import random
+import unittest
+from collections import Counter
+
+from app.engine.generator import QuestionPool, select_questions, select_questions_sorting
+from app.models import Task, NumericQuestion, ScaleQuestion
+
+RUNS = 16000
+
+
+def tied_questions(types: list, difficulties: list = None) -> list:
+    """
+    Builds questions of the types (built without the database), of equal priority unless difficulties are given
+    """
+
+    task = Task(identifier='length_m')
+    difficulties = difficulties or [0] * len(types)
+    return [question_class(id=i + 1, difficulty=difficulty, target_time=0, tasks=[task])
+            for i, (question_class, difficulty) in enumerate(zip(types, difficulties))]
+
+
+class SelectQuestionsTest(unittest.TestCase):
+
+    def assertSameDistribution(self, questions: list, number: int):
+        """
+        Compares frequencies of the selected sequences of question ids with the selection by sorting
+        """
+
+        random.seed(0)
+        pool = QuestionPool(questions)
+        selected = Counter(tuple(question.id for question in select_questions(pool, number, {}, {}, 0, 0))
+                           for i in range(RUNS))
+        expected = Counter(tuple(question.id for question in select_questions_sorting(questions, number, {}, {}, 0, 0))
+                           for i in range(RUNS))
+
+        self.assertEqual(set(selected), set(expected))
+        for sequence, count in expected.items():
+            # five standard deviations of the difference of the counts
+            self.assertLess(abs(selected[sequence] - count), 5 * math.sqrt(2 * count), sequence)
+
+    def test_ties_between_types(self):
+        # the third pick is not biased towards the type of the first one
+        self.assertSameDistribution(tied_questions([NumericQuestion, NumericQuestion, ScaleQuestion, ScaleQuestion]), 3)
+
+    def test_ties_weighted_by_questions_of_types(self):
+        # the first pick is one of the four questions, not one of the two types
+        self.assertSameDistribution(tied_questions([NumericQuestion, NumericQuestion, NumericQuestion, ScaleQuestion]),
+                                    2)
+
+    def test_ties_among_different_priorities(self):
+        self.assertSameDistribution(tied_questions([NumericQuestion, NumericQuestion, NumericQuestion, ScaleQuestion,
+                                                    ScaleQuestion, ScaleQuestion], [0, 0, 1, 0, 1, 1]), 4)
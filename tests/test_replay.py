@@ -0,0 +1,77 @@
+import os
+import tempfile
+
+from app.engine import elo_queue, replay, stats
+from app.extensions import db
+from app.models import User, EloUpdate, NumericQuestion
+from tests.database import DatabaseTestCase
+
+
+class WriteResultTest(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.task = self.create_task(questions=4)
+        self.user = User(uuid='user', skill_value=0)
+        db.session.add(self.user)
+        db.session.commit()
+
+    def answer(self, answers: int = 4, time: float = 2.5):
+        """
+        Stores and queues a TaskRun of the user with answers of the first questions of the task
+        """
+
+        taskrun = self.create_answered_taskrun(self.task, self.user, answers)
+        db.session.execute('UPDATE taskrun_question SET time = :time WHERE taskrun_id = :taskrun_id',
+                           {"time": time, "taskrun_id": taskrun.id})
+        elo_queue.enqueue_answers(taskrun, [question_run.question_id for question_run in taskrun.questions])
+        db.session.commit()
+
+    def answered_counts(self) -> list:
+        return [(question.answered_count, question.answered_users_count)
+                for question in NumericQuestion.query.order_by(NumericQuestion.id)]
+
+    def test_queued_answers_are_removed(self):
+        self.answer()
+        log = replay.load_answer_log()
+        replay.write_result(log, replay.replay(log))
+
+        self.assertEqual(EloUpdate.query.count(), 0)
+        self.assertEqual(elo_queue.process_pending(), 0)
+        self.assertEqual(self.answered_counts(), [(1, 1)] * 4)
+
+    def test_answers_without_time_are_counted(self):
+        self.answer(time=0)
+        self.answer(answers=2)
+        log = replay.load_answer_log()
+        self.assertEqual((len(log), log.skipped), (2, 4))
+        # the answers without time were the first attempts of the user
+        self.assertEqual(list(log.first), [0, 0])
+
+        replay.write_result(log, replay.replay(log))
+        replayed = self.answered_counts()
+        stats.rebuild_answer_counts()
+        self.assertEqual(replayed, self.answered_counts())
+        self.assertEqual(replayed, [(2, 1), (2, 1), (1, 1), (1, 1)])
+
+    def test_answers_stored_after_loading_are_not_overwritten(self):
+        self.answer()
+        log = replay.load_answer_log()
+        self.answer(answers=1)
+
+        with self.assertRaises(ValueError):
+            replay.write_result(log, replay.replay(log))
+        self.assertEqual(EloUpdate.query.count(), 5)
+        self.assertEqual(self.answered_counts(), [(0, 0)] * 4)
+
+    def test_saved_log_keeps_answered_questions(self):
+        self.answer(answers=2, time=0)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'answers.npz')
+            replay.load_answer_log().save(path)
+            loaded = replay.AnswerLog.load(path)
+
+        question_id = NumericQuestion.query.order_by(NumericQuestion.id).first().id
+        loaded.append(self.user.id, self.task.id, question_id, 2.5, 1)
+        self.assertEqual(list(loaded.first), [0])
+        self.assertEqual(loaded.answered_counts, [2, 1, 0, 0])
@@ -0,0 +1,124 @@
+import json
+import random
+import unittest
+
+from app.app import create_app
+from app.config import TestingConfig
+from app.models import NumericQuestion, ScaleQuestion, SortQuestion, SortAnswer, CloseEndedQuestion, \
+    CloseEndedAnswer, CurrencyQuestion, ScaleHint, TextHint, TaskRun
+from app.models.Task import TaskRunQuestion
+from app.serialization.Hint import task_schema_serialization_disambiguation, hint_serializers, dump_hint
+from app.serialization.Question import question_schema_serialization_disambiguation, question_serializers, \
+    dump_question, encode_question, clear_rendered_questions
+from app.serialization.Task import taskrun_schema, dump_taskrun, encode_taskrun
+
+# seeds of the random hints and orders of answers, both serializers of a question get the same random sequence
+SEEDS = range(8)
+
+
+def golden_questions() -> list:
+    """
+    Questions of all types with the variants their schemas serialize differently, built without the database
+    """
+
+    questions = [
+        NumericQuestion(id=1, target_time=0, from_value=5, from_unit="m", to_unit="ft", image_name=None),
+        NumericQuestion(id=2, target_time=1.5, from_value=2.5, from_unit="kg", to_unit="lb", image_name="scale",
+                        stored_to_value=5.51, from_unit_name="kilogram", to_unit_name="pound"),
+        NumericQuestion(id=3, target_time=0, from_value=20, from_unit="degC", to_unit="degF", image_name=None),
+        ScaleQuestion(id=4, target_time=0, scale_min=0, scale_max=10, from_value=6, from_unit="lb", to_unit="kg"),
+        ScaleQuestion(id=5, target_time=2, scale_min=-5, scale_max=5, from_value=1, from_unit="mi", to_unit="km",
+                      stored_to_value=1.61, from_unit_name="mile", to_unit_name="kilometer"),
+        SortQuestion(id=6, target_time=0, dimensionality="length", order="asc",
+                     answers=[SortAnswer(value=value, unit=unit, presented_pos=i)
+                              for i, (value, unit) in enumerate([(36, "in"), (1, "ft"), (12, "m"), (1, "km")])]),
+        SortQuestion(id=7, target_time=1, dimensionality="mass", order="desc",
+                     answers=[SortAnswer(value=value, unit=unit, presented_pos=i, stored_normalized_value=normalized,
+                                         title=title)
+                              for i, (value, unit, normalized, title) in enumerate([
+                                  (1, "kg", 1, "1 kilogram"), (3, "lb", 1.36, "3 pounds"), (500, "g", 0.5, "500 grams")
+                              ])]),
+        CloseEndedQuestion(id=8, target_time=0, question_en="bicycle", question_type="estimate_height", image_name=None,
+                           answers=[CloseEndedAnswer(value=3, unit="yd", correct=False),
+                                    CloseEndedAnswer(value=10, unit="in", correct=False),
+                                    CloseEndedAnswer(value=1, unit="yd", correct=True)]),
+        CloseEndedQuestion(id=9, target_time=0.5, question_en="car", question_type="estimate_length",
+                           image_name="car", answers=[CloseEndedAnswer(value=4, unit="m", correct=True, title="4 m"),
+                                                      CloseEndedAnswer(value=2, unit="m", correct=False)]),
+        CurrencyQuestion(id=10, target_time=0, from_value=10, from_unit="EUR", to_unit="eur"),
+    ]
+    for question in questions:
+        if isinstance(question, SortQuestion):
+            question.init_on_load()
+    return questions
+
+
+class GoldenSerializationTest(unittest.TestCase):
+    """
+    Compiled serializers and encoders compared with the marshmallow schemas they replace
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = create_app(TestingConfig)
+
+    def setUp(self):
+        # image paths of questions are generated by url_for
+        self.request_context = self.app.test_request_context()
+        self.request_context.push()
+        clear_rendered_questions()
+
+    def tearDown(self):
+        clear_rendered_questions()
+        self.request_context.pop()
+
+    def assertSameOutput(self, expected, actual, seed: int):
+        """
+        Calls both serializers with the same random sequence
+        :param expected: serializer returning marshmallow MarshalResult
+        :param actual: serializer returning the data
+        """
+
+        random.seed(seed)
+        result = expected()
+        random.seed(seed)
+        self.assertEqual(result.errors, {})
+        self.assertEqual(actual(), result.data)
+
+    def test_questions_of_all_types(self):
+        questions = golden_questions()
+        self.assertEqual(set(question.__class__ for question in questions), set(question_serializers))
+
+        for question in questions:
+            schema = question_schema_serialization_disambiguation(question, None)
+            for seed in SEEDS:
+                with self.subTest(question=question.id, seed=seed):
+                    self.assertSameOutput(lambda: schema.dump(question),
+                                          lambda: question_serializers[question.__class__](question), seed)
+                    # static parts are cached by the first call
+                    self.assertSameOutput(lambda: schema.dump(question), lambda: dump_question(question), seed)
+                    self.assertSameOutput(lambda: schema.dump(question),
+                                          lambda: json.loads(encode_question(question).decode('utf-8')), seed)
+
+    def test_hints_of_all_types(self):
+        hints = [ScaleHint.create_unit_hint("m", "ft"), ScaleHint.create_unit_hint("ft", "m"),
+                 TextHint.create_unit_hint("kg", "lb"), TextHint.create_unit_hint("mm", "km")]
+        self.assertEqual(set(hint.__class__ for hint in hints), set(hint_serializers))
+
+        for hint in hints:
+            schema = task_schema_serialization_disambiguation(hint, None)
+            with self.subTest(hint=hint):
+                self.assertSameOutput(lambda: schema.dump(hint), lambda: hint_serializers[hint.__class__](hint), 0)
+                self.assertSameOutput(lambda: schema.dump(hint), lambda: dump_hint(hint), 0)
+
+    def test_taskrun(self):
+        taskrun = TaskRun(id=1, questions=[TaskRunQuestion(question=question, position=i)
+                                           for i, question in enumerate(golden_questions())])
+        # the speed feedback is looked up in the database otherwise
+        taskrun.allow_speed_feedback = lambda: True
+
+        for seed in SEEDS:
+            with self.subTest(seed=seed):
+                self.assertSameOutput(lambda: taskrun_schema.dump(taskrun), lambda: dump_taskrun(taskrun), seed)
+                self.assertSameOutput(lambda: taskrun_schema.dump(taskrun),
+                                      lambda: json.loads(encode_taskrun(taskrun).decode('utf-8')), seed)